@@ -1,6 +1,7 @@
 from flask import Flask
 from secrets import token_hex
 from ava_rememberme.controller import create_celery
+from ava_rememberme.tracing import instrumentApp, setupTracing
 from flask_migrate import Migrate
 from flask_babel import Babel
 
@@ -8,6 +9,9 @@ app = Flask(__name__)
 app.config['SECRET_KEY'] = token_hex(32)
 app.config['SERVER_NAME'] = 'localhost:5000'
 
+setupTracing()
+instrumentApp(app)
+
 celery = create_celery(app)
 babel = Babel(app, default_locale='br')
 
@@ -0,0 +1,15 @@
+import redis
+
+from ava_rememberme import celery
+
+_client = None
+
+
+def getRedis():
+    """Returns a Redis client connected to the Celery broker, shared by the
+    whole process.
+    """
+    global _client
+    if _client is None:
+        _client = redis.Redis.from_url(celery.conf.broker_url)
+    return _client
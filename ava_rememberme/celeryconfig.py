@@ -1,5 +1,7 @@
 from celery.schedules import crontab
 
+from ava_rememberme.scheduling import beatSchedule
+
 # Broker settings.
 broker_url = 'redis://localhost'
 
@@ -9,10 +11,22 @@ broker_url = 'redis://localhost'
 # Using the database to store task state and results.
 result_backend = 'redis://'
 
-# Using pickle because it supports serializing datetime objects
-accept_content = ['pickle']
-task_serializer = 'pickle'
-result_serializer = 'pickle'
+# msgpack with datetimes and compact assignment records, see
+# ava_rememberme.serialization. Pickle is not accepted, so nothing read from
+# Redis is executed
+accept_content = ['avapack', 'json']
+task_serializer = 'avapack'
+result_serializer = 'avapack'
+
+# Redis emulates priorities with one list per step, 0 is served first. Only
+# refreshes set one, see ava_rememberme.priority
+broker_transport_options = {
+    'priority_steps': list(range(10)),
+    'sep': ':',
+    'queue_order_strategy': 'priority'
+}
+# prefetched messages would skip the priority order
+worker_prefetch_multiplier = 1
 
 # Timezone
 timezone = 'America/Sao_Paulo'
@@ -21,8 +35,9 @@ timezone = 'America/Sao_Paulo'
 Refresh disciplines: Once per month should be sufficient for checking
 if a user has a new discipline. Note that this is very rare.
 
-Refresh assignments: Once per week or Once in two weeks to save some
-processing.
+Refresh assignments: Once per day for every user, in shards spread over
+the refresh windows so AVA and the workers see a flat load. See
+ava_rememberme.scheduling.
 
 Check due dates: This should happen once per day, since it is the main
 pourpose of this app. :)
@@ -35,5 +50,14 @@ beat_schedule = {
         'ava_rememberme.tasks.databaseRefreshDisciplines',
         'schedule':
         crontab(minute='0', hour='3', day_of_month='1-7', day_of_week='0')
+    },
+    'send-due-dates': {
+        'task': 'ava_rememberme.tasks.databaseSendDueDates',
+        'schedule': crontab(minute='0', hour='8')
     }
 }
+beat_schedule.update(
+    beatSchedule('refresh-assignments',
+                 'ava_rememberme.tasks.databaseRefreshShards'))
+beat_schedule.update(
+    beatSchedule('refresh-urgent', 'ava_rememberme.tasks.databaseRefreshUrgent'))
@@ -1,7 +1,10 @@
 from celery import Celery
 
+from ava_rememberme.serialization import registerSerializer
+
 
 def create_celery(app):
+    registerSerializer()
     celery = Celery(app.name)
     celery.config_from_object('ava_rememberme.celeryconfig')
 
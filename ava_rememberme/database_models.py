@@ -3,14 +3,15 @@ import datetime
 
 from passlib.hash import pbkdf2_sha256
 from sqlalchemy import (JSON, Boolean, Column, DateTime, ForeignKey, Integer,
-                        String, Table, Text)
+                        String, Table, Text, and_, func, or_)
 from sqlalchemy.ext.associationproxy import association_proxy
 from sqlalchemy.orm import backref, relationship
 from sqlalchemy.schema import Index
 from sqlalchemy.dialects.postgresql import insert
 
-from ava_rememberme.database import Base
+from ava_rememberme.database import Base, db_session
 from ava_rememberme.exceptions import AssignmentExpired
+from ava_rememberme.scheduling import shardExpression
 
 
 class Users(Base):
@@ -59,6 +60,28 @@ class Users(Base):
     def get():
         return Users.query.all()
 
+    @staticmethod
+    def getByIds(userIds):
+        return Users.query.filter(Users.user_id.in_(userIds)).all()
+
+    @staticmethod
+    def countActive():
+        return Users.query.filter(Users.active.is_(True)).count()
+
+    @staticmethod
+    def getShard(shard, shards):
+        """Returns active users of a refresh shard, hashing ids in SQL the
+        same way scheduling.shardOf does.
+
+        :param shard: shard number, from 0 to shards - 1.
+        :param shards: total number of shards.
+        :rtype: list
+
+        """
+        return Users.query.filter(
+            Users.active.is_(True),
+            shardExpression(Users.user_id, shards) == shard).all()
+
     @staticmethod
     def hashString(string):
         return pbkdf2_sha256.hash(string)
@@ -106,6 +129,51 @@ class Users(Base):
 
         return materias
 
+    @staticmethod
+    def getReminders(daysToRemember, now=None):
+        """Returns every active user with open assignments due in one of the
+        given number of days. The day windows are tested by PostgreSQL on the
+        indexed Due_Date column, so only matching rows are loaded.
+
+        :param daysToRemember: list of days left that trigger a reminder.
+        :param now: reference datetime, defaults to now.
+        :returns: list of (user, materias) tuples, where materias maps each
+        discipline name to a list of dicts with keys: tipo, nome, dias.
+        :rtype: list
+
+        """
+        if now is None:
+            now = datetime.datetime.now()
+
+        rows = db_session.query(
+            Users, Assignments.name, Assignments.type, Assignments.dueDate,
+            Disciplines.name).join(
+                Users_Assignments,
+                Users_Assignments.user_id == Users.user_id).join(
+                    Assignments, Assignments.assignment_id ==
+                    Users_Assignments.assignment_id).outerjoin(
+                        Disciplines, Disciplines.discipline_id ==
+                        Assignments.discipline_id).filter(
+                            Users.active.is_(True),
+                            Users_Assignments.status == 1,
+                            Assignments.dueIn(daysToRemember, now)).order_by(
+                                Users.user_id, Assignments.dueDate)
+
+        reminders = collections.OrderedDict()
+        for user, name, type, dueDate, disciplineName in rows:
+            if user.user_id not in reminders:
+                reminders[user.user_id] = (user,
+                                           collections.defaultdict(list))
+
+            reminders[user.user_id][1][disciplineName].append({
+                'tipo': type,
+                'nome': name,
+                'dias': (dueDate - now).days
+            })
+
+        return [(user, dict(materias))
+                for user, materias in reminders.values()]
+
 
 users_disciplines = Table(
     'Users_Disciplines', Base.metadata,
@@ -138,6 +206,59 @@ class Users_Assignments(Base):
         return u'User ID: {}, Assignment ID: {}, Status: {}'.format(
             self.user_id, self.assignment_id, self.status)
 
+    @staticmethod
+    def bulkUpsert(rows):
+        """Inserts user assignment links, updating the status of the ones
+        that already exist, with one statement per batch.
+
+        :param rows: iterable of (user_id, assignment_id, status) tuples,
+        status already formatted.
+
+        """
+        table = Users_Assignments.__table__
+
+        # a statement can't touch the same row twice
+        unique = {(row[0], row[1]): row[2] for row in rows}
+        values = [{
+            'user_id': key[0],
+            'assignment_id': key[1],
+            'Status': status
+        } for key, status in unique.items()]
+
+        for batch in _batches(values):
+            statement = insert(table).values(batch)
+            statement = statement.on_conflict_do_update(
+                index_elements=[table.c.user_id, table.c.assignment_id],
+                set_={'Status': statement.excluded.Status})
+            db_session.execute(statement)
+
+    @staticmethod
+    def openWork(userIds, now=None):
+        """Counts open assignments not yet due of each user, with a single
+        grouped query.
+
+        :param userIds: users to look up.
+        :param now: reference datetime, defaults to now.
+        :returns: dict mapping user_id to (open count, nearest due date),
+        users without open work are left out.
+        :rtype: dict
+
+        """
+        if now is None:
+            now = datetime.datetime.now()
+
+        rows = db_session.query(
+            Users_Assignments.user_id, func.count(),
+            func.min(Assignments.dueDate)).join(
+                Assignments, Assignments.assignment_id ==
+                Users_Assignments.assignment_id).filter(
+                    Users_Assignments.user_id.in_(userIds),
+                    Users_Assignments.status == 1,
+                    Assignments.dueDate >= now).group_by(
+                        Users_Assignments.user_id)
+
+        return {userId: (count, nearest) for userId, count, nearest in rows}
+
     @staticmethod
     # 1 = aberta, 2 = encerrada, 3 = agendada, 4 = corrigida, 5 = ?
     def formatStatus(unformatedStatus):
@@ -190,13 +311,13 @@ class Assignments(Base):
     discipline_id = Column('DisciplineID', Integer,
                            ForeignKey('Disciplines.DisciplineID'))
     name = Column('Name', String(80))
-    codigo = Column('Codigo', Integer, index=True)
+    codigo = Column('Codigo', Integer, index=True, unique=True)
 
     # tipo = questionario ou forum
     type = Column('Type', String(20))
 
     # time in days before assignment ends
-    dueDate = Column('Due_Date', DateTime)
+    dueDate = Column('Due_Date', DateTime, index=True)
 
     def __init__(self, name, codigo, discipline_id, type, dueDate):
         "docstring"
@@ -210,10 +331,68 @@ class Assignments(Base):
     def get():
         return Assignments.query.all()
 
+    @staticmethod
+    def bulkUpsert(rows):
+        """Inserts assignments, updating name, type, due date and discipline
+        of the ones already known by Codigo, with one statement per batch.
+
+        :param rows: iterable of dicts with name, codigo, discipline_id,
+        type and dueDate.
+        :returns: dictionary mapping every codigo to its assignment_id.
+        :rtype: dict
+
+        """
+        table = Assignments.__table__
+
+        # a statement can't touch the same row twice
+        unique = {int(row['codigo']): row for row in rows}
+        values = [{
+            'Name': row['name'],
+            'Codigo': codigo,
+            'DisciplineID': row['discipline_id'],
+            'Type': row['type'],
+            'Due_Date': row['dueDate']
+        } for codigo, row in unique.items()]
+
+        assignmentIds = {}
+        for batch in _batches(values):
+            statement = insert(table).values(batch)
+            statement = statement.on_conflict_do_update(
+                index_elements=[table.c.Codigo],
+                set_={
+                    'Name': statement.excluded.Name,
+                    'Type': statement.excluded.Type,
+                    'Due_Date': statement.excluded.Due_Date,
+                    'DisciplineID': func.coalesce(
+                        statement.excluded.DisciplineID,
+                        table.c.DisciplineID)
+                }).returning(table.c.assignment_id, table.c.Codigo)
+
+            for assignmentId, codigo in db_session.execute(statement):
+                assignmentIds[codigo] = assignmentId
+
+        return assignmentIds
+
     def __repr__(self):
         return u'{} ID {}, Data limite: {}'.format(
             self.type, self.assignment_id, self.dueDate)
 
+    @staticmethod
+    def dueIn(days, now):
+        """SQL predicate matching assignments whose daysLeft, at now, is one
+        of days. Each day becomes a half-open Due_Date range, so the
+        Due_Date index can be used and expired rows never match.
+
+        :param days: list of days left, all greater than zero.
+        :param now: reference datetime.
+
+        """
+        return or_(*[
+            and_(Assignments.dueDate >= now + datetime.timedelta(days=day),
+                 Assignments.dueDate < now + datetime.timedelta(days=day + 1))
+            for day in days
+        ])
+
     @property
     def daysLeft(self):
         remainingDays = self.dueDate - datetime.datetime.now()
@@ -222,6 +401,14 @@ class Assignments(Base):
         return remainingDays.days
 
 
+def _batches(values, size=2000):
+    """Splits multi-row VALUES lists, keeping statements below PostgreSQL
+    bind parameter limit.
+    """
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
 class Profiles(Base):
     __tablename__ = 'Profiles'
 
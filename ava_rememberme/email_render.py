@@ -0,0 +1,145 @@
+from itsdangerous import URLSafeSerializer, URLSafeTimedSerializer
+from jinja2 import Environment, select_autoescape
+from markupsafe import Markup, escape
+
+CONFIRMATION_TEMPLATE = 'email/confirmation.html'
+ASSIGNMENTS_TEMPLATE = 'email/assignments.html'
+MATERIAS_TEMPLATE = 'email/assignments_materias.html'
+
+# fields of the due dates email that change from user to user
+DUE_DATES_FIELDS = ('userName', 'pendentes', 'atividades', 'action_url',
+                    'materias')
+
+
+class EmailRenderer():
+    "Renders email bodies from templates compiled once, outside of any"
+    "request context"
+
+    def __init__(self, app):
+        "docstring"
+        self.env = Environment(
+            loader=app.jinja_loader,
+            extensions=['jinja2.ext.i18n'],
+            autoescape=select_autoescape(['html']),
+            auto_reload=False)
+        self.env.install_null_translations(newstyle=True)
+        self.env.globals['url_for'] = self.urlFor
+
+        # external urls are built from SERVER_NAME, as url_for would inside
+        # a request to it
+        self.urls = app.url_map.bind(
+            app.config['SERVER_NAME'],
+            url_scheme=app.config.get('PREFERRED_URL_SCHEME', 'http'))
+
+        self.confirmationTemplate = self.env.get_template(
+            CONFIRMATION_TEMPLATE)
+        self.assignmentsTemplate = self.env.get_template(ASSIGNMENTS_TEMPLATE)
+        self.materiasTemplate = self.env.get_template(MATERIAS_TEMPLATE)
+
+    def urlFor(self, endpoint, _external=True, **values):
+        """url_for replacement for templates, urls are always external."""
+        return self.urls.build(endpoint, values, force_external=True)
+
+    def renderConfirmation(self, userEmail, userName, secret):
+        """Renders sign-up confirmation email.
+
+        :returns: html string
+        :rtype: str
+
+        """
+        token = URLSafeTimedSerializer(
+            secret, salt='user-confirmation').dumps(userEmail)
+        return self.confirmationTemplate.render(
+            userName=userName, action_url=self.urlFor('confirm', token=token))
+
+    def renderNoMoreAssignments(self, userName):
+        """Renders email sent when user has no pending assignments.
+
+        :returns: html string
+        :rtype: str
+
+        """
+        return self.confirmationTemplate.render(
+            userName=userName, action_url=self.urlFor('index'))
+
+    def renderDueDates(self, reminders, secret):
+        """Renders due dates email of many users at once.
+
+        :param reminders: list of (userEmail, userName, materias) tuples.
+        :param secret: flask config secret
+        :returns: dict mapping each email to a dict with subject and html.
+        :rtype: dict
+
+        """
+        serializer = URLSafeSerializer(secret, salt='user-unsubscribe')
+
+        rendered = {}
+        for userEmail, userName, materias in reminders:
+            fields = self._dueDatesFields(serializer, userEmail, userName,
+                                          materias)
+            rendered[userEmail] = {
+                'subject': fields.pop('subject'),
+                'html': self.assignmentsTemplate.render(**fields)
+            }
+
+        return rendered
+
+    def renderDueDatesBatch(self, reminders, secret):
+        """Renders due dates email for a Mailgun batch: the template once,
+        with %recipient.<field>% placeholders, and the fields of each user.
+
+        :param reminders: list of (userEmail, userName, materias) tuples.
+        :param secret: flask config secret
+        :returns: html, and dict mapping each email to its fields, subject
+        included.
+        :rtype: tuple
+
+        """
+        serializer = URLSafeSerializer(secret, salt='user-unsubscribe')
+
+        html = self.assignmentsTemplate.render(**{
+            field: Markup('%recipient.{}%'.format(field))
+            for field in DUE_DATES_FIELDS
+        })
+        recipientVariables = {
+            userEmail: {
+                field: str(value)
+                for field, value in self._dueDatesFields(
+                    serializer, userEmail, userName, materias).items()
+            }
+            for userEmail, userName, materias in reminders
+        }
+
+        return html, recipientVariables
+
+    def _dueDatesFields(self, serializer, userEmail, userName, materias):
+        """Fields of a user due dates email, html escaped but the plain text
+        subject.
+        """
+        count = len(materias)
+        atividades = '{} atividade{}'.format(count, '' if count == 1 else 's')
+        pendentes = '{} pendente{}'.format(atividades,
+                                           '' if count == 1 else 's')
+        return {
+            'subject': 'Você possui {}.'.format(pendentes),
+            'userName': escape(userName),
+            'pendentes': escape(pendentes),
+            'atividades': escape(atividades),
+            'action_url': escape(
+                self.urlFor('unsubscribe', token=serializer.dumps(userEmail))),
+            'materias': Markup(self.materiasTemplate.render(materias=materias))
+        }
+
+
+_renderer = None
+
+
+def getRenderer():
+    """Returns the EmailRenderer of this process, compiling templates on the
+    first call.
+    """
+    global _renderer
+    if _renderer is None:
+        from ava_rememberme import app
+        _renderer = EmailRenderer(app)
+    return _renderer
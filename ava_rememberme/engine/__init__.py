@@ -1,76 +1,367 @@
 "-*- coding: utf-8 -*-"
 
-import datetime
 import logging
-import re
+import os
+import shutil
+import tempfile
+import threading
+import time
 import traceback
-from contextlib import ContextDecorator
+from contextlib import contextmanager
 
-from bs4 import BeautifulSoup
 from selenium import webdriver
-from selenium.common.exceptions import TimeoutException, WebDriverException
-from selenium.webdriver.common.by import By
+from selenium.common.exceptions import (StaleElementReferenceException,
+                                        TimeoutException, WebDriverException)
 from selenium.webdriver.common.keys import Keys
 from selenium.webdriver.firefox.options import Options
 from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.support.ui import WebDriverWait
 
-from .exceptions import (DriverInstanceError, LoginError, ScraperError,
+from . import parsers
+from .base import AVA_BASE_URL, BaseScraper
+from .exceptions import (DriverInstanceError, LoginError, UnreachableError,
                          WrongPageError)
+from .instrumentation import step
+from .waits import waitPageReady, waitUntil
+
+
+# resources a scraper never needs, blocked by the lean profile
+LEAN_BLOCKED_URLS = [
+    '*.png', '*.jpg', '*.jpeg', '*.gif', '*.svg', '*.ico', '*.webp', '*.css',
+    '*.woff', '*.woff2', '*.ttf', '*.eot', '*.otf', '*.mp4', '*.mp3',
+    '*fonts.googleapis.com*', '*fonts.gstatic.com*', '*google-analytics.com*',
+    '*googletagmanager.com*', '*doubleclick.net*', '*facebook.net*',
+    '*facebook.com*', '*hotjar.com*'
+]
+# disk caches of the lean profile, one per pool slot of each process:
+# <pid>-<slot>
+LEAN_CACHE_DIR = os.path.join(tempfile.gettempdir(), 'ava-scraper-cache')
 
 
 class AVAscraperFactory:
     """
-    Factory with pool of free to work AVAscraper instances.
+    Thread-safe pool of reusable AVAscraper instances.
+
+    Browsers are started lazily up to _MAX_INSTANCES per worker process and
+    handed back to the pool when the scraper context exits, so the cost of
+    starting Chrome is paid once per worker instead of once per user.
+
+    User refreshes across the fleet take a lease first, sized by the
+    AIMDController given to configure.
     """
     _values = list()
+    _usedSlots = set()
+    _lock = threading.Condition()
     _CURRENT_INSTANCES = 0
     _MAX_INSTANCES = 1
+    _MAX_USES = 50
+    _CHECKOUT_TIMEOUT = 120
+    _LEAN = True
+    _GUARD = None
+    _CONTROLLER = None
+    _PRUNED = False
 
     @classmethod
-    def getInstance(cls, debug=False):
-        """Returns instance of AVAscraper.
+    def configure(cls,
+                  maxInstances=None,
+                  maxUses=None,
+                  timeout=None,
+                  lean=None,
+                  guard=None,
+                  controller=None):
+        """Changes pool limits.
+
+        :param maxInstances: maximum number of live browsers.
+        :param maxUses: number of checkouts before a browser is recycled.
+        :param timeout: seconds to wait for a free browser on checkout.
+        :param lean: start new browsers with the lean profile.
+        :param guard: AVAGuard given to every checked out instance.
+        :param controller: AIMDController behind lease, also told how
+        every request of checked out instances went.
+
+        """
+        with cls._lock:
+            if lean is not None:
+                cls._LEAN = lean
+            if guard is not None:
+                cls._GUARD = guard
+            if controller is not None:
+                cls._CONTROLLER = controller
+            if maxInstances is not None:
+                cls._MAX_INSTANCES = maxInstances
+            if maxUses is not None:
+                cls._MAX_USES = maxUses
+            if timeout is not None:
+                cls._CHECKOUT_TIMEOUT = timeout
+            cls._lock.notify_all()
+
+    @classmethod
+    @contextmanager
+    def lease(cls, timeout=None):
+        """Holds one of the fleet slots for a user refresh, whichever
+        scraper does it. Without a controller every refresh goes ahead.
+
+        :param timeout: seconds to wait for a slot, None waits forever.
+        :returns: the AIMDController, for scrapers to report to.
+        :raises DriverInstanceError: no slot was freed in time.
 
+        """
+        controller = cls._CONTROLLER
+        if controller is None:
+            yield None
+            return
+
+        lease = controller.acquire(timeout)
+        if lease is None:
+            raise DriverInstanceError(
+                u'Limite de acessos ao AVA atingido após {} segundos.'.format(
+                    timeout))
+        try:
+            yield controller
+        finally:
+            controller.release(lease)
+
+    @classmethod
+    def getInstance(cls,
+                    uninove_ra=None,
+                    uninove_senha=None,
+                    debug=False,
+                    timeout=None):
+        """Checks out a healthy AVAscraper from the pool, starting a new
+        browser if the pool is empty and below its limit.
+
+        :param uninove_ra: user RA the instance will scrape for.
+        :param uninove_senha: user AVA password.
+        :param timeout: seconds to wait for a free instance.
         :returns: AVAscraper instance.
 
         """
-        if len(cls.
-               _values) == 0 and cls._CURRENT_INSTANCES < cls._MAX_INSTANCES:
-            cls._values.append(AVAscraper(debug=debug))
-            cls._CURRENT_INSTANCES += 1
+        if timeout is None:
+            timeout = cls._CHECKOUT_TIMEOUT
+        deadline = time.monotonic() + timeout
+
+        instance = None
+        slot = None
+        dead = []
+        with cls._lock:
+            while instance is None:
+                while cls._values:
+                    candidate = cls._values.pop()
+                    if candidate.isAlive():
+                        instance = candidate
+                        break
+                    cls._discard(candidate)
+                    dead.append(candidate)
+
+                if instance is not None:
+                    break
+
+                if cls._CURRENT_INSTANCES < cls._MAX_INSTANCES:
+                    # reserve the slot, the browser is started outside the lock
+                    cls._CURRENT_INSTANCES += 1
+                    slot = min(
+                        set(range(len(cls._usedSlots) + 1)) - cls._usedSlots)
+                    cls._usedSlots.add(slot)
+                    break
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                cls._lock.wait(remaining)
+
+        cls._quit(dead)
+        if instance is None and slot is None:
+            raise DriverInstanceError(
+                u'Nenhum navegador livre após {} segundos.'.format(timeout))
+
+        if instance is None:
+            if not cls._PRUNED:
+                cls._PRUNED = True
+                _pruneCacheDirs()
+            try:
+                # a recycled browser gets the disk cache of its slot back
+                instance = AVAscraper(
+                    debug=debug,
+                    lean=cls._LEAN,
+                    cacheDir=os.path.join(LEAN_CACHE_DIR, '{}-{}'.format(
+                        os.getpid(), slot)))
+            except Exception:
+                with cls._lock:
+                    cls._CURRENT_INSTANCES -= 1
+                    cls._usedSlots.discard(slot)
+                    cls._lock.notify()
+                raise
+            instance.pooled = True
+            instance.cacheSlot = slot
 
             if debug:
                 print('instanciado!')
 
-        return cls._values.pop()
+        instance.uninove_ra = uninove_ra
+        instance.uninove_senha = uninove_senha
+        instance.debug = debug
+        instance.guard = cls._GUARD
+        instance.controller = cls._CONTROLLER
+        instance.uses += 1
+        return instance
 
     @classmethod
     def pushInstance(cls, instance):
-        return cls._values.append(instance)
+        """Returns instance to the pool, wiping its state. Instances that
+        reached _MAX_USES or fail to reset are quit instead.
 
+        :param instance: AVAscraper previously returned by getInstance.
+
+        """
+        recycle = instance.uses >= cls._MAX_USES
+        if not recycle:
+            try:
+                instance.reset()
+            except WebDriverException:
+                logging.error(traceback.format_exc())
+                recycle = True
 
-class AVAscraper(ContextDecorator):
+        with cls._lock:
+            discarded = recycle or len(cls._values) >= cls._MAX_INSTANCES
+            if discarded:
+                cls._discard(instance)
+            else:
+                cls._values.append(instance)
+            cls._lock.notify()
+
+        if discarded:
+            cls._quit([instance])
+
+    @classmethod
+    def occupancy(cls):
+        """Returns how many browsers are checked out, idle in the pool and
+        allowed in this process.
+
+        :rtype: dict
+
+        """
+        with cls._lock:
+            idle = len(cls._values)
+            return {
+                'busy': cls._CURRENT_INSTANCES - idle,
+                'idle': idle,
+                'max': cls._MAX_INSTANCES
+            }
+
+    @classmethod
+    def closeAll(cls):
+        """Quits every idle browser and removes its disk cache, used at
+        worker shutdown.
+        """
+        with cls._lock:
+            idle, cls._values = cls._values, list()
+            for instance in idle:
+                cls._discard(instance)
+            cls._lock.notify_all()
+
+        cls._quit(idle)
+        for instance in idle:
+            if instance.cacheDir is not None:
+                shutil.rmtree(instance.cacheDir, ignore_errors=True)
+
+    @classmethod
+    def _discard(cls, instance):
+        """Takes instance out of the count, its cache slot stays in use
+        until _quit. Caller must hold _lock.
+        """
+        cls._CURRENT_INSTANCES -= 1
+
+    @classmethod
+    def _quit(cls, instances):
+        """Quits discarded instances, then frees their cache slots. Called
+        without _lock: a hung browser can take long to close.
+        """
+        for instance in instances:
+            instance.quit()
+
+        if instances:
+            with cls._lock:
+                for instance in instances:
+                    cls._usedSlots.discard(instance.cacheSlot)
+
+
+def _pruneCacheDirs():
+    """Removes disk caches left by processes that died without closeAll."""
+    try:
+        names = os.listdir(LEAN_CACHE_DIR)
+    except FileNotFoundError:
+        return
+
+    for name in names:
+        pid = name.split('-', 1)[0]
+        if not pid.isdigit() or _processAlive(int(pid)):
+            continue
+        shutil.rmtree(os.path.join(LEAN_CACHE_DIR, name), ignore_errors=True)
+
+
+def _processAlive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _loginOutcome(driver):
+    """Login wait condition.
+
+    :returns: True on AVA main page, the message of the login error
+    element once it shows one, False otherwise.
+
+    """
+    if 'principal' in driver.current_url:
+        return True
+    try:
+        errors = driver.find_elements_by_id('lb_conteudo')
+        message = errors[0].text.strip() if errors else ''
+    # the login page went away while it was read
+    except StaleElementReferenceException:
+        return False
+    return message or False
+
+
+class AVAscraper(BaseScraper):
+    # TimeoutException included, AVA pages that never finish loading
+    NAVIGATION_FAILURES = (WebDriverException, )
+
+    @step('startBrowser')
     def __init__(self,
                  uninove_ra=None,
                  uninove_senha=None,
                  debug=False,
-                 engine="chrome"):
+                 engine="chrome",
+                 lean=False,
+                 cacheDir=None,
+                 guard=None):
         """
         Initialize selenium driver with simple options.
+
+        The lean profile blocks images, fonts, CSS and third-party requests,
+        stops page loads at DOMContentLoaded and keeps the disk cache in
+        cacheDir, so it stays warm when the browser is recycled.
         """
         self.uninove_ra = uninove_ra
         self.uninove_senha = uninove_senha
-        self.TIMEOUT_TIME = 5
-        self.TIMEOUT_TIME_LOGIN = 5
-        self.TIMEOUT_TIME_MENUTAB = 4
         self.debug = debug
         self.engine = engine
+        self.lean = lean
+        self.guard = guard
         self.options = None
         self.driver = None
+        self.pooled = False
+        self.uses = 0
+        self.cacheSlot = None
+        self.cacheDir = cacheDir if lean else None
 
-        self.AVA_LOGIN_URL = "https://ava.uninove.br/seu/AVA/index.php"
-        self.AVA_MAIN_URL = 'https://ava.uninove.br/seu/AVA/principal.php'
-        self.AVA_ATIVIDADE_URL = 'https://ava.uninove.br/seu/AVA/ferramentas/atividade.php'
+        self.AVA_LOGIN_URL = AVA_BASE_URL + '/index.php'
+        self.AVA_MAIN_URL = AVA_BASE_URL + '/principal.php'
+        self.AVA_ATIVIDADE_URL = AVA_BASE_URL + '/ferramentas/atividade.php'
 
         if self.engine == "firefox":
             self.options = webdriver.FirefoxOptions()
@@ -78,7 +369,16 @@ class AVAscraper(ContextDecorator):
             if not self.debug:
                 self.options.add_argument("headless")
 
-            self.driver = webdriver.Firefox(firefox_options=self.options)
+            capabilities = self.options.to_capabilities()
+            if self.lean:
+                self.options.set_preference('permissions.default.image', 2)
+                self.options.set_preference('extensions.enabled', False)
+                capabilities = self.options.to_capabilities()
+                capabilities['pageLoadStrategy'] = 'eager'
+
+            self.driver = webdriver.Firefox(
+                firefox_options=self.options,
+                desired_capabilities=capabilities)
 
         elif self.engine == "chrome":
             self.options = webdriver.ChromeOptions()
@@ -86,12 +386,46 @@ class AVAscraper(ContextDecorator):
             if not self.debug:
                 self.options.add_argument("headless")
 
-            self.driver = webdriver.Chrome(chrome_options=self.options)
+            capabilities = self.options.to_capabilities()
+            if self.lean:
+                self.options.add_argument("--disable-extensions")
+                self.options.add_argument("--disable-gpu")
+                self.options.add_argument("--blink-settings=imagesEnabled=false")
+                if cacheDir is not None:
+                    self.options.add_argument(
+                        "--disk-cache-dir={}".format(cacheDir))
+                self.options.add_experimental_option(
+                    'prefs', {
+                        'profile.managed_default_content_settings.images': 2
+                    })
+                capabilities = self.options.to_capabilities()
+                capabilities['pageLoadStrategy'] = 'eager'
+
+            self.driver = webdriver.Chrome(
+                chrome_options=self.options,
+                desired_capabilities=capabilities)
+
+            if self.lean:
+                self._blockResources()
         else:
             raise Exception("You need to choose an engine for the webdriver.")
 
             #self.options.set_headless(headless=False)
 
+    def _blockResources(self):
+        """Blocks LEAN_BLOCKED_URLS through the DevTools protocol, when the
+        installed selenium supports it.
+        """
+        if not hasattr(self.driver, 'execute_cdp_cmd'):
+            logging.warning('Selenium without CDP support, resources of AVA '
+                            'pages will not be blocked.')
+            return
+
+        self.driver.execute_cdp_cmd('Network.enable', {})
+        self.driver.execute_cdp_cmd('Network.setBlockedURLs',
+                                    {'urls': LEAN_BLOCKED_URLS})
+
+    @step('loginAva')
     def loginAva(self):
         """Login into AVA website with user's RA and AVA password.
 
@@ -100,29 +434,80 @@ class AVAscraper(ContextDecorator):
         """
 
         try:
-            self.driver.get(self.AVA_LOGIN_URL)
+            with self._navigation():
+                self.driver.get(self.AVA_LOGIN_URL)
         except WebDriverException:
             logging.error(traceback.format_exc())
-            raise ScraperError(u"Não foi possível entrar no site do AVA")
+            raise UnreachableError(u"Não foi possível entrar no site do AVA")
 
         username = self.driver.find_element_by_name('user')
         username.send_keys(self.uninove_ra)
         password = self.driver.find_element_by_name('Password')
         password.send_keys(self.uninove_senha)
-        password.send_keys(Keys.RETURN)
 
+        # AVA either moves on to its main page or shows why it didn't, so
+        # only a page that answers neither is a failure
+        try:
+            with self._navigation():
+                password.send_keys(Keys.RETURN)
+                outcome = waitUntil(self.driver, 'login', _loginOutcome)
+        except TimeoutException:
+            logging.error(traceback.format_exc())
+            raise UnreachableError(u"AVA não respondeu ao login.")
+
+        if outcome is not True:
+            raise LoginError(outcome)
+
+    def exportCookies(self):
+        """Returns AVA cookies as a list of dicts."""
+        return [{
+            'name': cookie['name'],
+            'value': cookie['value'],
+            'domain': cookie.get('domain'),
+            'path': cookie.get('path', '/')
+        } for cookie in self.driver.get_cookies()]
+
+    def importCookies(self, cookies):
+        # cookies can only be set for the domain currently loaded
+        try:
+            with self._navigation():
+                self.driver.get(self.AVA_LOGIN_URL)
+        except WebDriverException:
+            logging.error(traceback.format_exc())
+            raise UnreachableError(u"Não foi possível entrar no site do AVA")
+
+        for cookie in cookies:
+            self.driver.add_cookie({
+                'name': cookie['name'],
+                'value': cookie['value'],
+                'path': cookie['path']
+            })
+
+    def clearCookies(self):
+        self.driver.delete_all_cookies()
+
+    def sessionIsValid(self):
+        """Probes AVA main page, the session is valid if it isn't sent back
+        to the login page.
+
+        :rtype: bool
+
+        """
         try:
-            WebDriverWait(self.driver, self.TIMEOUT_TIME_LOGIN).until(
-                EC.url_contains(('principal')))
-        # something wrong happened on AVA platform
-        except TimeoutException as e:
-            raise LoginError(
-                self.driver.find_element_by_id('lb_conteudo').text)
-
-    def getMaterias(self, userDisciplines=False):
+            with self._navigation():
+                self.driver.get(self.AVA_MAIN_URL)
+        except WebDriverException:
+            return False
+
+        return 'principal' in self.driver.current_url and len(
+            self.driver.find_elements_by_id('frm-principal')) > 0
+
+    @step('getMaterias')
+    def getMaterias(self, userDisciplines=(), classification=None):
         """Get all user disciplines IDCurso, CodCurso, Name and if it is online or on-site.
 
         :param userDisciplines: dictionary if user already has disciplines.
+        :param classification: ClassificationCache of known disciplines.
         :returns: dictionary with discipline ID, Cod, Name and isOnline.
         :rtype: dict
 
@@ -131,51 +516,29 @@ class AVAscraper(ContextDecorator):
             print(userDisciplines)
 
         try:
-            WebDriverWait(self.driver, 5).until(
-                EC.url_to_be((self.AVA_MAIN_URL)))
-        except WrongPageError:
+            waitUntil(self.driver, 'principal',
+                      EC.url_to_be((self.AVA_MAIN_URL)))
+            waitPageReady(self.driver, 'principal')
+        except TimeoutException:
             raise WrongPageError(
                 u'Localização incorreta. Certifique-se da página')
 
-        menuTodasMaterias = WebDriverWait(
-            self.driver, self.TIMEOUT_TIME).until(
-                EC.presence_of_element_located((By.ID, 'menu0')))
-
-        soup = BeautifulSoup(
-            menuTodasMaterias.get_attribute('innerHTML'), "lxml")
-
-        materiasLista = []
-        materiasSoup = soup.find_all("div", {"idcurso": re.compile(r'.*')})
-
-        for materia in materiasSoup:
-            idCurso = int(materia.get('idcurso'))
-            codCurso = materia.get('codigo')
-            disciplineName = materia.select('span.md')[0].string
+        menus = self.driver.find_elements_by_id('menu0')
+        if not menus:
+            raise WrongPageError(u'Não achou elemento "menu0".')
+        menuTodasMaterias = menus[0]
 
-            if self.debug:
-                print(idCurso)
-                print(userDisciplines)
-                print(idCurso in userDisciplines)
-
-            if idCurso not in userDisciplines:
-                materiasLista.append({
-                    'IDCurso': idCurso,
-                    'CodCurso': codCurso,
-                    'Name': disciplineName
-                })
+        materiasLista = parsers.parseMaterias(
+            menuTodasMaterias.get_attribute('innerHTML'), userDisciplines)
 
         if self.debug:
             print(materiasLista)
 
-        for materia in materiasLista:
-            if self.disciplineIsOnline(materia['IDCurso'],
-                                       materia['CodCurso']):
-                materia.update({'isOnline': True})
-            else:
-                materia.update({'isOnline': False})
+        self.classifyMaterias(materiasLista, classification)
 
         return materiasLista
 
+    @step('disciplineIsOnline')
     def disciplineIsOnline(self, idCurso, codCurso):
         """Enters inside discipline page, and checks if it has a Atividade tab.
 
@@ -186,45 +549,17 @@ class AVAscraper(ContextDecorator):
 
         """
 
-        # start at main page
-        if self.driver.current_url != self.AVA_MAIN_URL:
-            try:
-                self.driver.get(self.AVA_MAIN_URL)
-                WebDriverWait(self.driver, self.TIMEOUT_TIME).until(
-                    EC.presence_of_element_located((By.ID, 'frm-principal')))
-            except WebDriverException:
-                pass
-            except TimeoutException:
-                raise WrongPageError(u'Não achou elemento "frm-principal".')
-
-        self._fillFormAndSubmit(idCurso, codCurso)
-
-        # checks if it is a discipline page
-        try:
-            WebDriverWait(self.driver, self.TIMEOUT_TIME).until(
-                EC.url_contains(('ferramentas')))
-        except TimeoutException:
-            raise
+        self._openDiscipline(idCurso, codCurso)
 
         if self.debug:
-            try:
-                titulo = WebDriverWait(self.driver, 5).until(
-                    EC.presence_of_element_located((By.ID,
-                                                    'titulo-disciplina')))
-                soup = BeautifulSoup(titulo.get_attribute('innerHTML'), "lxml")
-                print(soup.find('p').string)
-            except TimeoutError:
-                raise WrongPageError(
-                    u'Não achou elemento "titulo-disciplina".')
-
-        # checks if there is an Atividade tab to choose
-        try:
-            WebDriverWait(self.driver, self.TIMEOUT_TIME_MENUTAB).until(
-                EC.presence_of_element_located((By.ID, 'aba-atividade')))
-        except TimeoutException:
-            return False
-        return True
+            titulo = self.driver.find_elements_by_id('titulo-disciplina')
+            if titulo:
+                print(titulo[0].find_element_by_tag_name('p').text)
 
+        # the page finished loading, so a missing tab means on-site
+        return len(self.driver.find_elements_by_id('aba-atividade')) > 0
+
+    @step('getQuestionarios')
     def getQuestionarios(self, idCurso, codCurso):
         """Returns user assignments.
         # TODO: foruns
@@ -237,90 +572,38 @@ class AVAscraper(ContextDecorator):
         if self.debug:
             print('Página principal..')
 
-        # start at main page
-        try:
-            self.driver.get(self.AVA_MAIN_URL)
-            WebDriverWait(self.driver, self.TIMEOUT_TIME).until(
-                EC.presence_of_element_located((By.ID, 'frm-principal')))
-        except WebDriverException as e:
-            print(e)
-            pass
-        except TimeoutException as e:
-            raise WrongPageError(u'Não achou elemento "frm-principal".')
-
-        self._fillFormAndSubmit(idCurso, codCurso)
+        self._openDiscipline(idCurso, codCurso)
 
         if self.debug:
             print('Página de matéria EAD')
 
         # checks if there is an Atividade tab to choose, and then clicks it
-        try:
-            WebDriverWait(self.driver, self.TIMEOUT_TIME_MENUTAB).until(
-                EC.element_to_be_clickable(
-                    (By.CSS_SELECTOR, '#aba-atividade > a:nth-child(1)')))
-        except TimeoutException:
-            pass
+        atividadeTabs = self.driver.find_elements_by_css_selector(
+            '#aba-atividade > a:nth-child(1)')
+        if not atividadeTabs:
+            raise WrongPageError(u'Não entrou na TAB de atividade.')
 
         try:
-            atividadeTab = self.driver.find_element_by_css_selector(
-                '#aba-atividade > a:nth-child(1)')
-            self.driver.execute_script("arguments[0].click();", atividadeTab)
-
-            WebDriverWait(self.driver, 5).until(
-                EC.url_to_be((self.AVA_ATIVIDADE_URL)))
+            with self._navigation():
+                self.driver.execute_script("arguments[0].click();",
+                                           atividadeTabs[0])
+                waitUntil(self.driver, 'atividade',
+                          EC.url_to_be((self.AVA_ATIVIDADE_URL)))
+                waitPageReady(self.driver, 'atividade')
         except TimeoutException:
-            print(u'Não entrou na TAB de atividade.')
             raise WrongPageError(u'Não entrou na TAB de atividade.')
-        except Exception as e:
-            print(e)
-            print(self.driver.current_url)
-
-        # WebDriverWait(self.driver, 10).until(
-        #    EC.url_to_be((self.AVA_LOGIN_URL)))
 
         if self.debug:
             print('TAB de atividade')
 
         # checar todos os filtro-conteudo e retirar as atividades abertas
-        todosQuestionarios = None
-        try:
-            todosQuestionarios = WebDriverWait(
-                self.driver, self.TIMEOUT_TIME_MENUTAB).until(
-                    EC.presence_of_element_located((By.ID, 'div-conteudo')))
-        except TimeoutException:
-            pass
-
-        atividadesSoup = BeautifulSoup(
-            todosQuestionarios.get_attribute('innerHTML'), "lxml")
-
-        # parsing questionaries and forums
-        questionarios = atividadesSoup.find_all(
-            'div', class_='filtro-conteudo')
-        # foruns = atividadesSoup.find_all('div', {'tipo': '003'})
-
-        questionariosList = []
-        for questionario in questionarios:
-
-            name = questionario.select('span.marginLeft10')[0].text
-            codigo = questionario.find("div",
-                                       {"codigo": re.compile(r'.*')})['codigo']
-            status = questionario.select('p.sm2.white')[0].text
-            datas = re.findall(r'(\d+\/\d+\/\d+)+',
-                               questionario.select('div.bloco-data')[0].string)
-            daysLeft = datas[1]
-
-            questionariosList.append({
-                'name':
-                name,
-                'codigo':
-                codigo,
-                'status':
-                status,
-                'days_left':
-                self._formatDateString(daysLeft),
-                'type':
-                u'Questionário'
-            })
+        conteudo = self.driver.find_elements_by_id('div-conteudo')
+        if not conteudo:
+            raise WrongPageError(u'Não achou elemento "div-conteudo".')
+        todosQuestionarios = conteudo[0]
+
+        questionariosList = parsers.parseQuestionarios(
+            todosQuestionarios.get_attribute('innerHTML'))
 
         if self.debug:
             print('Questionarios: ')
@@ -329,18 +612,35 @@ class AVAscraper(ContextDecorator):
         return questionariosList
         # depois pegar seu nome, peso e data de termino
 
-    def _formatDateString(self, assignmentDate):
-        """Formats date string to datetime object.
+    def _openDiscipline(self, idCurso, codCurso):
+        """Goes to the main page if needed, submits the discipline form and
+        waits until the discipline page is ready.
 
-        :param assignmentList: assignmentDate in string format of xx/xx/xxxx.
-        :returns: end date of assignment
-        :rtype: datetime
+        :raises WrongPageError: if any of the pages didn't load.
 
         """
-        day, month, year = re.findall(r'(\d+)+', assignmentDate)
-        finaldate = datetime.datetime(
-            int(year), int(month), int(day), 23, 59, 59)
-        return finaldate
+
+        # start at main page
+        if self.driver.current_url != self.AVA_MAIN_URL:
+            try:
+                with self._navigation():
+                    self.driver.get(self.AVA_MAIN_URL)
+                    waitPageReady(self.driver, 'principal')
+            except WebDriverException:
+                raise WrongPageError(u'Não carregou a página principal.')
+
+        if not self.driver.find_elements_by_id('frm-principal'):
+            raise WrongPageError(u'Não achou elemento "frm-principal".')
+
+        # checks if it is a discipline page
+        try:
+            with self._navigation():
+                self._fillFormAndSubmit(idCurso, codCurso)
+                waitUntil(self.driver, 'ferramentas',
+                          EC.url_contains(('ferramentas')))
+                waitPageReady(self.driver, 'ferramentas')
+        except TimeoutException:
+            raise WrongPageError(u'Não entrou na página da disciplina.')
 
     def _fillFormAndSubmit(self, idCurso, codCurso):
         """Fill main page form and submits it.
@@ -370,13 +670,56 @@ class AVAscraper(ContextDecorator):
 
         form.submit()
 
+    def isAlive(self):
+        """Checks if the browser still answers commands.
+
+        :returns: True if driver is usable.
+        :rtype: bool
+
+        """
+        try:
+            self.driver.current_url
+        except WebDriverException:
+            return False
+        return True
+
+    def reset(self):
+        """Wipes cookies, storage, extra windows and credentials, so the
+        instance can be handed to another user.
+        """
+        handles = self.driver.window_handles
+        for handle in handles[1:]:
+            self.driver.switch_to.window(handle)
+            self.driver.close()
+        self.driver.switch_to.window(handles[0])
+
+        if self.driver.current_url.startswith('http'):
+            self.driver.execute_script(
+                'window.localStorage.clear(); window.sessionStorage.clear();')
+        self.driver.delete_all_cookies()
+        self.driver.get('about:blank')
+
+        self.uninove_ra = None
+        self.uninove_senha = None
+
+    def quit(self):
+        """
+        Closes driver, ignoring browsers that already died.
+        """
+        try:
+            self.driver.quit()
+        except WebDriverException:
+            logging.error(traceback.format_exc())
+
     def __enter__(self):
         return self
 
     def __exit__(self, *args):
         """
-        Closes driver.
+        Returns pooled instances to the factory, closes driver otherwise.
         """
-        # AVAscraperFactory.pushInstance(self)
-        self.driver.quit()
-        return self
+        if self.pooled:
+            AVAscraperFactory.pushInstance(self)
+        else:
+            self.quit()
+        return False
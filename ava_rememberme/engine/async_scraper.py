@@ -0,0 +1,270 @@
+"-*- coding: utf-8 -*-"
+
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+
+import httpx
+
+from .base import AVA_BASE_URL, QuestionariosCollector
+from .exceptions import ScraperError, UnreachableError
+from .http_scraper import USER_AGENT, AVAhttpFlows
+from .instrumentation import step, stepContext
+
+
+class AVAasyncScraper(AVAhttpFlows):
+    """
+    asyncio version of AVAhttpScraper, so many users can be logged in and
+    scraped concurrently from a single worker.
+    """
+
+    NAVIGATION_FAILURES = (httpx.HTTPError, )
+
+    def __init__(self,
+                 transport,
+                 uninove_ra=None,
+                 uninove_senha=None,
+                 debug=False,
+                 timeout=10,
+                 guard=None,
+                 controller=None):
+        self.uninove_ra = uninove_ra
+        self.uninove_senha = uninove_senha
+        self.debug = debug
+        self.guard = guard
+        self.controller = controller
+
+        self.AVA_LOGIN_URL = AVA_BASE_URL + '/index.php'
+        self.AVA_MAIN_URL = AVA_BASE_URL + '/principal.php'
+        self.AVA_FERRAMENTAS_URL = AVA_BASE_URL + '/ferramentas/principal.php'
+        self.AVA_ATIVIDADE_URL = AVA_BASE_URL + '/ferramentas/atividade.php'
+
+        # each user has its own cookie jar, connections come from the
+        # shared transport
+        self.client = httpx.AsyncClient(
+            transport=transport,
+            timeout=timeout,
+            follow_redirects=True,
+            headers={'User-Agent': USER_AGENT})
+        self._cookieJar = self.client.cookies.jar
+
+        self._mainPage = None
+        self._mainFormFields = None
+
+    @step('loginAva')
+    async def loginAva(self):
+        """Login into AVA website posting the login form.
+
+        :raises LoginError: AVA refused the credentials.
+        :raises ScraperError: login page did not look as expected.
+        """
+        await self._run(self._loginFlow())
+
+    async def loginCached(self, sessionStore=None):
+        """Async version of BaseScraper.loginCached, the sessionStore is
+        read and written from a thread.
+
+        :returns: True if a cached session was reused.
+        :rtype: bool
+
+        """
+        if sessionStore is not None:
+            cookies = await asyncio.to_thread(sessionStore.load,
+                                              self.uninove_ra)
+            if cookies:
+                self.importCookies(cookies)
+                if await self.sessionIsValid():
+                    return True
+                await asyncio.to_thread(sessionStore.invalidate,
+                                        self.uninove_ra)
+                self.clearCookies()
+
+        await self.loginAva()
+
+        if sessionStore is not None:
+            await asyncio.to_thread(sessionStore.save, self.uninove_ra,
+                                    self.exportCookies())
+        return False
+
+    async def sessionIsValid(self):
+        """Probes AVA main page, the session is valid if it isn't sent back
+        to the login page.
+
+        :rtype: bool
+
+        """
+        return await self._run(self._sessionFlow())
+
+    @step('getQuestionarios')
+    async def getQuestionarios(self, idCurso, codCurso):
+        """Returns user assignments of a discipline.
+
+        :returns: name, status, days_left, type
+        :rtype: list
+
+        """
+        return await self._run(self._questionariosFlow(idCurso, codCurso))
+
+    async def getQuestionariosAll(self, disciplines):
+        """Returns assignments of every given discipline, see
+        BaseScraper.getQuestionariosAll.
+
+        :param disciplines: list of (idCurso, codCurso) pairs.
+        :rtype: list
+
+        """
+        collected = QuestionariosCollector()
+        # sequential on purpose, AVA keeps the selected discipline in the
+        # login session
+        for idCurso, codCurso in disciplines:
+            with collected.discipline(idCurso):
+                collected.add(idCurso, await self.getQuestionarios(
+                    idCurso, codCurso))
+        return collected.result()
+
+    async def _run(self, flow):
+        """Makes each request of flow, returning what it returns."""
+        response = None
+        while True:
+            try:
+                method, url, kwargs = flow.send(response)
+            except StopIteration as done:
+                return done.value
+            response = await self._request(method, url, **kwargs)
+
+    @asynccontextmanager
+    async def _navigation(self):
+        """Async version of BaseScraper._navigation, the Redis calls of the
+        guard and controller run in threads, off the event loop.
+
+        :raises CircuitOpenError: AVA is considered down.
+
+        """
+        if self.guard is not None:
+            await asyncio.sleep(await asyncio.to_thread(self.guard.reserve))
+
+        with stepContext(type(self).__name__, 'navigation'):
+            start = time.monotonic()
+            try:
+                yield
+            except self.NAVIGATION_FAILURES:
+                if self.guard is not None:
+                    await asyncio.to_thread(self.guard.recordFailure)
+                if self.controller is not None:
+                    await asyncio.to_thread(self.controller.observe,
+                                            time.monotonic() - start, True)
+                raise
+            if self.controller is not None:
+                await asyncio.to_thread(self.controller.observe,
+                                        time.monotonic() - start)
+
+    async def _request(self, method, url, **kwargs):
+        try:
+            async with self._navigation():
+                response = await self.client.request(method, url, **kwargs)
+                response.raise_for_status()
+        except httpx.HTTPError:
+            logging.exception(url)
+            raise UnreachableError(u"Não foi possível entrar no site do AVA")
+        return response
+
+    async def close(self):
+        # closing the client would close the shared transport
+        self.client.cookies.clear()
+
+
+@asynccontextmanager
+async def _lease(controller):
+    """Holds a fleet slot of controller, like AVAscraperFactory.lease."""
+    if controller is None:
+        yield
+        return
+
+    lease = await asyncio.to_thread(controller.tryAcquire)
+    while lease is None:
+        await asyncio.sleep(controller.POLL_SECONDS)
+        lease = await asyncio.to_thread(controller.tryAcquire)
+    try:
+        yield
+    finally:
+        await asyncio.to_thread(controller.release, lease)
+
+
+async def _fetchUser(semaphore, transport, user, sessionStore, guard,
+                     controller, debug):
+    async with semaphore, _lease(controller):
+        scraper = AVAasyncScraper(
+            transport,
+            user['uninove_ra'],
+            user['uninove_senha'],
+            debug=debug,
+            guard=guard,
+            controller=controller)
+        result = {
+            'user_id': user['user_id'],
+            'assignments': None,
+            'error': None
+        }
+        try:
+            await scraper.loginCached(sessionStore)
+            result['assignments'] = await scraper.getQuestionariosAll(
+                user['disciplines'])
+        except ScraperError as e:
+            result['error'] = '{}: {}'.format(type(e).__name__, e.msg)
+        # one user's bug must not lose the results of the whole batch
+        except Exception as e:
+            logging.exception('Async scrape of user %s failed',
+                              user['user_id'])
+            result['error'] = '{}: {}'.format(type(e).__name__, e)
+        finally:
+            await scraper.close()
+
+        if debug:
+            print(result)
+        return result
+
+
+async def fetchAssignments(users,
+                           concurrency=20,
+                           sessionStore=None,
+                           guard=None,
+                           controller=None,
+                           debug=False):
+    """Logs every user in and fetches their assignments, keeping at most
+    concurrency users in flight.
+
+    :param users: list of dicts with user_id, uninove_ra, uninove_senha and
+    disciplines, a list of (idCurso, codCurso) pairs.
+    :param concurrency: maximum users scraped at the same time.
+    :param sessionStore: SessionStore of cached logins, optional.
+    :param guard: AVAGuard around every request, optional.
+    :param controller: AIMDController, optional. Users then also wait for
+    a fleet slot, so concurrency is only an upper bound.
+    :returns: list of dicts with user_id, assignments and error, in the same
+    order as users. assignments is None when error is set.
+    :rtype: list
+
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    limits = httpx.Limits(
+        max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncHTTPTransport(limits=limits) as transport:
+        return await asyncio.gather(*[
+            _fetchUser(semaphore, transport, user, sessionStore, guard,
+                       controller, debug)
+            for user in users
+        ])
+
+
+def runFetchAssignments(users,
+                        concurrency=20,
+                        sessionStore=None,
+                        guard=None,
+                        controller=None,
+                        debug=False):
+    """Synchronous entry point of fetchAssignments, for Celery tasks."""
+    return asyncio.run(
+        fetchAssignments(users, concurrency, sessionStore, guard, controller,
+                         debug))
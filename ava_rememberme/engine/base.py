@@ -0,0 +1,155 @@
+"-*- coding: utf-8 -*-"
+
+import logging
+import os
+import time
+from contextlib import ContextDecorator, contextmanager, nullcontext
+
+from .exceptions import WrongPageError
+from .instrumentation import stepContext
+
+# every AVA page the scrapers visit is under this url, it can point to a
+# stand-in such as tools/fake_ava.py
+AVA_BASE_URL = os.environ.get('AVA_BASE_URL',
+                              'https://ava.uninove.br/seu/AVA').rstrip('/')
+
+
+class BaseScraper(ContextDecorator):
+    """
+    Behaviour shared by the browser and HTTP scrapers, built only on top of
+    loginAva, getQuestionarios and the cookie methods.
+    """
+
+    # AVAGuard wrapped around every request to AVA, None disables it
+    guard = None
+    # AIMDController told how each request went, None disables it
+    controller = None
+    # exceptions counted as AVA failures
+    NAVIGATION_FAILURES = ()
+
+    @contextmanager
+    def _navigation(self):
+        """Context around a single request to AVA, see AVAGuard.navigation.
+
+        :raises CircuitOpenError: AVA is considered down.
+
+        """
+        guard = nullcontext()
+        if self.guard is not None:
+            guard = self.guard.navigation(self.NAVIGATION_FAILURES)
+
+        with guard, stepContext(type(self).__name__, 'navigation'):
+            start = time.monotonic()
+            try:
+                yield
+            except self.NAVIGATION_FAILURES:
+                if self.controller is not None:
+                    self.controller.observe(time.monotonic() - start, True)
+                raise
+            if self.controller is not None:
+                self.controller.observe(time.monotonic() - start)
+
+    def loginCached(self, sessionStore=None):
+        """Reuses the user AVA session cached in sessionStore, logging in
+        from scratch only when there is none or it expired.
+
+        :param sessionStore: SessionStore, None disables the cache.
+        :returns: True if a cached session was reused.
+        :rtype: bool
+
+        """
+        if sessionStore is not None:
+            cookies = sessionStore.load(self.uninove_ra)
+            if cookies:
+                self.importCookies(cookies)
+                if self.sessionIsValid():
+                    return True
+                sessionStore.invalidate(self.uninove_ra)
+                self.clearCookies()
+
+        self.loginAva()
+
+        if sessionStore is not None:
+            sessionStore.save(self.uninove_ra, self.exportCookies())
+        return False
+
+    def classifyMaterias(self, materiasLista, classification=None):
+        """Sets isOnline of each discipline, taking it from classification
+        when known and probing the discipline page otherwise.
+
+        :param materiasLista: list of dicts with IDCurso and CodCurso.
+        :param classification: ClassificationCache, None probes everything.
+
+        """
+        known = {}
+        if classification is not None:
+            known = classification.lookup(
+                [materia['IDCurso'] for materia in materiasLista])
+
+        probed = {}
+        for materia in materiasLista:
+            if materia['IDCurso'] in known:
+                materia['isOnline'] = known[materia['IDCurso']]
+                continue
+
+            materia['isOnline'] = bool(
+                self.disciplineIsOnline(materia['IDCurso'],
+                                        materia['CodCurso']))
+            probed[materia['IDCurso']] = materia['isOnline']
+
+        if classification is not None:
+            classification.store(probed)
+
+    def getQuestionariosAll(self, disciplines):
+        """Returns assignments of every given discipline, with a single login.
+
+        Disciplines are visited one after the other: AVA keeps the selected
+        discipline in the login session, so concurrent pages would mix their
+        activity lists.
+
+        :param disciplines: list of (idCurso, codCurso) pairs.
+        :returns: list of getQuestionarios dicts, each with its idCurso.
+        :rtype: list
+        :raises WrongPageError: if no discipline could be read.
+
+        """
+        collected = QuestionariosCollector()
+        for idCurso, codCurso in disciplines:
+            with collected.discipline(idCurso):
+                collected.add(idCurso,
+                              self.getQuestionarios(idCurso, codCurso))
+        return collected.result()
+
+
+class QuestionariosCollector:
+    """
+    Assignments gathered by getQuestionariosAll, of the sync and asyncio
+    scrapers, skipping disciplines whose pages could not be read.
+    """
+
+    def __init__(self):
+        self.questionariosList = []
+        self.lastError = None
+
+    @contextmanager
+    def discipline(self, idCurso):
+        """Skips the discipline if reading it raises WrongPageError."""
+        try:
+            yield
+        except WrongPageError as e:
+            logging.warning('Discipline %s skipped: %s', idCurso, e.msg)
+            self.lastError = e
+
+    def add(self, idCurso, questionarios):
+        for questionario in questionarios:
+            questionario['idCurso'] = idCurso
+        self.questionariosList.extend(questionarios)
+
+    def result(self):
+        """
+        :rtype: list
+        :raises WrongPageError: if no discipline could be read.
+        """
+        if self.lastError is not None and len(self.questionariosList) == 0:
+            raise self.lastError
+        return self.questionariosList
@@ -0,0 +1,70 @@
+"-*- coding: utf-8 -*-"
+
+import random
+
+
+class ClassificationCache:
+    """
+    Shared online/on-site classification of disciplines, keyed by idCurso,
+    so each discipline page is probed once for every user that has it.
+    Lookups go to Redis, then to loader (the Disciplines table), and only
+    missing disciplines are probed by the scraper.
+    """
+
+    KEY = 'ava:discipline:online'
+
+    def __init__(self, client, loader=None, reprobeChance=0.01):
+        """
+        :param client: redis.Redis client.
+        :param loader: callable receiving a list of idCurso and returning a
+        dict idCurso -> isOnline of the known ones.
+        :param reprobeChance: chance of ignoring a cached entry, so
+        disciplines that change modality are eventually probed again.
+        """
+        self.client = client
+        self.loader = loader
+        self.reprobeChance = reprobeChance
+
+    def lookup(self, idCursos):
+        """Returns known classification of the given disciplines.
+
+        :param idCursos: list of idCurso.
+        :returns: dict idCurso -> isOnline, without the unknown ones.
+        :rtype: dict
+
+        """
+        idCursos = [
+            idCurso for idCurso in idCursos
+            if random.random() >= self.reprobeChance
+        ]
+        if not idCursos:
+            return {}
+
+        known = {}
+        for idCurso, value in zip(idCursos,
+                                  self.client.hmget(self.KEY, idCursos)):
+            if value is not None:
+                known[idCurso] = value == b'1'
+
+        missing = [idCurso for idCurso in idCursos if idCurso not in known]
+        if missing and self.loader is not None:
+            loaded = self.loader(missing)
+            if loaded:
+                self.store(loaded)
+                known.update(loaded)
+
+        return known
+
+    def store(self, classified):
+        """Saves classification of disciplines.
+
+        :param classified: dict idCurso -> isOnline.
+
+        """
+        if classified:
+            self.client.hset(
+                self.KEY,
+                mapping={
+                    idCurso: '1' if isOnline else '0'
+                    for idCurso, isOnline in classified.items()
+                })
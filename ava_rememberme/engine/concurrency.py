@@ -0,0 +1,220 @@
+"-*- coding: utf-8 -*-"
+
+import logging
+import threading
+import time
+import uuid
+
+# leases are a sorted set scored by expiry, so a worker that died holding
+# one only blocks its slot until it expires. Filling the last slot, or
+# finding none, marks the limit as saturated: only a saturated limit is
+# worth raising.
+ACQUIRE_SCRIPT = """
+local clock = redis.call('TIME')
+local now = tonumber(clock[1])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now)
+
+local limit = tonumber(redis.call('GET', KEYS[2]) or ARGV[1])
+local inFlight = redis.call('ZCARD', KEYS[1])
+if inFlight + 1 >= limit then
+    redis.call('SET', KEYS[3], '1', 'EX', ARGV[4])
+end
+if inFlight >= limit then
+    return 0
+end
+
+redis.call('ZADD', KEYS[1], now + tonumber(ARGV[2]), ARGV[3])
+return 1
+"""
+
+# every process votes with its own window, a decrease blocks further
+# decreases for a cooldown so one burst seen by all workers only halves the
+# limit once. The last window and change counts are kept for snapshot.
+ADJUST_SCRIPT = """
+local minLimit = tonumber(ARGV[2])
+local maxLimit = tonumber(ARGV[3])
+local limit = tonumber(redis.call('GET', KEYS[1]) or maxLimit)
+local new = limit
+
+if ARGV[1] == 'down' then
+    if redis.call('SET', KEYS[2], '1', 'NX', 'EX', ARGV[6]) then
+        new = math.floor(limit * tonumber(ARGV[5]))
+    end
+elseif redis.call('DEL', KEYS[3]) == 1 then
+    new = limit + tonumber(ARGV[4])
+end
+
+new = math.max(minLimit, math.min(maxLimit, new))
+redis.call('SET', KEYS[1], new)
+
+redis.call('HSET', KEYS[4], 'errorRate', ARGV[7], 'p90', ARGV[8])
+if new > limit then
+    redis.call('HINCRBY', KEYS[4], 'increases', 1)
+elseif new < limit then
+    redis.call('HINCRBY', KEYS[4], 'decreases', 1)
+end
+return {limit, new}
+"""
+
+
+class AIMDController:
+    """
+    Number of user refreshes in flight across every worker, raised by one
+    after healthy windows of requests and halved when AVA gets slow or
+    starts failing, the way TCP sizes its congestion window.
+    """
+
+    LIMIT_KEY = 'ava:concurrency:limit'
+    LEASES_KEY = 'ava:concurrency:leases'
+    SATURATED_KEY = 'ava:concurrency:saturated'
+    DECREASED_KEY = 'ava:concurrency:decreased'
+    STATS_KEY = 'ava:concurrency:stats'
+
+    # seconds between attempts while waiting for a free slot
+    POLL_SECONDS = 0.5
+
+    def __init__(self,
+                 client,
+                 minLimit=1,
+                 maxLimit=20,
+                 increase=1,
+                 decrease=0.5,
+                 window=50,
+                 latencyTarget=5.0,
+                 maxErrorRate=0.1,
+                 cooldown=60,
+                 leaseSeconds=15 * 60):
+        """
+        The limit starts at maxLimit, so the fleet runs as before until AVA
+        shows trouble.
+
+        :param client: redis.Redis client.
+        :param increase: slots added after a healthy, saturated window.
+        :param decrease: factor the limit is multiplied by after a bad one.
+        :param window: requests observed by a process before it votes.
+        :param latencyTarget: p90 request seconds above which a window is
+        bad.
+        :param maxErrorRate: failed requests ratio above which a window is
+        bad.
+        :param cooldown: seconds between decreases.
+        :param leaseSeconds: a slot not released by then is freed.
+        """
+        self.client = client
+        self.minLimit = minLimit
+        self.maxLimit = maxLimit
+        self.increase = increase
+        self.decrease = decrease
+        self.window = window
+        self.latencyTarget = latencyTarget
+        self.maxErrorRate = maxErrorRate
+        self.cooldown = cooldown
+        self.leaseSeconds = leaseSeconds
+
+        self._acquire = client.register_script(ACQUIRE_SCRIPT)
+        self._adjust = client.register_script(ADJUST_SCRIPT)
+
+        self._samples = []
+        self._lock = threading.Lock()
+
+    def tryAcquire(self):
+        """Takes a slot if one is free.
+
+        :returns: lease to release, None if every slot is taken.
+        :rtype: str
+
+        """
+        lease = uuid.uuid4().hex
+        acquired = self._acquire(
+            keys=[self.LEASES_KEY, self.LIMIT_KEY, self.SATURATED_KEY],
+            args=[self.maxLimit, self.leaseSeconds, lease, self.cooldown])
+        return lease if int(acquired) else None
+
+    def acquire(self, timeout=None):
+        """Waits for a slot.
+
+        :param timeout: seconds to wait, None waits forever.
+        :returns: lease to release, None if it timed out.
+        :rtype: str
+
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            lease = self.tryAcquire()
+            if lease is not None:
+                return lease
+            if deadline is not None and time.monotonic() >= deadline:
+                return None
+            time.sleep(self.POLL_SECONDS)
+
+    def release(self, lease):
+        self.client.zrem(self.LEASES_KEY, lease)
+
+    def observe(self, seconds, failed=False):
+        """Records one request to AVA, voting once window requests were
+        seen by this process.
+
+        :param seconds: how long the request took.
+        :param failed: the request failed or timed out.
+
+        """
+        with self._lock:
+            self._samples.append((seconds, failed))
+            if len(self._samples) < self.window:
+                return
+            samples, self._samples = self._samples, []
+
+        latencies = sorted(seconds for seconds, _ in samples)
+        errorRate = sum(failed for _, failed in samples) / len(samples)
+        latency = latencies[int(0.9 * (len(latencies) - 1))]
+        healthy = (errorRate <= self.maxErrorRate
+                   and latency <= self.latencyTarget)
+
+        before, after = (int(value) for value in self._adjust(
+            keys=[
+                self.LIMIT_KEY, self.DECREASED_KEY, self.SATURATED_KEY,
+                self.STATS_KEY
+            ],
+            args=[
+                'up' if healthy else 'down', self.minLimit, self.maxLimit,
+                self.increase, self.decrease, self.cooldown, errorRate,
+                latency
+            ]))
+        if after > before:
+            logging.info('Scrape concurrency %s -> %s', before, after)
+        elif after < before:
+            logging.warning(
+                'Scrape concurrency %s -> %s, %.0f%% errors, p90 %.1fs',
+                before, after, errorRate * 100, latency)
+
+    def limit(self):
+        """Returns the current limit of user refreshes in flight.
+
+        :rtype: int
+
+        """
+        limit = self.client.get(self.LIMIT_KEY)
+        return self.maxLimit if limit is None else int(limit)
+
+    def snapshot(self):
+        """Returns the fleet limit, slots in use, the last window voted on
+        and how many times the limit changed.
+
+        :rtype: dict
+
+        """
+        pipeline = self.client.pipeline()
+        pipeline.get(self.LIMIT_KEY)
+        pipeline.zcount(self.LEASES_KEY, time.time(), '+inf')
+        pipeline.hgetall(self.STATS_KEY)
+        limit, inFlight, stats = pipeline.execute()
+        stats = {key.decode(): float(value) for key, value in stats.items()}
+        return {
+            'limit': self.maxLimit if limit is None else int(limit),
+            'inFlight': inFlight,
+            'minLimit': self.minLimit,
+            'maxLimit': self.maxLimit,
+            'errorRate': stats.get('errorRate'),
+            'p90': stats.get('p90'),
+            'increases': int(stats.get('increases', 0)),
+            'decreases': int(stats.get('decreases', 0))
+        }
@@ -26,7 +26,23 @@ class WrongPageError(ScraperError):
     """
 
 
+class UnreachableError(ScraperError):
+    """
+    AVA didn't answer, or answered with an HTTP error.
+    """
+
+
 class RegisterError(Exception):
     """
     Base exception for errors raised at the user registration
     """
+
+
+class CircuitOpenError(ScraperError):
+    """
+    AVA failed too often recently, requests are paused for a while.
+    """
+
+    def __init__(self, msg=None, retryIn=0):
+        super().__init__(msg)
+        self.retryIn = retryIn
@@ -0,0 +1,131 @@
+"-*- coding: utf-8 -*-"
+
+import logging
+import time
+from contextlib import contextmanager
+
+from .exceptions import CircuitOpenError
+
+# takes a token from the bucket, which may go negative: the caller then
+# waits for its turn instead of polling. Fails right away while the breaker
+# is open. Writing after TIME needs Redis 5 or later.
+RESERVE_SCRIPT = """
+local reopensIn = redis.call('PTTL', KEYS[2])
+if reopensIn > 0 then
+    return {0, tostring(reopensIn / 1000)}
+end
+
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'stamp')
+local tokens = tonumber(bucket[1]) or burst
+local stamp = tonumber(bucket[2]) or now
+
+tokens = math.min(burst, tokens + math.max(0, now - stamp) * rate) - 1
+redis.call('HMSET', KEYS[1], 'tokens', tostring(tokens), 'stamp',
+           tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil((burst - tokens) / rate) + 1)
+
+if tokens >= 0 then
+    return {1, '0'}
+end
+return {1, tostring(-tokens / rate)}
+"""
+
+# counts failures in a fixed window, opening the breaker when they reach the
+# threshold
+FAILURE_SCRIPT = """
+local failures = redis.call('INCR', KEYS[1])
+if failures == 1 then
+    redis.call('EXPIRE', KEYS[1], ARGV[1])
+end
+if failures >= tonumber(ARGV[2]) then
+    redis.call('SET', KEYS[2], '1', 'EX', ARGV[3])
+    redis.call('DEL', KEYS[1])
+    return 1
+end
+return 0
+"""
+
+
+class AVAGuard:
+    """
+    Token bucket and circuit breaker kept in Redis, so every worker shares
+    the same request budget to AVA and stops together when it is down.
+    """
+
+    BUCKET_KEY = 'ava:guard:bucket'
+    FAILURES_KEY = 'ava:guard:failures'
+    OPEN_KEY = 'ava:guard:open'
+
+    def __init__(self,
+                 client,
+                 rate=5,
+                 burst=10,
+                 failures=20,
+                 window=60,
+                 cooldown=5 * 60):
+        """
+        :param client: redis.Redis client.
+        :param rate: navigations per second, across all workers.
+        :param burst: navigations allowed at once after a quiet period.
+        :param failures: failed navigations in window seconds that open the
+        breaker.
+        :param cooldown: seconds the breaker stays open.
+        """
+        self.client = client
+        self.rate = rate
+        self.burst = burst
+        self.failures = failures
+        self.window = window
+        self.cooldown = cooldown
+
+        self._reserve = client.register_script(RESERVE_SCRIPT)
+        self._recordFailure = client.register_script(FAILURE_SCRIPT)
+
+    def reserve(self):
+        """Takes the next navigation slot.
+
+        :returns: seconds to wait before navigating.
+        :rtype: float
+        :raises CircuitOpenError: AVA is considered down.
+
+        """
+        allowed, value = self._reserve(
+            keys=[self.BUCKET_KEY, self.OPEN_KEY],
+            args=[self.rate, self.burst])
+        if not int(allowed):
+            raise CircuitOpenError(
+                u'AVA instável, nova tentativa em {:.0f} segundos.'.format(
+                    float(value)), float(value))
+        return float(value)
+
+    def recordFailure(self):
+        opened = self._recordFailure(
+            keys=[self.FAILURES_KEY, self.OPEN_KEY],
+            args=[self.window, self.failures, self.cooldown])
+        if int(opened):
+            logging.warning('%s AVA failures in %ss, pausing for %ss',
+                            self.failures, self.window, self.cooldown)
+
+    def reopensIn(self):
+        """Returns seconds until the breaker closes, 0 if it is closed."""
+        return max(0, self.client.pttl(self.OPEN_KEY)) / 1000
+
+    @contextmanager
+    def navigation(self, failures):
+        """Waits for a slot, then counts exceptions of the failures types
+        raised inside the block against AVA.
+
+        :raises CircuitOpenError: AVA is considered down.
+
+        """
+        time.sleep(self.reserve())
+        try:
+            yield
+        except failures:
+            self.recordFailure()
+            raise
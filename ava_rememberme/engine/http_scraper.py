@@ -0,0 +1,278 @@
+"-*- coding: utf-8 -*-"
+
+import logging
+from urllib.parse import urljoin
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.cookies import create_cookie
+
+from . import parsers
+from .base import AVA_BASE_URL, BaseScraper
+from .exceptions import (LoginError, ScraperError, UnreachableError,
+                         WrongPageError)
+from .instrumentation import step
+
+# connections to AVA are shared by every session of the worker process,
+# while cookies stay isolated per user session
+_ADAPTER = HTTPAdapter(pool_connections=2, pool_maxsize=16)
+
+USER_AGENT = ('Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 '
+              '(KHTML, like Gecko) Chrome/69.0 Safari/537.36')
+
+
+class AVAhttpFlows:
+    """
+    AVA pages and forms walked by AVAhttpScraper and AVAasyncScraper.
+
+    Each flow is a generator yielding (method, url, kwargs) requests and
+    sent back their responses, so the blocking and the asyncio scrapers run
+    the same steps, each with its own client. Subclasses set the AVA urls,
+    uninove_ra, uninove_senha, _cookieJar, _mainPage and _mainFormFields.
+    """
+
+    def exportCookies(self):
+        """Returns session cookies as a list of dicts."""
+        return [{
+            'name': cookie.name,
+            'value': cookie.value,
+            'domain': cookie.domain,
+            'path': cookie.path
+        } for cookie in self._cookieJar]
+
+    def importCookies(self, cookies):
+        for cookie in cookies:
+            self._cookieJar.set_cookie(
+                create_cookie(
+                    cookie['name'],
+                    cookie['value'],
+                    domain=cookie['domain'],
+                    path=cookie['path']))
+
+    def clearCookies(self):
+        self._cookieJar.clear()
+        self._mainPage = None
+
+    def _loginFlow(self):
+        loginPage = yield 'GET', self.AVA_LOGIN_URL, {}
+
+        form = parsers.parseForm(loginPage.content, fieldName='user')
+        if form is None:
+            raise ScraperError(u'Formulário de login não encontrado.')
+        action, fields = form
+
+        data = dict(fields)
+        data['user'] = self.uninove_ra
+        data['Password'] = self.uninove_senha
+
+        response = yield 'POST', urljoin(str(loginPage.url), action), {
+            'data': data
+        }
+
+        if 'principal' not in str(response.url):
+            message = parsers.parseLoginError(response.content)
+            # no AVA message means we don't know what happened, so let the
+            # caller fall back to the browser
+            if message is None:
+                raise ScraperError(u'Login não redirecionou ao AVA.')
+            raise LoginError(message)
+
+        self._mainPage = response.content
+
+    def _sessionFlow(self):
+        response = yield 'GET', self.AVA_MAIN_URL, {}
+        if 'principal' not in str(response.url) or not parsers.hasElement(
+                response.content, 'frm-principal'):
+            return False
+
+        self._mainPage = response.content
+        return True
+
+    def _mainPageFlow(self):
+        if self._mainPage is None:
+            self._mainPage = (yield 'GET', self.AVA_MAIN_URL, {}).content
+        return self._mainPage
+
+    def _disciplineFlow(self, idCurso, codCurso):
+        """Posts the main page form the same way AVAscraper._fillFormAndSubmit
+        does, selecting the discipline on the AVA session.
+
+        :returns: discipline page response.
+
+        """
+        if self._mainFormFields is None:
+            mainPage = yield from self._mainPageFlow()
+            form = parsers.parseForm(mainPage, formId='frm-principal')
+            if form is None or len(form[1]) < 2:
+                raise WrongPageError(u'Não achou elemento "frm-principal".')
+            self._mainFormFields = form[1]
+
+        fields = dict(self._mainFormFields)
+        fields[self._mainFormFields[0][0]] = idCurso
+        fields[self._mainFormFields[1][0]] = codCurso
+
+        response = yield 'POST', self.AVA_FERRAMENTAS_URL, {
+            'data': fields,
+            'headers': {
+                'Referer': self.AVA_MAIN_URL
+            }
+        }
+
+        if 'ferramentas' not in str(response.url):
+            raise WrongPageError(u'Não entrou na página da disciplina.')
+        return response
+
+    def _questionariosFlow(self, idCurso, codCurso):
+        disciplinePage = yield from self._disciplineFlow(idCurso, codCurso)
+        if not parsers.hasAtividadeTab(disciplinePage.content):
+            raise WrongPageError(u'Não entrou na TAB de atividade.')
+
+        atividadePage = yield 'GET', self.AVA_ATIVIDADE_URL, {
+            'headers': {
+                'Referer': str(disciplinePage.url)
+            }
+        }
+        conteudo = parsers.document(atividadePage.content, 'div-conteudo')
+        if not parsers.hasElement(conteudo, 'div-conteudo'):
+            raise WrongPageError(u'Não achou elemento "div-conteudo".')
+
+        return parsers.parseQuestionarios(conteudo)
+
+
+class AVAhttpScraper(AVAhttpFlows, BaseScraper):
+    """
+    Scraper with the same interface as AVAscraper, posting AVA forms
+    directly with requests instead of driving a browser.
+    """
+
+    NAVIGATION_FAILURES = (requests.RequestException, )
+
+    def __init__(self,
+                 uninove_ra=None,
+                 uninove_senha=None,
+                 debug=False,
+                 timeout=10,
+                 guard=None,
+                 controller=None):
+        self.uninove_ra = uninove_ra
+        self.uninove_senha = uninove_senha
+        self.debug = debug
+        self.TIMEOUT_TIME = timeout
+        self.guard = guard
+        self.controller = controller
+
+        self.AVA_LOGIN_URL = AVA_BASE_URL + '/index.php'
+        self.AVA_MAIN_URL = AVA_BASE_URL + '/principal.php'
+        self.AVA_FERRAMENTAS_URL = AVA_BASE_URL + '/ferramentas/principal.php'
+        self.AVA_ATIVIDADE_URL = AVA_BASE_URL + '/ferramentas/atividade.php'
+
+        self.session = requests.Session()
+        self.session.mount('https://', _ADAPTER)
+        self.session.mount('http://', _ADAPTER)
+        self.session.headers.update({'User-Agent': USER_AGENT})
+        self._cookieJar = self.session.cookies
+
+        self._mainPage = None
+        self._mainFormFields = None
+
+    @step('loginAva')
+    def loginAva(self):
+        """Login into AVA website posting the login form.
+
+        :raises LoginError: AVA refused the credentials.
+        :raises ScraperError: login page did not look as expected.
+        """
+        self._run(self._loginFlow())
+
+    def sessionIsValid(self):
+        """Probes AVA main page, the session is valid if it isn't sent back
+        to the login page.
+
+        :rtype: bool
+
+        """
+        return self._run(self._sessionFlow())
+
+    @step('getMaterias')
+    def getMaterias(self, userDisciplines=(), classification=None):
+        """Get all user disciplines IDCurso, CodCurso, Name and if it is online or on-site.
+
+        :param userDisciplines: idCurso list of disciplines already known.
+        :param classification: ClassificationCache of known disciplines.
+        :returns: list with discipline ID, Cod, Name and isOnline.
+        :rtype: list
+
+        """
+        # parsed once, queries stay inside the menu
+        menu = parsers.document(self._run(self._mainPageFlow()), 'menu0')
+
+        if not parsers.hasElement(menu, 'menu0'):
+            raise WrongPageError(u'Não achou elemento "menu0".')
+
+        materiasLista = parsers.parseMaterias(menu, userDisciplines)
+
+        self.classifyMaterias(materiasLista, classification)
+
+        if self.debug:
+            print(materiasLista)
+
+        return materiasLista
+
+    @step('disciplineIsOnline')
+    def disciplineIsOnline(self, idCurso, codCurso):
+        """Opens discipline page, and checks if it has a Atividade tab.
+
+        :returns: True if discipline has Atividade tab, False if not.
+        :rtype: bool
+
+        """
+        return parsers.hasAtividadeTab(
+            self._run(self._disciplineFlow(idCurso, codCurso)).content)
+
+    @step('getQuestionarios')
+    def getQuestionarios(self, idCurso, codCurso):
+        """Returns user assignments of a discipline.
+
+        :returns: name, status, days_left, type
+        :rtype: list
+
+        """
+        questionariosList = self._run(
+            self._questionariosFlow(idCurso, codCurso))
+
+        if self.debug:
+            print('Questionarios: ')
+            print(questionariosList)
+
+        return questionariosList
+
+    def _run(self, flow):
+        """Makes each request of flow, returning what it returns."""
+        response = None
+        while True:
+            try:
+                method, url, kwargs = flow.send(response)
+            except StopIteration as done:
+                return done.value
+            response = self._request(method, url, **kwargs)
+
+    def _request(self, method, url, **kwargs):
+        try:
+            with self._navigation():
+                response = self.session.request(
+                    method, url, timeout=self.TIMEOUT_TIME, **kwargs)
+                response.raise_for_status()
+        except requests.RequestException:
+            logging.exception(url)
+            raise UnreachableError(u"Não foi possível entrar no site do AVA")
+        return response
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        """
+        Closes session, connections stay in the shared pool.
+        """
+        self.session.cookies.clear()
+        return False
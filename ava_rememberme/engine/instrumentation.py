@@ -0,0 +1,60 @@
+"-*- coding: utf-8 -*-"
+
+import asyncio
+import functools
+from contextlib import ExitStack, contextmanager
+
+# hook(backend, step) -> context manager, entered around every scraper step
+_hooks = []
+
+
+def addStepHook(hook):
+    """Runs hook around every scraper step, such as loginAva, of every
+    backend. Hooks let the app time or trace steps without the engine
+    knowing about it.
+
+    :param hook: callable(backend, step) returning a context manager, it
+    sees the exception when the step fails.
+
+    """
+    _hooks.append(hook)
+
+
+@contextmanager
+def stepContext(backend, step):
+    """Enters every hook around a step that isn't a whole method, such as a
+    single request.
+    """
+    with ExitStack() as stack:
+        for hook in _hooks:
+            stack.enter_context(hook(backend, step))
+        yield
+
+
+def step(name):
+    """Decorates a scraper method as step name, the scraper class name is
+    its backend.
+    """
+
+    def decorator(function):
+        if asyncio.iscoroutinefunction(function):
+
+            @functools.wraps(function)
+            async def wrapper(self, *args, **kwargs):
+                if not _hooks:
+                    return await function(self, *args, **kwargs)
+                with stepContext(type(self).__name__, name):
+                    return await function(self, *args, **kwargs)
+
+            return wrapper
+
+        @functools.wraps(function)
+        def wrapper(self, *args, **kwargs):
+            if not _hooks:
+                return function(self, *args, **kwargs)
+            with stepContext(type(self).__name__, name):
+                return function(self, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,169 @@
+"-*- coding: utf-8 -*-"
+
+import datetime
+import re
+
+import lxml.html
+from lxml import etree
+
+DATE_RE = re.compile(r'(\d+)\/(\d+)\/(\d+)')
+
+
+def _hasClass(name):
+    return ("contains(concat(' ', normalize-space(@class), ' '), ' {} ')"
+            .format(name))
+
+
+# compiled once, evaluated against any page or element, these stay inside
+# the element given, itself included
+MATERIAS = etree.XPath('descendant-or-self::div[@idcurso]')
+MATERIA_NAME = etree.XPath('.//span[{}]'.format(_hasClass('md')))
+
+QUESTIONARIOS = etree.XPath('descendant-or-self::div[{}]'.format(
+    _hasClass('filtro-conteudo')))
+QUESTIONARIO_NAME = etree.XPath('.//span[{}]'.format(
+    _hasClass('marginLeft10')))
+QUESTIONARIO_CODIGO = etree.XPath('.//div[@codigo]/@codigo')
+QUESTIONARIO_STATUS = etree.XPath('.//p[{} and {}]'.format(
+    _hasClass('sm2'), _hasClass('white')))
+QUESTIONARIO_DATAS = etree.XPath('.//div[{}]'.format(_hasClass('bloco-data')))
+
+BY_ID = etree.XPath('//*[@id=$id]')
+FORM_BY_ID = etree.XPath('//form[@id=$id]')
+FORM_BY_FIELD = etree.XPath('//input[@name=$name]/ancestor::form[1]')
+FORM_FIELDS = etree.XPath('.//input[@name]')
+
+
+def document(html, subtree=None):
+    """Parses a page, or a fragment such as an element innerHTML.
+
+    :param html: bytes or str, or an already parsed element.
+    :param subtree: id of the only element that will be queried, returned
+    in place of the page when it has one.
+    :returns: lxml element
+    """
+    if not isinstance(html, etree._Element):
+        try:
+            html = lxml.html.fromstring(html)
+        except etree.ParserError:
+            # empty or whitespace only responses
+            html = lxml.html.Element('html')
+
+    if subtree is None or html.get('id') == subtree:
+        return html
+
+    elements = BY_ID(html, id=subtree)
+    return elements[0] if elements else html
+
+
+def _text(elements):
+    return elements[0].text_content() if elements else None
+
+
+def parseMaterias(html, userDisciplines=()):
+    """Parses AVA main page menu, returning all user disciplines.
+
+    :param html: main page or #menu0 innerHTML.
+    :param userDisciplines: idCurso list of disciplines to skip.
+    :returns: list of dicts with IDCurso, CodCurso and Name.
+    :rtype: list
+
+    """
+    materiasLista = []
+    for materia in MATERIAS(document(html, 'menu0')):
+        idCurso = int(materia.get('idcurso'))
+
+        if idCurso in userDisciplines:
+            continue
+
+        materiasLista.append({
+            'IDCurso': idCurso,
+            'CodCurso': materia.get('codigo'),
+            'Name': _text(MATERIA_NAME(materia))
+        })
+
+    return materiasLista
+
+
+def parseQuestionarios(html):
+    """Parses AVA Atividade tab, returning discipline assignments.
+
+    :param html: atividade page or #div-conteudo innerHTML.
+    :returns: list of dicts with name, codigo, status, days_left, type.
+    :rtype: list
+
+    """
+    questionariosList = []
+    for questionario in QUESTIONARIOS(document(html, 'div-conteudo')):
+        datas = DATE_RE.findall(_text(QUESTIONARIO_DATAS(questionario)))
+
+        questionariosList.append({
+            'name': _text(QUESTIONARIO_NAME(questionario)),
+            'codigo': QUESTIONARIO_CODIGO(questionario)[0],
+            'status': _text(QUESTIONARIO_STATUS(questionario)),
+            'days_left': _endOfDay(*datas[1]),
+            'type': u'Questionário'
+        })
+
+    return questionariosList
+
+
+def _endOfDay(day, month, year):
+    return datetime.datetime(int(year), int(month), int(day), 23, 59, 59)
+
+
+def hasElement(html, elementId):
+    """Checks if page has an element with given id.
+
+    :returns: True if found.
+    :rtype: bool
+
+    """
+    return len(BY_ID(document(html), id=elementId)) > 0
+
+
+def hasAtividadeTab(html):
+    """Checks if discipline page has an Atividade tab, meaning it is online.
+
+    :rtype: bool
+
+    """
+    return hasElement(html, 'aba-atividade')
+
+
+def parseLoginError(html):
+    """Returns AVA login error message, None if there is none.
+
+    :rtype: str
+
+    """
+    message = _text(BY_ID(document(html), id='lb_conteudo'))
+    if message is None:
+        return None
+    return message.strip() or None
+
+
+def parseForm(html, formId=None, fieldName=None):
+    """Finds a form by id, or by one of its input names, returning its
+    action and inputs in document order.
+
+    :param formId: form id attribute.
+    :param fieldName: name of an input inside the form.
+    :returns: tuple (action, [(name, value), ...]), None if not found.
+    :rtype: tuple
+
+    """
+    page = document(html)
+
+    forms = []
+    if formId is not None:
+        forms = FORM_BY_ID(page, id=formId)
+    elif fieldName is not None:
+        forms = FORM_BY_FIELD(page, name=fieldName)
+
+    if not forms:
+        return None
+
+    fields = [(field.get('name'), field.get('value', ''))
+              for field in FORM_FIELDS(forms[0])]
+    return (forms[0].get('action', ''), fields)
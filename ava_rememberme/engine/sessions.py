@@ -0,0 +1,59 @@
+"-*- coding: utf-8 -*-"
+
+import hashlib
+import json
+
+from cryptography.fernet import Fernet, InvalidToken
+
+
+class SessionStore:
+    """
+    Encrypted cache of AVA session cookies, one entry per user, kept in
+    Redis so every worker can reuse a login made by another one.
+    """
+
+    KEY = 'ava:session:{}'
+
+    def __init__(self, client, secret, ttl=20 * 60):
+        """
+        :param client: redis.Redis client.
+        :param secret: Fernet key used to encrypt cookies.
+        :param ttl: seconds a session is kept, shorter than AVA's own expiry.
+        """
+        self.client = client
+        self.fernet = Fernet(secret)
+        self.ttl = ttl
+
+    def _key(self, uninove_ra):
+        # RA is hashed so keys don't reveal who is logged in
+        return self.KEY.format(
+            hashlib.sha256(str(uninove_ra).encode('utf-8')).hexdigest())
+
+    def load(self, uninove_ra):
+        """Returns cached cookies of user, None if there are none.
+
+        :returns: list of dicts with name, value, domain and path.
+        :rtype: list
+
+        """
+        token = self.client.get(self._key(uninove_ra))
+        if token is None:
+            return None
+
+        try:
+            return json.loads(self.fernet.decrypt(token).decode('utf-8'))
+        except InvalidToken:
+            self.invalidate(uninove_ra)
+            return None
+
+    def save(self, uninove_ra, cookies):
+        """Caches cookies of user for ttl seconds.
+
+        :param cookies: list of dicts with name, value, domain and path.
+
+        """
+        token = self.fernet.encrypt(json.dumps(cookies).encode('utf-8'))
+        self.client.setex(self._key(uninove_ra), self.ttl, token)
+
+    def invalidate(self, uninove_ra):
+        self.client.delete(self._key(uninove_ra))
@@ -0,0 +1,130 @@
+"-*- coding: utf-8 -*-"
+
+import collections
+import threading
+import time
+
+from selenium.common.exceptions import TimeoutException
+from selenium.webdriver.support.ui import WebDriverWait
+
+# true once the document finished loading and jQuery, which AVA uses to load
+# parts of its pages, has no request in flight
+PAGE_READY_SCRIPT = ("return document.readyState === 'complete' && "
+                     "(!window.jQuery || window.jQuery.active === 0);")
+
+
+class LatencyTracker:
+    """
+    Rolling samples of how long each AVA page takes to get ready, used to
+    size waits from the observed latency instead of fixed timeouts.
+    """
+
+    def __init__(self,
+                 window=200,
+                 minSamples=20,
+                 percentile=0.99,
+                 factor=2.0,
+                 minTimeout=1.0,
+                 maxTimeout=15.0,
+                 defaultTimeout=5.0):
+        """
+        :param window: samples kept per page.
+        :param minSamples: samples needed before defaultTimeout is replaced.
+        :param percentile: latency percentile the timeout is based on.
+        :param factor: timeout is percentile latency times factor.
+        """
+        self.window = window
+        self.minSamples = minSamples
+        self.percentile = percentile
+        self.factor = factor
+        self.minTimeout = minTimeout
+        self.maxTimeout = maxTimeout
+        self.defaultTimeout = defaultTimeout
+
+        self._samples = collections.defaultdict(
+            lambda: collections.deque(maxlen=self.window))
+        self._lock = threading.Lock()
+
+    def record(self, page, seconds):
+        with self._lock:
+            self._samples[page].append(seconds)
+
+    def quantile(self, page, q):
+        """Returns the q quantile of page latency, None without samples."""
+        with self._lock:
+            samples = sorted(self._samples[page])
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+    def timeout(self, page):
+        """Returns how long to wait for page.
+
+        :rtype: float
+
+        """
+        with self._lock:
+            count = len(self._samples[page])
+        if count < self.minSamples:
+            return self.defaultTimeout
+
+        timeout = self.quantile(page, self.percentile) * self.factor
+        return min(self.maxTimeout, max(self.minTimeout, timeout))
+
+    def stats(self):
+        """Returns p50 and p99 latency and current timeout of every page.
+
+        :rtype: dict
+
+        """
+        with self._lock:
+            pages = list(self._samples)
+        return {
+            page: {
+                'p50': self.quantile(page, 0.5),
+                'p99': self.quantile(page, 0.99),
+                'timeout': self.timeout(page)
+            }
+            for page in pages
+        }
+
+
+# shared by every scraper of the process
+PAGE_LATENCY = LatencyTracker()
+
+
+def waitUntil(driver, page, condition, tracker=PAGE_LATENCY):
+    """Waits for condition with a timeout sized from page latency, recording
+    how long it took. A wait that times out is recorded as taking the whole
+    timeout, the page took at least that long, so a slower AVA raises the
+    timeout instead of failing every wait.
+
+    :param page: name the latency is tracked under.
+    :param condition: WebDriverWait condition.
+    :returns: condition result.
+    :raises TimeoutException: condition wasn't met in time.
+
+    """
+    timeout = tracker.timeout(page)
+    start = time.monotonic()
+    try:
+        result = WebDriverWait(
+            driver, timeout, poll_frequency=0.05).until(condition)
+    except TimeoutException:
+        tracker.record(page, max(timeout, time.monotonic() - start))
+        raise
+    tracker.record(page, time.monotonic() - start)
+    return result
+
+
+def waitPageReady(driver, page, tracker=PAGE_LATENCY):
+    """Waits for the document and its XHR requests to finish, so elements can
+    then be looked up once, without waiting for ones that won't appear.
+
+    :param page: page name, readiness latency is tracked as <page>:ready.
+    :raises TimeoutException: page didn't finish loading in time.
+
+    """
+    return waitUntil(
+        driver, page + ':ready',
+        lambda driver: driver.execute_script(PAGE_READY_SCRIPT), tracker)
@@ -0,0 +1,64 @@
+"""Content hashes of the last activity list stored for each user, so a
+refresh that scraped exactly the same list can skip the database.
+"""
+
+import hashlib
+import json
+
+from ava_rememberme.cache import getRedis
+
+FINGERPRINT_KEY = 'ava:fingerprint:{}'
+
+# fingerprints expire so every user is written at least once a week, even
+# if the database was changed behind the refresh back
+FINGERPRINT_TTL = 7 * 24 * 60 * 60
+
+
+def fingerprint(assignments):
+    """Hashes a parsed activity list, ignoring its order.
+
+    :param assignments: list of dicts returned by getQuestionariosAll.
+    :returns: hex digest
+    :rtype: str
+
+    """
+    rows = sorted(
+        (str(assignment['idCurso']), str(assignment['codigo']),
+         assignment['status'], assignment['days_left'].isoformat(),
+         assignment['name'], assignment['type'])
+        for assignment in assignments)
+    return hashlib.sha1(json.dumps(rows).encode('utf-8')).hexdigest()
+
+
+def markUnchanged(results):
+    """Fingerprints scraped results. The ones equal to the stored fingerprint
+    get unchanged set and their assignments dropped.
+
+    :param results: list of dicts with user_id, assignments and error.
+
+    """
+    scraped = [result for result in results if result['error'] is None]
+    if not scraped:
+        return
+
+    stored = getRedis().mget([
+        FINGERPRINT_KEY.format(result['user_id']) for result in scraped
+    ])
+
+    for result, previous in zip(scraped, stored):
+        result['fingerprint'] = fingerprint(result['assignments'])
+        if previous is not None and \
+           previous.decode('utf-8') == result['fingerprint']:
+            result['unchanged'] = True
+            result['assignments'] = None
+
+
+def saveFingerprints(results):
+    """Stores fingerprints of results already committed to the database."""
+    pipeline = getRedis().pipeline()
+    for result in results:
+        if result.get('fingerprint') is not None:
+            pipeline.setex(
+                FINGERPRINT_KEY.format(result['user_id']), FINGERPRINT_TTL,
+                result['fingerprint'])
+    pipeline.execute()
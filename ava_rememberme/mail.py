@@ -1,5 +1,27 @@
-import requests
+import json
+import os
 import re
+import time
+
+import requests
+from urllib3.exceptions import NewConnectionError
+
+from ava_rememberme.metrics import MAILGUN_RESPONSES, MAILGUN_SECONDS
+
+MAILGUN_API_URL = os.environ.get('MAILGUN_API_URL',
+                                 'https://api.mailgun.net/v3')
+
+# most recipients Mailgun accepts in a single batch message
+BATCH_SIZE = 1000
+# Mailgun refuses messages over 25MB, recipient variables included, this
+# leaves room for the form encoding
+MAX_MESSAGE_BYTES = 20 * 1024 * 1024
+MAX_RETRIES = 5
+# longest Retry-After waited for, beyond it the 429 is returned
+MAX_RETRY_AFTER = 60
+
+# keep-alive connections to Mailgun, shared by every message of the process
+_SESSION = requests.Session()
 
 
 class Mailgun():
@@ -31,19 +53,110 @@ class Mailgun():
         if self.content is None:
             raise Exception("Can't send a NoneType message")
 
-        mailStatus = requests.post(
-            "https://api.mailgun.net/v3/{}/messages".format(self.subdomain),
-            auth=("api", "{}".format(self.apikey)),
-            data={
-                "from": "Lembretes AVA <LembretesAVA@{}>".format(self.domain),
-                "to": ["{}".format(self.recipient)],
-                "subject": "{}".format(self.subject),
-                "html": self.content
-            })
+        return self._post({
+            "from": self._sender(),
+            "to": ["{}".format(self.recipient)],
+            "subject": "{}".format(self.subject),
+            "html": self.content
+        })
+
+    def sendBatch(self, recipientVariables):
+        """Sends one personalised copy of the message to each recipient, up to
+        BATCH_SIZE recipients and MAX_MESSAGE_BYTES per API call. Subject
+        and content may use %recipient.<key>% placeholders, filled from
+        recipientVariables.
+
+        :param recipientVariables: dict mapping each email to a dict of
+        variables.
+        :returns: list of response objects, one per API call.
+        :rtype: list
+
+        """
+
+        if self.content is None:
+            raise Exception("Can't send a NoneType message")
+
+        # the html is sent with every batch, variables fill the rest
+        budget = MAX_MESSAGE_BYTES - len(self.content.encode('utf-8'))
+
+        batches = [{}]
+        size = 0
+        for email, variables in recipientVariables.items():
+            length = len(json.dumps({email: variables}))
+            if batches[-1] and (len(batches[-1]) == BATCH_SIZE
+                                or size + length > budget):
+                batches.append({})
+                size = 0
+            batches[-1][email] = variables
+            size += length
+
+        responses = []
+        for batch in batches:
+            if not batch:
+                continue
+            responses.append(
+                self._post({
+                    "from": self._sender(),
+                    "to": list(batch),
+                    "subject": "{}".format(self.subject),
+                    "html": self.content,
+                    "recipient-variables": json.dumps(batch)
+                }))
+
+        return responses
+
+    def _sender(self):
+        return "Lembretes AVA <LembretesAVA@{}>".format(self.domain)
+
+    def _post(self, data):
+        """Posts message, retrying with exponential backoff while Mailgun
+        rate limits it or can't be connected to. Other failures aren't
+        retried: Mailgun may have accepted the message, and posting it again
+        would deliver it twice.
+        """
+        url = "{}/{}/messages".format(MAILGUN_API_URL, self.subdomain)
+
+        for attempt in range(MAX_RETRIES + 1):
+            start = time.monotonic()
+            try:
+                mailStatus = _SESSION.post(
+                    url, auth=("api", "{}".format(self.apikey)), data=data)
+            except requests.RequestException as e:
+                MAILGUN_RESPONSES.labels('error').inc()
+                if not _notSent(e) or attempt == MAX_RETRIES:
+                    raise
+                time.sleep(2**attempt)
+                continue
+            finally:
+                MAILGUN_SECONDS.observe(time.monotonic() - start)
+            MAILGUN_RESPONSES.labels(mailStatus.status_code).inc()
+
+            if mailStatus.status_code != 429 or attempt == MAX_RETRIES:
+                return mailStatus
+
+            retryAfter = mailStatus.headers.get('Retry-After', '')
+            wait = int(retryAfter) if retryAfter.isdigit() else 2**attempt
+            if wait > MAX_RETRY_AFTER:
+                return mailStatus
+            time.sleep(wait)
 
         return mailStatus
 
 
+def _notSent(error):
+    """Checks if a request failed before reaching Mailgun, while connecting.
+
+    :param error: requests.RequestException raised by the post.
+    :rtype: bool
+
+    """
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    reason = getattr(error.args[0], 'reason', None) if error.args else None
+    return isinstance(error, requests.ConnectionError) and isinstance(
+        reason, NewConnectionError)
+
+
 def fileToHTML(filePath):
     """Transforms whole HTML file into a string variable
 
@@ -0,0 +1,229 @@
+"""Prometheus metrics of the scrapers, Celery tasks, database and Mailgun.
+
+Celery forks its pool processes, so for their metrics to be served
+PROMETHEUS_MULTIPROC_DIR must point to an empty directory before the worker
+starts: every process writes there and the exporter sums them. The exporter
+runs in the worker main process, on AVA_METRICS_PORT, and also serves the
+fleet-wide concurrency limit and circuit breaker kept in Redis.
+"""
+
+import datetime
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from celery.signals import (before_task_publish, task_postrun, task_prerun,
+                            worker_process_shutdown)
+from prometheus_client import (REGISTRY, CollectorRegistry, Counter, Gauge,
+                               Histogram, multiprocess, start_http_server)
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from sqlalchemy import event
+
+from .engine import AVAscraperFactory
+from .engine.instrumentation import addStepHook
+
+# 0 disables the exporter
+METRICS_PORT = int(os.environ.get('AVA_METRICS_PORT', 9540))
+MULTIPROC_DIR = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+
+# message header with the time the task was published
+SENT_AT_HEADER = 'ava_sent_at'
+
+SECONDS_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 80, 160)
+
+SCRAPER_STEP_SECONDS = Histogram(
+    'ava_scraper_step_seconds',
+    'Time spent in each scraper step, navigation is a single request.',
+    ['backend', 'step'],
+    buckets=SECONDS_BUCKETS)
+SCRAPER_ERRORS = Counter('ava_scraper_errors_total',
+                         'Scraper steps that raised, by exception type.',
+                         ['backend', 'step', 'exception'])
+
+TASK_SECONDS = Histogram(
+    'ava_task_seconds',
+    'Celery task run time.', ['task', 'state'],
+    buckets=SECONDS_BUCKETS + (320, 640, 1280))
+TASK_QUEUE_WAIT_SECONDS = Histogram(
+    'ava_task_queue_wait_seconds',
+    'Time between a task being due, published or its eta, and starting.',
+    ['task'],
+    buckets=SECONDS_BUCKETS + (320, 640, 1280))
+
+DB_STATEMENTS = Counter('ava_db_statements_total', 'SQL statements executed.',
+                        ['task', 'statement'])
+DB_STATEMENTS_PER_TASK = Histogram(
+    'ava_db_statements_per_task',
+    'SQL statements executed by one task run.', ['task'],
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 5000))
+
+MAILGUN_SECONDS = Histogram(
+    'ava_mailgun_request_seconds',
+    'Mailgun API request time.',
+    buckets=SECONDS_BUCKETS)
+MAILGUN_RESPONSES = Counter('ava_mailgun_responses_total',
+                            'Mailgun API responses by status code.',
+                            ['status'])
+
+BROWSER_POOL = Gauge(
+    'ava_browser_pool_browsers',
+    'Browsers of the scraper pools, busy, idle and the maximum allowed.',
+    ['state'],
+    multiprocess_mode='livesum')
+
+STATEMENT_KINDS = {'SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH'}
+
+# task running in this thread, and its statement count
+_running = threading.local()
+
+
+@contextmanager
+def _observeStep(backend, step):
+    start = time.monotonic()
+    try:
+        yield
+    except Exception as e:
+        SCRAPER_ERRORS.labels(backend, step, type(e).__name__).inc()
+        raise
+    finally:
+        SCRAPER_STEP_SECONDS.labels(backend,
+                                    step).observe(time.monotonic() - start)
+
+
+addStepHook(_observeStep)
+
+
+def _updatePool():
+    for state, browsers in AVAscraperFactory.occupancy().items():
+        BROWSER_POOL.labels(state).set(browsers)
+
+
+@before_task_publish.connect
+def _stampPublish(headers=None, **kwargs):
+    if headers is not None:
+        headers.setdefault(SENT_AT_HEADER, time.time())
+
+
+@task_prerun.connect
+def _taskStarted(task=None, **kwargs):
+    now = time.time()
+    _running.task = task.name
+    _running.start = time.monotonic()
+    _running.statements = 0
+
+    due = getattr(task.request, SENT_AT_HEADER, None)
+    if due is not None:
+        eta = task.request.eta
+        if isinstance(eta, str):
+            eta = datetime.datetime.fromisoformat(eta)
+        if eta is not None:
+            due = max(due, eta.timestamp())
+        TASK_QUEUE_WAIT_SECONDS.labels(task.name).observe(max(0, now - due))
+
+    _updatePool()
+
+
+@task_postrun.connect
+def _taskFinished(task=None, state=None, **kwargs):
+    start = getattr(_running, 'start', None)
+    if start is None:
+        return
+
+    TASK_SECONDS.labels(task.name, state or 'UNKNOWN').observe(
+        time.monotonic() - start)
+    DB_STATEMENTS_PER_TASK.labels(task.name).observe(_running.statements)
+    _running.__dict__.clear()
+
+    _updatePool()
+
+
+@worker_process_shutdown.connect
+def _markProcessDead(**kwargs):
+    if MULTIPROC_DIR is not None:
+        multiprocess.mark_process_dead(os.getpid())
+
+
+def instrumentEngine(engine):
+    """Counts statements executed by engine, by task and kind."""
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def countStatement(conn, cursor, statement, *args):
+        kind = statement.lstrip()[:6].upper().split(None, 1)[:1]
+        task = getattr(_running, 'task', None)
+        if task is not None:
+            _running.statements += 1
+        DB_STATEMENTS.labels(
+            task or 'none',
+            kind[0] if kind and kind[0] in STATEMENT_KINDS else 'OTHER').inc()
+
+
+class FleetCollector:
+    """
+    State shared by every worker through Redis, read when Prometheus
+    scrapes: the AIMDController limit and the AVAGuard circuit breaker.
+    """
+
+    def __init__(self, controller, guard):
+        self.controller = controller
+        self.guard = guard
+
+    def collect(self):
+        try:
+            snapshot = self.controller.snapshot()
+            reopensIn = self.guard.reopensIn()
+        except Exception:
+            logging.exception('Reading fleet metrics from Redis failed')
+            return
+
+        yield GaugeMetricFamily('ava_scrape_concurrency_limit',
+                                'User refreshes allowed in flight.',
+                                snapshot['limit'])
+        yield GaugeMetricFamily('ava_scrape_in_flight',
+                                'User refreshes in flight.',
+                                snapshot['inFlight'])
+
+        changes = CounterMetricFamily(
+            'ava_scrape_concurrency_changes',
+            'Times the concurrency limit was raised or lowered.',
+            labels=['direction'])
+        changes.add_metric(['up'], snapshot['increases'])
+        changes.add_metric(['down'], snapshot['decreases'])
+        yield changes
+
+        if snapshot['p90'] is not None:
+            yield GaugeMetricFamily(
+                'ava_scrape_window_p90_seconds',
+                'p90 request time of the last window voted on.',
+                snapshot['p90'])
+            yield GaugeMetricFamily(
+                'ava_scrape_window_error_ratio',
+                'Failed requests ratio of the last window voted on.',
+                snapshot['errorRate'])
+
+        yield GaugeMetricFamily('ava_circuit_open_seconds',
+                                'Seconds until AVA requests resume.',
+                                reopensIn)
+
+
+def startExporter(controller, guard, port=METRICS_PORT):
+    """Serves metrics of every worker process, and the fleet ones, over
+    HTTP. Runs in the worker main process.
+    """
+    if not port:
+        return
+
+    if MULTIPROC_DIR is not None:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        logging.warning('PROMETHEUS_MULTIPROC_DIR not set, metrics of the '
+                        'pool processes will not be served')
+        registry = REGISTRY
+    registry.register(FleetCollector(controller, guard))
+
+    try:
+        start_http_server(port, registry=registry)
+    except OSError:
+        logging.exception('Metrics exporter not started on port %s', port)
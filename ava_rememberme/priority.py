@@ -0,0 +1,152 @@
+"""Refresh urgency of each user, from how soon their open work is due.
+
+Users with an open assignment due in the next days are refreshed several
+times a day by the urgent lane, at a Celery priority served before the
+daily shard sweeps. Users with no open work back off exponentially: the
+shard sweeps skip them for 1, 2, 4... days, while every refresh that finds
+open work resets them to daily.
+"""
+
+import time
+
+from ava_rememberme.cache import getRedis
+
+# user_id -> when the urgent lane refreshes the user next
+URGENT_KEY = 'ava:refresh:urgent'
+# user_id -> Celery priority of the user refresh
+PRIORITY_KEY = 'ava:refresh:priority'
+# user_id -> refreshes in a row that found no open work
+IDLE_KEY = 'ava:refresh:idle'
+# exists while the user is backing off
+BACKOFF_KEY = 'ava:refresh:backoff:{}'
+
+# Redis serves lower priorities first, and tasks sent without one get 0, so
+# registrations and emails still go ahead of any refresh.
+# (days until the nearest due date, priority, hours between refreshes)
+URGENCY_LEVELS = ((2, 2, 4), (7, 4, 12))
+DAILY_PRIORITY = 6
+IDLE_PRIORITY = 8
+
+MAX_BACKOFF_DAYS = 8
+
+# the urgent lane tries again after this long when a refresh didn't report
+# back, failed users included
+RETRY_SECONDS = 60 * 60
+
+# keeps a backoff alive past the sweep it must skip, sweeps of a shard run
+# about the same time every day
+BACKOFF_SLACK_SECONDS = 60 * 60
+
+
+def urgency(openCount, nearestDue, now):
+    """Returns the priority of a user refresh and the hours between urgent
+    refreshes, None when the daily shard sweep is enough.
+
+    :param openCount: open assignments not yet due.
+    :param nearestDue: due date of the nearest one.
+    :rtype: tuple
+
+    """
+    if not openCount:
+        return IDLE_PRIORITY, None
+
+    daysLeft = (nearestDue - now).total_seconds() / 86400
+    for days, priority, hours in URGENCY_LEVELS:
+        if daysLeft <= days:
+            return priority, hours
+    return DAILY_PRIORITY, None
+
+
+def backoffDays(idleRefreshes):
+    """Days until the next refresh of a user without open work."""
+    return min(MAX_BACKOFF_DAYS, 2**max(0, idleRefreshes - 1))
+
+
+def planRefreshes(userIds, openWork, now):
+    """Schedules the next refresh of users that were just refreshed.
+
+    :param userIds: refreshed users.
+    :param openWork: dict from Users_Assignments.openWork.
+    :param now: naive datetime the open work was counted at.
+
+    """
+    if not userIds:
+        return
+
+    client = getRedis()
+    idle = client.hmget(IDLE_KEY, userIds)
+
+    timestamp = time.time()
+    pipeline = client.pipeline()
+    for userId, idleRefreshes in zip(userIds, idle):
+        openCount, nearestDue = openWork.get(userId, (0, None))
+        priority, hours = urgency(openCount, nearestDue, now)
+        pipeline.hset(PRIORITY_KEY, userId, priority)
+
+        if hours is not None:
+            pipeline.zadd(URGENT_KEY, {userId: timestamp + hours * 3600})
+        else:
+            pipeline.zrem(URGENT_KEY, userId)
+
+        if openCount:
+            pipeline.hdel(IDLE_KEY, userId)
+            pipeline.delete(BACKOFF_KEY.format(userId))
+            continue
+
+        idleRefreshes = int(idleRefreshes or 0) + 1
+        pipeline.hset(IDLE_KEY, userId, idleRefreshes)
+        days = backoffDays(idleRefreshes)
+        if days > 1:
+            pipeline.setex(
+                BACKOFF_KEY.format(userId),
+                (days - 1) * 86400 + BACKOFF_SLACK_SECONDS, 1)
+    pipeline.execute()
+
+
+def backingOff(userIds):
+    """Returns the users the shard sweep should skip.
+
+    :rtype: set
+
+    """
+    if not userIds:
+        return set()
+    flags = getRedis().mget([BACKOFF_KEY.format(userId) for userId in userIds])
+    return {userId for userId, flag in zip(userIds, flags) if flag is not None}
+
+
+def priorities(userIds):
+    """Returns the refresh priority of each user, DAILY_PRIORITY for users
+    never planned.
+
+    :rtype: dict
+
+    """
+    if not userIds:
+        return {}
+    stored = getRedis().hmget(PRIORITY_KEY, userIds)
+    return {
+        userId: int(priority) if priority is not None else DAILY_PRIORITY
+        for userId, priority in zip(userIds, stored)
+    }
+
+
+def claimUrgent(limit):
+    """Returns up to limit users the urgent lane should refresh now, pushing
+    them RETRY_SECONDS ahead so the next tick doesn't pick them again.
+
+    :rtype: list
+
+    """
+    client = getRedis()
+    timestamp = time.time()
+    userIds = [
+        int(userId) for userId in client.zrangebyscore(
+            URGENT_KEY, '-inf', timestamp, start=0, num=limit)
+    ]
+    if userIds:
+        client.zadd(URGENT_KEY, {
+            userId: timestamp + RETRY_SECONDS
+            for userId in userIds
+        })
+    return userIds
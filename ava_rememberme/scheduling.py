@@ -0,0 +1,109 @@
+"""Splits the assignments refresh in shards spread over the day.
+
+Users are assigned to a shard by a hash of their id, and shards to the beat
+ticks of REFRESH_WINDOWS, so every tick refreshes about the same number of
+users. The shard count grows with the number of users, always by powers of
+two, so a growing count splits shards in halves instead of reshuffling
+everyone.
+
+Nothing from the app is imported here, celeryconfig imports it to build
+beat_schedule.
+"""
+
+from celery.schedules import crontab
+
+# local hours, [start, end), when refreshes may run
+REFRESH_WINDOWS = ((0, 24), )
+
+# a beat tick dispatches the shards of its slot every this many minutes,
+# must divide an hour
+REFRESH_TICK_MINUTES = 15
+
+# users refreshed by one shard, on average
+REFRESH_SHARD_SIZE = 250
+
+# Knuth multiplicative hash, spreads sequential user ids over 32 bits
+HASH_MULTIPLIER = 2654435761
+HASH_BITS = 32
+
+
+def shardOf(userId, shards):
+    """Returns the shard of a user, the same as Users.getShard in SQL.
+
+    :rtype: int
+
+    """
+    hashed = (userId * HASH_MULTIPLIER) % 2**HASH_BITS
+    return (hashed * shards) >> HASH_BITS
+
+
+def shardExpression(userId, shards):
+    """Returns the SQL expression of shardOf, for a user id column."""
+    hashed = userId * HASH_MULTIPLIER % 2**HASH_BITS
+    # SQL divides integers rounding down, as >> does
+    return (hashed * shards).op('/')(2**HASH_BITS)
+
+
+def shardCount(users, shardSize=REFRESH_SHARD_SIZE):
+    """Returns how many shards are needed for users, a power of two.
+
+    :rtype: int
+
+    """
+    shards = 1
+    while shards * shardSize < users:
+        shards *= 2
+    return shards
+
+
+def slotCount(windows=REFRESH_WINDOWS, tickMinutes=REFRESH_TICK_MINUTES):
+    """Returns the number of beat ticks per day, inside windows."""
+    return sum((end - start) * 60 // tickMinutes for start, end in windows)
+
+
+def slotAt(moment,
+           windows=REFRESH_WINDOWS,
+           tickMinutes=REFRESH_TICK_MINUTES):
+    """Returns the slot of the beat tick at moment, None outside windows.
+
+    :param moment: datetime in the Celery timezone.
+    :rtype: int
+
+    """
+    minutes = moment.hour * 60 + moment.minute
+    offset = 0
+    for start, end in windows:
+        if start * 60 <= minutes < end * 60:
+            return offset + (minutes - start * 60) // tickMinutes
+        offset += (end - start) * 60 // tickMinutes
+    return None
+
+
+def shardsForSlot(slot, shards, slots):
+    """Returns the shards refreshed at slot, spreading shards evenly over
+    the slots of the day.
+
+    :rtype: list
+
+    """
+    return [shard for shard in range(shards) if shard * slots // shards == slot]
+
+
+def beatSchedule(name,
+                 task,
+                 windows=REFRESH_WINDOWS,
+                 tickMinutes=REFRESH_TICK_MINUTES):
+    """Returns beat_schedule entries ticking task inside every window, named
+    name-0, name-1...
+    """
+    return {
+        '{}-{}'.format(name, index): {
+            'task':
+            task,
+            'schedule':
+            crontab(
+                minute='*/{}'.format(tickMinutes),
+                hour='{}-{}'.format(start, end - 1))
+        }
+        for index, (start, end) in enumerate(windows)
+    }
@@ -1,95 +1,545 @@
 "-*- coding: utf-8 -*-"
 
+import collections
 import datetime
-import json
 import os
+from contextlib import nullcontext
 
-from celery import current_task
+from celery import chord
+from celery.signals import worker_process_shutdown, worker_ready
 from celery.result import allow_join_result
+from celery.worker.control import inspect_command
 from celery.utils.log import get_task_logger
-from flask import current_app, url_for
-from itsdangerous import URLSafeSerializer, URLSafeTimedSerializer
+from flask import current_app
 
 from ava_rememberme import celery
 
-from .engine.exceptions import LoginError
+from .engine.exceptions import (CircuitOpenError, LoginError, ScraperError,
+                                UnreachableError)
 from .exceptions import AssignmentExpired
-from .mail import Mailgun
+from .email_render import getRenderer
+from .fingerprints import markUnchanged, saveFingerprints
+from .mail import BATCH_SIZE, Mailgun
+from .metrics import startExporter
+from .priority import backingOff, claimUrgent, planRefreshes, priorities
+from .scheduling import (REFRESH_SHARD_SIZE, REFRESH_TICK_MINUTES,
+                         shardCount, shardsForSlot, slotAt, slotCount)
 
 EMAIL_TEMPLATE_LOCATION = "/home/martin/Documentos/Programming/Python/Projetos/Uninove-RememberMe/ava_rememberme/templates/email/"
 EMAIL_DOMAIN = "mg.martinmariano.com"
 DEBUG = True
 
+# browsers kept alive per worker process, and how many users each one
+# serves before being restarted
+SCRAPER_POOL_SIZE = 1
+SCRAPER_MAX_USES = 50
+SCRAPER_CHECKOUT_TIMEOUT = 120
+# block images, fonts, CSS and trackers, see AVAscraper
+SCRAPER_LEAN = True
+
+# 'http' posts AVA forms directly and only falls back to the browser when
+# a page is not understood, 'selenium' always uses the browser
+SCRAPER_BACKEND = 'http'
+
+# AVA logins are cached encrypted in Redis, with the Fernet key from the
+# AVA_SESSION_KEY environment variable, for this many seconds
+AVA_SESSION_TTL = 20 * 60
+
+# chance of probing again a discipline whose modality is already known
+DISCIPLINE_REPROBE_CHANCE = 0.01
+
+# full refreshes run as a chord of per-user tasks ('chord') or inside a
+# single task with the async engine ('async'). Either way, no more than
+# REFRESH_CONCURRENCY users are scraped at the same time
+REFRESH_ENGINE = 'chord'
+REFRESH_CONCURRENCY = 20
+
+# users in flight across the fleet start at REFRESH_CONCURRENCY and adapt
+# down to REFRESH_MIN_CONCURRENCY: halved when the p90 of a window of AVA
+# requests goes over REFRESH_LATENCY_TARGET seconds or more than
+# REFRESH_MAX_ERROR_RATE of them fail, raised by one otherwise
+REFRESH_MIN_CONCURRENCY = 2
+REFRESH_LATENCY_TARGET = 5.0
+REFRESH_MAX_ERROR_RATE = 0.1
+
+# requests to AVA per second, shared by every worker, and how many may go
+# out at once after a quiet period
+AVA_RATE_LIMIT = 5
+AVA_RATE_BURST = 10
+# AVA is left alone for AVA_BREAKER_COOLDOWN seconds after
+# AVA_BREAKER_FAILURES failed requests within AVA_BREAKER_WINDOW seconds
+AVA_BREAKER_FAILURES = 20
+AVA_BREAKER_WINDOW = 60
+AVA_BREAKER_COOLDOWN = 5 * 60
+
 logger = get_task_logger(__name__)
 
 
+_guard = None
+
+
+def _avaGuard():
+    """Returns the rate limit and circuit breaker around AVA requests, one
+    per worker process, sharing its state with the others through Redis.
+    """
+    global _guard
+    if _guard is None:
+        from .cache import getRedis
+        from .engine.guard import AVAGuard
+        _guard = AVAGuard(
+            getRedis(),
+            rate=AVA_RATE_LIMIT,
+            burst=AVA_RATE_BURST,
+            failures=AVA_BREAKER_FAILURES,
+            window=AVA_BREAKER_WINDOW,
+            cooldown=AVA_BREAKER_COOLDOWN)
+    return _guard
+
+
+_controller = None
+
+
+def _concurrencyController():
+    """Returns the AIMD limit of user refreshes in flight, one per worker
+    process, sharing the limit with the others through Redis.
+    """
+    global _controller
+    if _controller is None:
+        from .cache import getRedis
+        from .engine.concurrency import AIMDController
+        _controller = AIMDController(
+            getRedis(),
+            minLimit=REFRESH_MIN_CONCURRENCY,
+            maxLimit=REFRESH_CONCURRENCY,
+            latencyTarget=REFRESH_LATENCY_TARGET,
+            maxErrorRate=REFRESH_MAX_ERROR_RATE)
+    return _controller
+
+
+def _scraperPool():
+    from .engine import AVAscraperFactory
+    AVAscraperFactory.configure(
+        maxInstances=SCRAPER_POOL_SIZE,
+        maxUses=SCRAPER_MAX_USES,
+        timeout=SCRAPER_CHECKOUT_TIMEOUT,
+        lean=SCRAPER_LEAN,
+        guard=_avaGuard(),
+        controller=_concurrencyController())
+    return AVAscraperFactory
+
+
+def _sessionStore():
+    """Returns the AVA login cache, None when AVA_SESSION_KEY isn't set."""
+    secret = os.environ.get('AVA_SESSION_KEY')
+    if secret is None:
+        return None
+
+    from .cache import getRedis
+    from .engine.sessions import SessionStore
+    return SessionStore(getRedis(), secret, ttl=AVA_SESSION_TTL)
+
+
+def _classificationCache():
+    """Returns the shared online/on-site cache of disciplines, backed by
+    Redis and by the Disciplines table.
+    """
+    from .cache import getRedis
+    from .engine.classification import ClassificationCache
+
+    def loadFromDatabase(idCursos):
+        from .database_models import Disciplines
+        from .database import db_session
+        return dict(
+            db_session.query(Disciplines.idCurso, Disciplines.isOnline)
+            .filter(Disciplines.idCurso.in_(idCursos),
+                    Disciplines.isOnline.isnot(None)))
+
+    return ClassificationCache(
+        getRedis(), loadFromDatabase, reprobeChance=DISCIPLINE_REPROBE_CHANCE)
+
+
+def _withScraper(uninove_ra,
+                 uninove_senha,
+                 action,
+                 cached=True,
+                 leased=False):
+    """Logs user in and runs action(scraper), using the HTTP backend first
+    and falling back to a pooled browser when AVA pages didn't look as
+    expected.
+
+    :param action: callable receiving a logged in scraper.
+    :param cached: reuse a cached AVA session instead of logging in.
+    :param leased: wait for a fleet slot first, for refreshes. Requests of
+    users waiting on the site never wait behind them.
+    :returns: whatever action returns.
+    :raises LoginError: AVA refused the credentials.
+    :raises CircuitOpenError: AVA failed too often recently.
+
+    """
+    sessionStore = _sessionStore() if cached else None
+    pool = _scraperPool()
+
+    with pool.lease() if leased else nullcontext():
+        if SCRAPER_BACKEND == 'http':
+            from .engine.http_scraper import AVAhttpScraper
+            try:
+                with AVAhttpScraper(
+                        uninove_ra,
+                        uninove_senha,
+                        debug=DEBUG,
+                        guard=_avaGuard(),
+                        controller=_concurrencyController()) as scraper:
+                    scraper.loginCached(sessionStore)
+                    return action(scraper)
+            # the browser would not do better on an AVA that is down, only
+            # pages it failed to parse are worth another try
+            except (LoginError, CircuitOpenError, UnreachableError):
+                raise
+            except ScraperError as e:
+                logger.warning('HTTP scraper failed, using browser: %s',
+                               e.msg)
+
+        with pool.getInstance(
+                uninove_ra, uninove_senha, debug=DEBUG) as scraper:
+            scraper.loginCached(sessionStore)
+            return action(scraper)
+
+
+@worker_process_shutdown.connect
+def closeScrapers(**kwargs):
+    from .engine import AVAscraperFactory
+    AVAscraperFactory.closeAll()
+
+
+@worker_ready.connect
+def serveMetrics(**kwargs):
+    startExporter(_concurrencyController(), _avaGuard())
+
+
+@inspect_command()
+def scrapeConcurrency(state):
+    """Fleet concurrency limit and how it got there, with celery inspect
+    scrapeConcurrency.
+    """
+    return _concurrencyController().snapshot()
+
+
+@celery.task(ignore_result=True)
+def databaseRefreshShards():
+    """Beat tick of the assignments refresh. Dispatches the shards whose
+    slot is the current one, spaced over the tick so the load stays flat.
+    The shard count follows the number of active users, see
+    ava_rememberme.scheduling.
+    """
+
+    from .database_models import Users
+
+    slot = slotAt(celery.now())
+    if slot is None:
+        return
+
+    shards = shardCount(Users.countActive())
+    due = shardsForSlot(slot, shards, slotCount())
+    if not due:
+        return
+
+    # while AVA is down the shards wait for the breaker to close
+    paused = _avaGuard().reopensIn()
+    if paused:
+        logger.warning('AVA paused, slot %s delayed %.0fs', slot, paused)
+
+    spacing = REFRESH_TICK_MINUTES * 60 / len(due)
+    for position, shard in enumerate(due):
+        databaseRefreshAssignments.apply_async(
+            kwargs={'shard': shard, 'shards': shards},
+            countdown=paused + position * spacing)
+
+    logger.info('Slot %s: dispatched shards %s of %s', slot, due, shards)
+
+
+@celery.task(ignore_result=True)
+def databaseRefreshUrgent():
+    """Beat tick of the urgent lane. Refreshes, at most one shard worth at a
+    time, the users whose open work is due soon and whose urgent refresh
+    time came, see ava_rememberme.priority. Skipped while AVA is paused,
+    users stay due until a tick finds it back.
+    """
+    if _avaGuard().reopensIn():
+        return
+
+    userIds = claimUrgent(REFRESH_SHARD_SIZE)
+    if userIds:
+        databaseRefreshAssignments(userIds=userIds)
+
+
 @celery.task()
-def databaseRefreshAssignments():
+def databaseRefreshAssignments(shard=None, shards=1, userIds=None):
     """Refresh the whole database, logging in each user on AVA Platform,
     only for online disiciplines and checks if user has a new assignment,
     then updates the database.
+
+    Users are scraped in parallel by a chord of scrapeUserAssignments
+    tasks, split in as many lanes as the current fleet concurrency limit,
+    and storeRefreshedAssignments writes all results once they are done.
+    With REFRESH_ENGINE = 'async' the whole sweep runs inside this task
+    instead.
+
+    Each user is scraped at its priority from ava_rememberme.priority, and
+    shard sweeps skip users backing off for having no open work.
+
+    :param shard: only refresh users of this shard, all users if None.
+    :param shards: total number of shards.
+    :param userIds: only refresh these users.
     """
 
-    from .database_models import Users, Assignments, Users_Assignments
-    from .database import db_session
+    from .database_models import Users
 
-    allUsers = Users.get()
+    if userIds is not None:
+        users = Users.getByIds(userIds)
+    elif shard is not None:
+        users = Users.getShard(shard, shards)
+        idle = backingOff([user.user_id for user in users])
+        users = [user for user in users if user.user_id not in idle]
+    else:
+        users = Users.get()
 
-    for user in allUsers:
+    payloads = []
+    for user in users:
 
         # skip cycle if user not confirmed
         if not user.isActive():
             continue
 
-        # if user doesnt has any discipline
-        if user.Disciplines is None or not user.Disciplines:
-            continue
-
         onlineDisciplines = [
             discipline for discipline in user.Disciplines
             if discipline.isOnline is True
         ]
 
-        userAssignments = getUserAssignments.apply_async(
-            (user.uninove_ra, user.uninove_senha, onlineDisciplines[0].idCurso,
-             onlineDisciplines[0].codCurso))
-
-        assignmentList = None
-        with allow_join_result():
-            assignmentList = userAssignments.get()
-
-        if DEBUG is True:
-            print('Substask return:')
-            print(assignmentList)
-            print('User assignment list size: {}'.format(len(assignmentList)))
-
-        for assignment in assignmentList:
-            currentAssignment = Assignments.query.filter(
-                Assignments.codigo == assignment['codigo']).first()
-
-            # if it doesn't exist, create new assignment
-            if currentAssignment is None:
-                currentAssignment = Assignments(
-                    assignment['name'], assignment['codigo'],
-                    onlineDisciplines[0].discipline_id, assignment['type'],
-                    assignment['days_left'])
-                db_session.add(currentAssignment)
-
-            # if this assignment already exists in intermediate table,
-            # update the status, else we append assignment to user
-            userAssignmentsEntry = Users_Assignments.query.filter(
-                Users_Assignments.user_id == user.user_id, Users_Assignments.
-                assignment_id == currentAssignment.assignment_id).first()
-
-            if userAssignmentsEntry is not None:
-                userAssignmentsEntry.status = Users_Assignments.formatStatus(
-                    assignment['status'])
-            else:
-                user.assignments.append(
-                    [currentAssignment, assignment['status']])
+        # if user doesnt has any online discipline
+        if not onlineDisciplines:
+            continue
+
+        payloads.append({
+            'user_id': user.user_id,
+            'uninove_ra': user.uninove_ra,
+            'uninove_senha': user.uninove_senha,
+            'disciplines': [(discipline.idCurso, discipline.codCurso)
+                            for discipline in onlineDisciplines]
+        })
+
+    if not payloads:
+        return {'refreshed': 0, 'skipped': 0, 'failed': 0}
+
+    if REFRESH_ENGINE == 'async':
+        from .engine.async_scraper import runFetchAssignments
+        results = runFetchAssignments(
+            payloads,
+            concurrency=REFRESH_CONCURRENCY,
+            sessionStore=_sessionStore(),
+            guard=_avaGuard(),
+            controller=_concurrencyController(),
+            debug=DEBUG)
+        markUnchanged(results)
+        return storeRefreshedAssignments(results)
+
+    # each chunk runs its users one after the other, so about as many users
+    # as the limit are scraped at the same time. Leases keep it when the
+    # limit drops mid sweep
+    chunkSize = -(-len(payloads) // _concurrencyController().limit())
+
+    # one chord per priority, so urgent users don't wait behind others
+    userPriorities = priorities([payload['user_id'] for payload in payloads])
+    levels = collections.defaultdict(list)
+    for payload in payloads:
+        levels[userPriorities[payload['user_id']]].append((payload, ))
+
+    for priority, arguments in sorted(levels.items()):
+        header = scrapeUserAssignments.chunks(arguments, chunkSize).group()
+        chord(header)(storeRefreshedAssignments.s(), priority=priority)
+
+    return {'dispatched': len(payloads)}
+
+
+@celery.task()
+def scrapeUserAssignments(payload):
+    """Scrapes one user for the refresh chord. Errors are returned instead of
+    raised, so one failing user doesn't stop the chord callback.
+
+    :param payload: dict with user_id, uninove_ra, uninove_senha and
+    disciplines, a list of (idCurso, codCurso) pairs.
+    :returns: dict with user_id, assignments and error, see markUnchanged
+    for the fingerprint keys.
+    :rtype: dict
+
+    """
+    result = {
+        'user_id': payload['user_id'],
+        'assignments': None,
+        'error': None
+    }
+    try:
+        result['assignments'] = _withScraper(
+            payload['uninove_ra'],
+            payload['uninove_senha'],
+            lambda scraper: scraper.getQuestionariosAll(
+                payload['disciplines']),
+            leased=True)
+    except Exception as e:
+        logger.exception('Scraping user %s failed', payload['user_id'])
+        result['error'] = '{}: {}'.format(
+            type(e).__name__, getattr(e, 'msg', e))
+
+    markUnchanged([result])
+    return result
+
+
+@celery.task()
+def storeRefreshedAssignments(results):
+    """Chord callback writing every scraped user to the database in bulk.
+    If the batch can't be written, users are retried one by one so a single
+    bad row only costs its own user. Users whose activity list didn't change
+    since the last refresh are only counted. Users that weren't scraped
+    because AVA was paused are refreshed again once the circuit breaker
+    closes.
+
+    :param results: scrapeUserAssignments results, possibly grouped in
+    chunks.
+    :returns: dict with refreshed, skipped (unchanged) and failed user
+    counts.
+    :rtype: dict
+
+    """
+    from .database import db_session
 
+    # chunked headers return one list of results per chunk
+    if results and isinstance(results[0], list):
+        results = [result for chunk in results for result in chunk]
+
+    scraped = []
+    unchanged = []
+    paused = []
+    failed = 0
+    for result in results:
+        if result['error'] is not None:
+            logger.warning('User %s not refreshed: %s', result['user_id'],
+                           result['error'])
+            failed += 1
+            if result['error'].startswith(CircuitOpenError.__name__):
+                paused.append(result['user_id'])
+        elif result.get('unchanged'):
+            unchanged.append(result['user_id'])
+        else:
+            scraped.append(result)
+
+    skipped = len(unchanged)
+    logger.info('%s users unchanged since last refresh', skipped)
+
+    if paused:
+        _retryPaused(paused)
+
+    if not scraped:
+        _planRefreshes(unchanged)
+        return {'refreshed': 0, 'skipped': skipped, 'failed': failed}
+
+    try:
+        _storeUserAssignments(scraped)
         db_session.commit()
-    return 'done'
+    except Exception:
+        db_session.rollback()
+        logger.exception('Bulk store failed, storing users one by one')
+    else:
+        saveFingerprints(scraped)
+        _planRefreshes(unchanged +
+                       [result['user_id'] for result in scraped])
+        return {
+            'refreshed': len(scraped),
+            'skipped': skipped,
+            'failed': failed
+        }
+
+    stored = []
+    for result in scraped:
+        try:
+            _storeUserAssignments([result])
+            db_session.commit()
+        except Exception:
+            db_session.rollback()
+            logger.exception('Storing user %s failed', result['user_id'])
+            failed += 1
+            continue
+        saveFingerprints([result])
+        stored.append(result['user_id'])
+
+    _planRefreshes(unchanged + stored)
+    return {'refreshed': len(stored), 'skipped': skipped, 'failed': failed}
+
+
+def _retryPaused(userIds):
+    """Refreshes again, once AVA is back, users that were skipped while the
+    circuit breaker was open.
+    """
+    reopensIn = _avaGuard().reopensIn()
+    databaseRefreshAssignments.apply_async(
+        kwargs={'userIds': userIds},
+        countdown=reopensIn + REFRESH_TICK_MINUTES * 60)
+    logger.warning('%s users paused, retrying in %.0fs', len(userIds),
+                   reopensIn + REFRESH_TICK_MINUTES * 60)
+
+
+def _planRefreshes(userIds):
+    """Schedules the next refresh of users whose assignments are now up to
+    date in the database. A failure only costs the planning, the refresh is
+    already stored.
+    """
+    from .database_models import Users_Assignments
+
+    if not userIds:
+        return
+
+    now = datetime.datetime.now()
+    try:
+        planRefreshes(userIds, Users_Assignments.openWork(userIds, now), now)
+    except Exception:
+        logger.exception('Planning next refreshes failed')
+
+
+def _storeUserAssignments(results):
+    """Upserts scraped assignments and the status of each user on them, with
+    a handful of statements for the whole batch. Caller commits.
+
+    :param results: list of dicts with user_id and assignments, as returned
+    by getQuestionariosAll.
+
+    """
+    from .database_models import Assignments, Disciplines, Users_Assignments
+    from .database import db_session
+
+    rows = [(result['user_id'], assignment) for result in results
+            for assignment in result['assignments']]
+
+    if DEBUG is True:
+        print('Assignments to store: {}'.format(len(rows)))
+
+    if not rows:
+        return
+
+    idCursos = {assignment['idCurso'] for _, assignment in rows}
+    disciplineIds = dict(
+        db_session.query(Disciplines.idCurso, Disciplines.discipline_id)
+        .filter(Disciplines.idCurso.in_(idCursos)))
+
+    assignmentIds = Assignments.bulkUpsert([{
+        'name': assignment['name'],
+        'codigo': assignment['codigo'],
+        'discipline_id': disciplineIds.get(assignment['idCurso']),
+        'type': assignment['type'],
+        'dueDate': assignment['days_left']
+    } for _, assignment in rows])
+
+    Users_Assignments.bulkUpsert(
+        [(userId, assignmentIds[int(assignment['codigo'])],
+          Users_Assignments.formatStatus(assignment['status']))
+         for userId, assignment in rows])
 
 
 @celery.task(ignore_result=True)
@@ -97,47 +547,120 @@ def databaseRefreshDisciplines():
     """Refresh the whole database, logging in each user on AVA Platform,
     gathers all disciplines with any assignment or forum with a due date,
     then updates the database.
+
+    Users are scraped in parallel by a chord of scrapeUserDisciplines
+    tasks, split in as many lanes as the current fleet concurrency limit,
+    and storeRefreshedDisciplines writes all results once they are done.
+    The async engine only fetches assignments, so REFRESH_ENGINE doesn't
+    apply here.
     """
 
-    from .database_models import Users, Disciplines
-    from .database import db_session
+    from .database_models import Users
 
-    allUsers = Users.get()
+    payloads = [({
+        'user_id': user.user_id,
+        'uninove_ra': user.uninove_ra,
+        'uninove_senha': user.uninove_senha,
+        'known': Users.getIDcursoList(user)
+    }, ) for user in Users.get() if user.isActive()]
 
-    for user in allUsers:
-        print(user)
+    if not payloads:
+        return
+
+    chunkSize = -(-len(payloads) // _concurrencyController().limit())
+    header = scrapeUserDisciplines.chunks(payloads, chunkSize).group()
+    chord(header)(storeRefreshedDisciplines.s())
+
+
+@celery.task()
+def scrapeUserDisciplines(payload):
+    """Scrapes the disciplines of one user for the refresh chord. Errors are
+    returned instead of raised, so one failing user doesn't stop the chord
+    callback.
+
+    :param payload: dict with user_id, uninove_ra, uninove_senha and known,
+    the idCurso list of disciplines already stored.
+    :returns: dict with user_id, disciplines, as returned by getMaterias,
+    and error.
+    :rtype: dict
+
+    """
+    result = {
+        'user_id': payload['user_id'],
+        'disciplines': None,
+        'error': None
+    }
+    try:
+        result['disciplines'] = _withScraper(
+            payload['uninove_ra'],
+            payload['uninove_senha'],
+            lambda scraper: scraper.getMaterias(
+                payload['known'], _classificationCache()),
+            leased=True)
+    except Exception as e:
+        logger.exception('Scraping disciplines of user %s failed',
+                         payload['user_id'])
+        result['error'] = '{}: {}'.format(
+            type(e).__name__, getattr(e, 'msg', e))
+    return result
 
-        # skip cycle if user not confirmed
-        if not user.isActive():
-            continue
 
-        disciplineList = None
-        result = getAllDisciplines.apply_async((user.uninove_ra,
-                                                user.uninove_senha,
-                                                Users.getIDcursoList(user)))
-        with allow_join_result():
-            disciplineList = result.get()
+@celery.task()
+def storeRefreshedDisciplines(results):
+    """Chord callback storing the disciplines found for each user, and
+    whether each one is online. Each user is committed on its own, so a bad
+    row only costs its own user.
+
+    :param results: scrapeUserDisciplines results, grouped in chunks.
+    :returns: dict with refreshed and failed user counts.
+    :rtype: dict
+
+    """
+    from .database_models import Users, Disciplines
+    from .database import db_session
 
-        # user with error on login, or if no new disciplines are found
-        if not disciplineList:
+    results = [result for chunk in results for result in chunk]
+    users = {
+        user.user_id: user
+        for user in Users.getByIds(
+            [result['user_id'] for result in results])
+    }
+
+    refreshed = 0
+    failed = 0
+    for result in results:
+        user = users.get(result['user_id'])
+        if result['error'] is not None or user is None:
+            logger.warning('Disciplines of user %s not refreshed: %s',
+                           result['user_id'], result['error'])
+            failed += 1
             continue
 
-        for discipline in disciplineList:
-
-            currentDiscipline = Disciplines.query.filter(
-                Disciplines.idCurso == discipline['IDCurso']).first()
-            # if discipline doesnt exists, then insert and associate user
-            if currentDiscipline is None:
-                currentDiscipline = Disciplines(user.user_id,
-                                                str.title(discipline['Name']),
-                                                discipline['isOnline'],
-                                                discipline['IDCurso'],
-                                                discipline['CodCurso'])
-            currentDiscipline.users.append(user)
-            db_session.add(currentDiscipline)
+        try:
+            for discipline in result['disciplines']:
+                currentDiscipline = Disciplines.query.filter(
+                    Disciplines.idCurso == discipline['IDCurso']).first()
+                # if discipline doesnt exists, then insert and associate user
+                if currentDiscipline is None:
+                    currentDiscipline = Disciplines(
+                        user.user_id, str.title(discipline['Name']),
+                        discipline['isOnline'], discipline['IDCurso'],
+                        discipline['CodCurso'])
+                # a re-probe found that the discipline changed modality
+                elif currentDiscipline.isOnline != discipline['isOnline']:
+                    currentDiscipline.isOnline = discipline['isOnline']
+                currentDiscipline.users.append(user)
+                db_session.add(currentDiscipline)
             db_session.commit()
+        except Exception:
+            db_session.rollback()
+            logger.exception('Storing disciplines of user %s failed',
+                             result['user_id'])
+            failed += 1
+            continue
+        refreshed += 1
 
-    return 'done'
+    return {'refreshed': refreshed, 'failed': failed}
 
 
 @celery.task(ignore_result=True)
@@ -151,29 +674,16 @@ def databaseSendDueDates():
 
     from .database_models import Users
 
-    allUsers = Users.get()
     DAYS_TO_REMEMBER = [30, 15, 7, 3, 2, 1]
 
-    for user in allUsers:
-
-        # skip cycle if user not confirmed
-        if not user.isActive():
-            continue
+    reminders = [(user.email, user.nome, materias)
+                 for user, materias in Users.getReminders(DAYS_TO_REMEMBER)]
 
-        materias = Users.getAssignments(user, status=1)
-
-        # if any user assignment meets day requirements, shoot email and iterates to next user
-        try:
-            for index, materia in materias.items():
-                for assignment in materia:
-                    print(assignment)
-                    if assignment['dias'] in DAYS_TO_REMEMBER:
-                        emailSendDueDates.apply_async(
-                            (user.email, user.nome,
-                             current_app.config['SECRET_KEY'], materias))
-                        raise StopIteration
-        except StopIteration:
-            continue
+    # Mailgun takes up to BATCH_SIZE personalised copies per API call
+    for start in range(0, len(reminders), BATCH_SIZE):
+        emailSendDueDatesBatch.apply_async(
+            (reminders[start:start + BATCH_SIZE],
+             current_app.config['SECRET_KEY']))
 
 
 @celery.task()
@@ -185,15 +695,13 @@ def registerUserChecker(uninove_ra, uninove_senha):
     :returns: tuple, [0] True or False, [1] message
 
     """
-    from .engine import AVAscraper
-    with AVAscraper(debug=DEBUG) as scraper:
-        scraper.uninove_ra = uninove_ra
-        scraper.uninove_senha = uninove_senha
-        try:
-            scraper.loginAva()
-        except LoginError as e:
-            return (False, e.msg)
-        return (True, )
+    try:
+        # credentials are being checked, so never trust a cached session
+        _withScraper(
+            uninove_ra, uninove_senha, lambda scraper: None, cached=False)
+    except LoginError as e:
+        return (False, e.msg)
+    return (True, )
 
 
 @celery.task()
@@ -206,20 +714,16 @@ def getUserAssignments(uninove_ra, uninove_senha, idCurso, codCurso):
     :rtype: dict
 
     """
-    from .engine import AVAscraper
-    with AVAscraper(debug=DEBUG) as scraper:
-        scraper.uninove_ra = uninove_ra
-        scraper.uninove_senha = uninove_senha
-        try:
-            scraper.loginAva()
-        except LoginError as e:
-            return False
-        questionarios = scraper.getQuestionarios(idCurso, codCurso)
-        return questionarios
+    try:
+        return _withScraper(
+            uninove_ra, uninove_senha,
+            lambda scraper: scraper.getQuestionarios(idCurso, codCurso))
+    except LoginError:
+        return False
 
 
 @celery.task()
-def getAllDisciplines(uninove_ra, uninove_senha, userDisciplines=False):
+def getAllDisciplines(uninove_ra, uninove_senha, userDisciplines=()):
     """Get all users disciplines and checks if they are on-site or online.
 
     :param uninove_ra: string, user RA
@@ -228,16 +732,13 @@ def getAllDisciplines(uninove_ra, uninove_senha, userDisciplines=False):
     :rtype: list
 
     """
-    from .engine import AVAscraper
-    with AVAscraper(debug=DEBUG) as scraper:
-        scraper.uninove_ra = uninove_ra
-        scraper.uninove_senha = uninove_senha
-        try:
-            scraper.loginAva()
-        except LoginError as e:
-            return False
-        materiasList = scraper.getMaterias(userDisciplines)
-        return materiasList
+    try:
+        return _withScraper(
+            uninove_ra, uninove_senha,
+            lambda scraper: scraper.getMaterias(
+                userDisciplines, _classificationCache()))
+    except LoginError:
+        return False
 
 
 @celery.task()
@@ -256,17 +757,8 @@ def emailSendConfirmation(userEmail, userName, secret):
     newMail = Mailgun(APIKEY, EMAIL_DOMAIN)
     newMail.recipient = userEmail
     newMail.subject = 'Lembretes configurados com sucesso.'
-
-    emailTemplate = current_app.jinja_env.get_template(
-        "/email/confirmation.html")
-
-    newToken = URLSafeTimedSerializer(secret, salt='user-confirmation')
-    token = newToken.dumps(userEmail)
-
-    with current_app.app_context(), current_app.test_request_context():
-        newMail.content = emailTemplate.render(
-            userName=userName,
-            action_url=url_for('confirm', token=token, _external=True))
+    newMail.content = getRenderer().renderConfirmation(
+        userEmail, userName, secret)
 
     response = newMail.send()
 
@@ -285,27 +777,40 @@ def emailSendDueDates(userEmail, userName, secret, materias):
     :rtype:
 
     """
+    rendered = getRenderer().renderDueDates(
+        [(userEmail, userName, materias)], secret)[userEmail]
+
     APIKEY = os.environ.get('MAILGUN_API')
     newMail = Mailgun(APIKEY, EMAIL_DOMAIN)
     newMail.recipient = userEmail
-    newMail.subject = 'Você possui {} atividades pendentes.'.format(
-        len(materias))
+    newMail.subject = rendered['subject']
+    newMail.content = rendered['html']
 
-    emailTemplate = current_app.jinja_env.get_template(
-        "/email/assignments.html")
+    response = newMail.send()
 
-    newToken = URLSafeSerializer(secret, salt='user-unsubscribe')
-    token = newToken.dumps(userEmail)
+    return response.status_code
 
-    with current_app.app_context(), current_app.test_request_context():
-        newMail.content = emailTemplate.render(
-            userName=userName,
-            action_url=url_for('unsubscribe', token=token, _external=True),
-            materias=materias)
 
-    response = newMail.send()
+@celery.task()
+def emailSendDueDatesBatch(reminders, secret):
+    """Send due dates email to many users with Mailgun batch sending, the
+    template once and each user's own fields through recipient variables.
 
-    return response.status_code
+    :param reminders: list of (userEmail, userName, materias) tuples.
+    :param secret: flask config secret
+    :returns: status code of each Mailgun API call.
+    :rtype: list
+
+    """
+    APIKEY = os.environ.get('MAILGUN_API')
+    newMail = Mailgun(APIKEY, EMAIL_DOMAIN)
+    newMail.subject = '%recipient.subject%'
+    newMail.content, recipientVariables = getRenderer().renderDueDatesBatch(
+        reminders, secret)
+
+    responses = newMail.sendBatch(recipientVariables)
+
+    return [response.status_code for response in responses]
 
 
 @celery.task()
@@ -323,8 +828,7 @@ def emailNoMoreAssignments(userEmail, userName):
     newMail = Mailgun(APIKEY, EMAIL_DOMAIN)
     newMail.recipient = userEmail
     newMail.subject = 'Não existem mais atividades pendentes.'
-
-    newMail.contentFromFile('./templates/email/confirmation.html', userName)
+    newMail.content = getRenderer().renderNoMoreAssignments(userName)
 
     response = newMail.send()
 
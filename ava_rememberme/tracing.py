@@ -0,0 +1,228 @@
+"""OpenTelemetry traces from the Flask request through Celery tasks down to
+each scraper step and SQL statement.
+
+AVA_TRACE_EXPORT picks where spans go: a file path appends them as JSON
+lines, 'otlp' sends them to the collector at OTEL_EXPORTER_OTLP_ENDPOINT
+(needs the otlp extra), and unset leaves tracing off. The trace context
+travels in Celery message headers, so a sign-up, from the index view to the
+confirmation email, or a whole beat tick of the refresh sweep is one trace.
+"""
+
+import functools
+import os
+
+from celery.signals import (after_task_publish, before_task_publish,
+                            task_failure, task_postrun, task_prerun)
+from opentelemetry import context, propagate, trace
+from opentelemetry.trace import SpanKind, Status, StatusCode
+from sqlalchemy import event
+
+from .engine.instrumentation import addStepHook
+
+TRACE_EXPORT = os.environ.get('AVA_TRACE_EXPORT')
+SERVICE_NAME = os.environ.get('OTEL_SERVICE_NAME', 'ava_rememberme')
+
+# message headers holding the trace context, see W3C trace context
+CONTEXT_HEADERS = ('traceparent', 'tracestate')
+
+_tracer = trace.get_tracer(__name__)
+
+# task id -> span of a message being published, or of a running task and
+# the token to restore the previous context
+_publishing = {}
+_running = {}
+
+
+def enabled():
+    return bool(TRACE_EXPORT)
+
+
+def setupTracing():
+    """Installs the span exporter and the Celery and scraper hooks, if
+    AVA_TRACE_EXPORT is set. Spans are exported by a background thread,
+    which the SDK restarts in forked worker processes.
+    """
+    if not enabled():
+        return
+
+    from opentelemetry.sdk.resources import Resource
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import (BatchSpanProcessor,
+                                                ConsoleSpanExporter)
+
+    if TRACE_EXPORT == 'otlp':
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import \
+            OTLPSpanExporter
+        exporter = OTLPSpanExporter()
+    else:
+        exporter = ConsoleSpanExporter(
+            out=open(TRACE_EXPORT, 'a', buffering=1),
+            formatter=lambda span: span.to_json(indent=None) + '\n')
+
+    provider = TracerProvider(
+        resource=Resource.create({'service.name': SERVICE_NAME}))
+    provider.add_span_processor(BatchSpanProcessor(exporter))
+    trace.set_tracer_provider(provider)
+
+    addStepHook(_stepSpan)
+    before_task_publish.connect(_startPublish)
+    after_task_publish.connect(_endPublish)
+    task_prerun.connect(_startTask)
+    task_failure.connect(_failTask)
+    task_postrun.connect(_endTask)
+
+
+def traced(name):
+    """Decorates a function to run inside a span called name."""
+
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with _tracer.start_as_current_span(name):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def carrier():
+    """Returns the current trace context as a dict, to be stored along with
+    work that resumes later, in another request.
+
+    :rtype: dict
+
+    """
+    headers = {}
+    propagate.inject(headers)
+    return headers
+
+
+def resumed(name, headers):
+    """Returns a context manager running a span called name as a child of
+    the context saved by carrier, or in a new trace without one.
+    """
+    return _tracer.start_as_current_span(
+        name, context=propagate.extract(headers or {}))
+
+
+def _stepSpan(backend, step):
+    return _tracer.start_as_current_span(
+        '{}.{}'.format(backend, step), attributes={'scraper.backend': backend})
+
+
+def _startPublish(sender=None, headers=None, **kwargs):
+    if headers is None:
+        return
+    span = _tracer.start_span(
+        'publish {}'.format(sender),
+        kind=SpanKind.PRODUCER,
+        attributes={'celery.task_id': headers.get('id')})
+    propagate.inject(headers, context=trace.set_span_in_context(span))
+    _publishing[headers.get('id')] = span
+
+
+def _endPublish(headers=None, **kwargs):
+    span = _publishing.pop((headers or {}).get('id'), None)
+    if span is not None:
+        span.end()
+
+
+def _startTask(task_id=None, task=None, **kwargs):
+    parent = propagate.extract({
+        header: getattr(task.request, header)
+        for header in CONTEXT_HEADERS
+        if getattr(task.request, header, None) is not None
+    })
+    span = _tracer.start_span(
+        task.name,
+        context=parent,
+        kind=SpanKind.CONSUMER,
+        attributes={'celery.task_id': task_id})
+    _running[task_id] = (span,
+                         context.attach(trace.set_span_in_context(span)))
+
+
+def _failTask(task_id=None, exception=None, **kwargs):
+    running = _running.get(task_id)
+    if running is not None:
+        running[0].record_exception(exception)
+        running[0].set_status(Status(StatusCode.ERROR))
+
+
+def _endTask(task_id=None, state=None, **kwargs):
+    running = _running.pop(task_id, None)
+    if running is None:
+        return
+    span, token = running
+    span.set_attribute('celery.state', state or 'UNKNOWN')
+    span.end()
+    context.detach(token)
+
+
+def instrumentApp(app):
+    """Runs every Flask request inside a span, the root of the traces it
+    starts.
+    """
+    if not enabled():
+        return
+
+    from flask import g, request
+
+    @app.before_request
+    def startRequestSpan():
+        span = _tracer.start_span(
+            '{} {}'.format(request.method, request.url_rule or request.path),
+            kind=SpanKind.SERVER,
+            attributes={
+                'http.method': request.method,
+                'http.target': request.path
+            })
+        g.traceSpan = span
+        g.traceToken = context.attach(trace.set_span_in_context(span))
+
+    @app.teardown_request
+    def endRequestSpan(exception=None):
+        span = g.pop('traceSpan', None)
+        if span is None:
+            return
+        if exception is not None:
+            span.record_exception(exception)
+            span.set_status(Status(StatusCode.ERROR))
+        span.end()
+        context.detach(g.pop('traceToken'))
+
+
+def traceEngine(engine):
+    """Runs every SQL statement of engine in a span."""
+    if not enabled():
+        return
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def startStatementSpan(conn, cursor, statement, parameters, execution,
+                           executemany):
+        if execution is None:
+            return
+        kind = statement.lstrip()[:6].upper().split(None, 1)[:1]
+        execution._traceSpan = _tracer.start_span(
+            kind[0] if kind else 'SQL',
+            kind=SpanKind.CLIENT,
+            attributes={
+                'db.system': engine.dialect.name,
+                'db.statement': statement
+            })
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def endStatementSpan(conn, cursor, statement, parameters, execution,
+                         executemany):
+        span = getattr(execution, '_traceSpan', None)
+        if span is not None:
+            span.end()
+
+    @event.listens_for(engine, 'handle_error')
+    def failStatementSpan(exceptionContext):
+        span = getattr(exceptionContext.execution_context, '_traceSpan', None)
+        if span is not None:
+            span.record_exception(exceptionContext.original_exception)
+            span.set_status(Status(StatusCode.ERROR))
+            span.end()
@@ -1,19 +1,39 @@
-from flask import (current_app, flash, redirect, render_template, request,
-                   url_for)
+import json
+import os
+
+from cryptography.fernet import Fernet, InvalidToken
+from flask import (current_app, flash, jsonify, redirect, render_template,
+                   request, url_for)
 from itsdangerous import (BadSignature, BadTimeSignature, URLSafeSerializer,
                           URLSafeTimedSerializer)
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm.exc import NoResultFound
 
 from ava_rememberme import app
+from ava_rememberme.cache import getRedis
 from ava_rememberme.database import db_session
 from ava_rememberme.database_models import Profiles, Users
+from ava_rememberme.email_render import getRenderer
 from ava_rememberme.engine.exceptions import LoginError
 from ava_rememberme.forms import RegisterForm
 from ava_rememberme.tasks import (databaseRefreshAssignments,
                                   databaseRefreshDisciplines,
                                   databaseSendDueDates, emailSendConfirmation,
                                   emailSendDueDates, registerUserChecker)
+from ava_rememberme.tracing import carrier, resumed, traced
+
+# pending sign-ups, waiting for the AVA login check, encrypted as they
+# hold the AVA password
+REGISTRATION_KEY = 'registration:{}'
+REGISTRATION_TTL = 60 * 10
+
+# Fernet key of pending sign-ups, from the AVA_REGISTRATION_KEY environment
+# variable. It must be the same on every web worker and survive restarts, as
+# the status poll may reach another worker than the sign-up
+if os.environ.get('AVA_REGISTRATION_KEY') is None:
+    raise RuntimeError('AVA_REGISTRATION_KEY is not set, generate one with '
+                       'cryptography.fernet.Fernet.generate_key()')
+_registrationFernet = Fernet(os.environ['AVA_REGISTRATION_KEY'])
 
 
 @app.route('/', methods=('GET', 'POST'))
@@ -24,32 +44,24 @@ def index():
     if request.method == 'POST':
 
         if form.validate():
-            novoUsuario = Users(form.email.data, form.nome.data,
-                                form.uninoveRA.data, form.uninoveSenha.data)
-
+            # AVA login is checked by a worker, the user is only saved once
+            # registerStatus sees it succeed
             registerTask = registerUserChecker.apply_async(
-                args=(novoUsuario.uninove_ra, novoUsuario.uninove_senha))
-            results = registerTask.get()
-            print(results)
-
-            # redirect uninove's message to user
-            if not results[0]:
-                flash(results[1], 'error')
-                return redirect(url_for('index'))
-
-            try:
-                userWithSettingsCommit(novoUsuario)
-            except IntegrityError:
-                flash(u'Esse email ou RA já está cadastrado em nosso sistema.',
-                      'integrity')
-                return redirect(url_for('index'))
-
-            emailSendConfirmation.delay(novoUsuario.email, novoUsuario.nome,
-                                        current_app.config['SECRET_KEY'])
-            flash(
-                u'Um email foi enviado  para {}. Por favor confirme para começar utilizar o serviço.'.
-                format(novoUsuario.email), 'success')
-            return redirect(url_for('index'))
+                args=(form.uninoveRA.data, form.uninoveSenha.data))
+
+            getRedis().setex(
+                REGISTRATION_KEY.format(registerTask.id), REGISTRATION_TTL,
+                _registrationFernet.encrypt(
+                    json.dumps({
+                        'email': form.email.data,
+                        'nome': form.nome.data,
+                        'uninove_ra': form.uninoveRA.data,
+                        'uninove_senha': form.uninoveSenha.data,
+                        # the sign-up is finished under the same trace
+                        'trace': carrier()
+                    }).encode('utf-8')))
+
+            return redirect(url_for('register', jobId=registerTask.id))
 
         # erro na validação do form
         else:
@@ -59,6 +71,81 @@ def index():
     return render_template("register.html", form=form)
 
 
+@app.route('/registro/<jobId>')
+def register(jobId):
+    return render_template(
+        'register_status.html',
+        status_url=url_for('registerStatus', jobId=jobId))
+
+
+@app.route('/registro/<jobId>/status')
+def registerStatus(jobId):
+    """Polled by register page. Finishes the registration once the worker
+    checked the AVA login.
+
+    :returns: json with state pending, done, or failed and expired with a
+    message for the user to submit the form again.
+
+    """
+
+    registerTask = registerUserChecker.AsyncResult(jobId)
+    if not registerTask.ready():
+        return jsonify(state='pending')
+
+    # only the first poll after the task finished gets the pending data
+    key = REGISTRATION_KEY.format(jobId)
+    pipeline = getRedis().pipeline()
+    pipeline.get(key)
+    pipeline.delete(key)
+    pending = pipeline.execute()[0]
+
+    if pending is not None:
+        try:
+            pending = json.loads(
+                _registrationFernet.decrypt(
+                    pending, ttl=REGISTRATION_TTL).decode('utf-8'))
+        except InvalidToken:
+            pending = None
+
+    if pending is None:
+        return _registerFailed(
+            u'Seu cadastro expirou ou já foi concluído, envie o formulário '
+            u'novamente.', 'expired')
+
+    if registerTask.failed():
+        return _registerFailed(
+            u'Não foi possível checar seu login no AVA, tente novamente.')
+
+    results = registerTask.get()
+    registerTask.forget()
+
+    # redirect uninove's message to user
+    if not results[0]:
+        return _registerFailed(results[1])
+
+    with resumed('finishRegistration', pending.get('trace')):
+        novoUsuario = Users(pending['email'], pending['nome'],
+                            pending['uninove_ra'], pending['uninove_senha'])
+
+        try:
+            userWithSettingsCommit(novoUsuario)
+        except IntegrityError:
+            db_session.rollback()
+            return _registerFailed(
+                u'Esse email ou RA já está cadastrado em nosso sistema.')
+
+        emailSendConfirmation.delay(novoUsuario.email, novoUsuario.nome,
+                                    current_app.config['SECRET_KEY'])
+    flash(
+        u'Um email foi enviado  para {}. Por favor confirme para começar utilizar o serviço.'.
+        format(novoUsuario.email), 'success')
+    return jsonify(state='done', redirect=url_for('index'))
+
+
+def _registerFailed(message, state='failed'):
+    return jsonify(state=state, message=message, redirect=url_for('index'))
+
+
 @app.route('/confirm/<token>')
 def confirm(token):
 
@@ -136,23 +223,17 @@ def testaTemplate():
 
     ppt = pprint.PrettyPrinter(indent=4)
 
-    teste = URLSafeTimedSerializer(
-        app.config['SECRET_KEY'], salt='user-confirmation')
-    sent = teste.dumps('martin@hotmail.com.br')
-
     user = Users.query.first()
     materias = Users.getAssignments(user, 1)
 
     ppt.pprint(materias)
 
-    return render_template(
-        '/email/assignments.html',
-        materias=materias,
-        userName=user.nome,
-        uninove_RA=user.uninove_ra,
-        action_url=url_for('unsubscribe', token=sent, _external=True))
+    rendered = getRenderer().renderDueDates(
+        [(user.email, user.nome, materias)], app.config['SECRET_KEY'])
+    return rendered[user.email]['html']
 
 
+@traced('userWithSettingsCommit')
 def userWithSettingsCommit(user):
 
     db_session.add(user)
@@ -0,0 +1,46 @@
+"""unique assignment codigo for bulk upserts
+
+Revision ID: 4b1e9d2a7c3f
+Revises: 311e34abddd7
+Create Date: 2026-10-18 10:12:31.204117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4b1e9d2a7c3f'
+down_revision = '311e34abddd7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # the per row insert path could store an assignment twice, keep the
+    # oldest row of each Codigo and move user links to it
+    op.execute("""
+        UPDATE "Users_Assignments" AS link
+        SET assignment_id = kept.assignment_id
+        FROM "Assignments" AS duplicate, (
+            SELECT "Codigo", min(assignment_id) AS assignment_id
+            FROM "Assignments"
+            WHERE "Codigo" IS NOT NULL
+            GROUP BY "Codigo") AS kept
+        WHERE link.assignment_id = duplicate.assignment_id
+        AND duplicate."Codigo" = kept."Codigo"
+        AND duplicate.assignment_id <> kept.assignment_id
+    """)
+    op.execute("""
+        DELETE FROM "Assignments" AS duplicate
+        USING "Assignments" AS kept
+        WHERE duplicate."Codigo" = kept."Codigo"
+        AND duplicate.assignment_id > kept.assignment_id
+    """)
+    op.drop_index(op.f('ix_Assignments_Codigo'), table_name='Assignments')
+    op.create_index(op.f('ix_Assignments_Codigo'), 'Assignments', ['Codigo'], unique=True)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_Assignments_Codigo'), table_name='Assignments')
+    op.create_index(op.f('ix_Assignments_Codigo'), 'Assignments', ['Codigo'], unique=False)
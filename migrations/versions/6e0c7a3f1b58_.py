@@ -0,0 +1,33 @@
+"""user assignment primary key for bulk upserts
+
+Revision ID: 6e0c7a3f1b58
+Revises: 9d3c51f0e8a2
+Create Date: 2026-10-18 15:41:09.553820
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6e0c7a3f1b58'
+down_revision = '9d3c51f0e8a2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # the table had no key, the per row insert path could link a user to
+    # an assignment twice. The next refresh sets the status of the row kept
+    op.execute("""
+        DELETE FROM "Users_Assignments" AS duplicate
+        USING "Users_Assignments" AS kept
+        WHERE duplicate.user_id = kept.user_id
+        AND duplicate.assignment_id = kept.assignment_id
+        AND duplicate.ctid > kept.ctid
+    """)
+    op.create_primary_key('Users_Assignments_pkey', 'Users_Assignments', ['user_id', 'assignment_id'])
+
+
+def downgrade():
+    op.drop_constraint('Users_Assignments_pkey', 'Users_Assignments', type_='primary')
@@ -0,0 +1,24 @@
+"""index assignment due date for reminder windows
+
+Revision ID: 9d3c51f0e8a2
+Revises: 4b1e9d2a7c3f
+Create Date: 2026-10-18 11:02:47.918305
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9d3c51f0e8a2'
+down_revision = '4b1e9d2a7c3f'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index(op.f('ix_Assignments_Due_Date'), 'Assignments', ['Due_Date'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_Assignments_Due_Date'), table_name='Assignments')
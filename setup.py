@@ -9,7 +9,11 @@ setup(
     include_package_data=True,
     install_requires=[
         'flask', 'flask-security', 'flask-sqlalchemy', 'beautifulsoup4',
-        'selenium', 'celery[redis]', 'requests', 'lxml', 'flask-babel',
-        'flask-migrate', 'gunicorn'
+        'selenium', 'celery[redis]', 'requests', 'httpx', 'lxml',
+        'cryptography', 'msgpack', 'flask-babel', 'flask-migrate', 'gunicorn',
+        'prometheus_client', 'opentelemetry-api', 'opentelemetry-sdk'
     ],
-    extras_require={'psql': ['psycopg2']})
+    extras_require={
+        'psql': ['psycopg2'],
+        'otlp': ['opentelemetry-exporter-otlp-proto-http']
+    })
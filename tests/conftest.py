@@ -0,0 +1,19 @@
+"""Loads ava_rememberme modules without running the package __init__,
+which builds the Flask app and connects to the database.
+"""
+
+import os
+import sys
+import types
+
+from celery import Celery
+
+PACKAGE_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    'ava_rememberme')
+
+if 'ava_rememberme' not in sys.modules:
+    package = types.ModuleType('ava_rememberme')
+    package.__path__ = [PACKAGE_DIR]
+    package.celery = Celery('ava_rememberme')
+    sys.modules['ava_rememberme'] = package
@@ -0,0 +1,58 @@
+from ava_rememberme.engine import parsers
+
+MENU = ('<div id="menu{}">'
+        '<div idcurso="{}" codigo="{}"><span class="md">{}</span></div>'
+        '</div>')
+
+
+def page(*menus):
+    return ('<html><body><div id="header">'
+            '<div idcurso="999" codigo="0"></div></div>{}'
+            '</body></html>').format(''.join(menus))
+
+
+def test_parseMaterias_ignores_menus_after_menu0():
+    html = page(
+        MENU.format(0, 1, '10', 'Cálculo'),
+        MENU.format(1, 2, '20', 'Física'))
+
+    assert [materia['IDCurso']
+            for materia in parsers.parseMaterias(html)] == [1]
+
+
+def test_parseMaterias_of_bytes_and_single_quoted_id():
+    html = page(
+        "<div data-id='menu0'></div>",
+        "<div id='menu0'><div idcurso='1' codigo='10'>"
+        "<span class='md'>Calculo</span></div></div>",
+        MENU.format(1, 2, '20', 'Física')).encode('utf-8')
+
+    assert parsers.parseMaterias(html) == [{
+        'IDCurso': 1,
+        'CodCurso': '10',
+        'Name': 'Calculo'
+    }]
+
+
+def test_parseMaterias_of_menu_innerHTML():
+    innerHTML = '<div idcurso="1" codigo="10"><span class="md">A</span></div>'
+
+    assert [materia['IDCurso']
+            for materia in parsers.parseMaterias(innerHTML)] == [1]
+
+
+def test_parseMaterias_skips_known_disciplines():
+    html = page('<div id="menu0">'
+                '<div idcurso="1" codigo="10"></div>'
+                '<div idcurso="2" codigo="20"></div></div>')
+
+    assert [materia['IDCurso']
+            for materia in parsers.parseMaterias(html, [1])] == [2]
+
+
+def test_document_returns_subtree_element():
+    menu = parsers.document(page(MENU.format(0, 1, '10', 'A')), 'menu0')
+
+    assert menu.get('id') == 'menu0'
+    assert parsers.hasElement(menu, 'menu0')
+    assert parsers.document(menu, 'menu0') is menu
@@ -0,0 +1,36 @@
+import datetime
+
+from ava_rememberme import priority
+
+NOW = datetime.datetime(2018, 10, 1, 12)
+
+
+def dueIn(days):
+    return NOW + datetime.timedelta(days=days)
+
+
+def test_urgency_of_users_without_open_work():
+    assert priority.urgency(0, None, NOW) == (priority.IDLE_PRIORITY, None)
+
+
+def test_urgency_buckets():
+    assert priority.urgency(1, dueIn(0.5), NOW) == (2, 4)
+    assert priority.urgency(3, dueIn(2), NOW) == (2, 4)
+    assert priority.urgency(1, dueIn(2.5), NOW) == (4, 12)
+    assert priority.urgency(1, dueIn(7), NOW) == (4, 12)
+    assert priority.urgency(1, dueIn(7.5), NOW) == (priority.DAILY_PRIORITY,
+                                                    None)
+
+
+def test_urgent_buckets_go_ahead_of_the_daily_sweep():
+    priorities = [level[1] for level in priority.URGENCY_LEVELS]
+
+    assert priorities == sorted(priorities)
+    assert 0 < priorities[0]
+    assert priorities[-1] < priority.DAILY_PRIORITY < priority.IDLE_PRIORITY
+
+
+def test_backoffDays_doubles_up_to_the_maximum():
+    assert [priority.backoffDays(idle) for idle in range(7)] == [
+        1, 1, 2, 4, 8, 8, 8
+    ]
@@ -0,0 +1,56 @@
+from sqlalchemy import (Column, Integer, MetaData, Table, create_engine,
+                        insert, select)
+
+from ava_rememberme import scheduling
+
+# sequential ids, and the largest of an INTEGER column
+USER_IDS = list(range(1, 2001)) + [2**31 - 1]
+
+
+def test_shardExpression_agrees_with_shardOf():
+    metadata = MetaData()
+    users = Table('Users', metadata, Column('user_id', Integer))
+    engine = create_engine('sqlite://')
+    metadata.create_all(engine)
+
+    with engine.begin() as connection:
+        connection.execute(
+            insert(users), [{
+                'user_id': userId
+            } for userId in USER_IDS])
+        for shards in (1, 2, 8, 64):
+            rows = connection.execute(
+                select(users.c.user_id,
+                       scheduling.shardExpression(users.c.user_id, shards)))
+            assert {
+                userId: shard
+                for userId, shard in rows
+            } == {
+                userId: scheduling.shardOf(userId, shards)
+                for userId in USER_IDS
+            }
+
+
+def test_doubling_shards_splits_each_shard_in_two():
+    for userId in USER_IDS:
+        assert scheduling.shardOf(userId, 16) // 2 == scheduling.shardOf(
+            userId, 8)
+
+
+def test_shards_are_about_the_same_size():
+    sizes = [0] * 8
+    for userId in USER_IDS:
+        sizes[scheduling.shardOf(userId, 8)] += 1
+
+    assert max(sizes) - min(sizes) < len(USER_IDS) // 8 // 10
+
+
+def test_shardsForSlot_spreads_every_shard_once():
+    slots = scheduling.slotCount()
+    for shards in (1, 8, 128):
+        spread = [
+            scheduling.shardsForSlot(slot, shards, slots)
+            for slot in range(slots)
+        ]
+        assert sorted(sum(spread, [])) == list(range(shards))
+        assert max(map(len, spread)) - min(map(len, spread)) <= 1
@@ -0,0 +1,129 @@
+import datetime
+
+from ava_rememberme import serialization
+
+DUE = datetime.datetime(2018, 10, 5, 23, 59, 59)
+
+
+def assignment(index, **fields):
+    value = {
+        'name': u'Questionário {}'.format(index),
+        'codigo': str(100000 + index),
+        'status': 'Aberto',
+        'days_left': DUE + datetime.timedelta(days=index),
+        'type': u'Questionário'
+    }
+    value.update(fields)
+    return value
+
+
+def roundTrip(value):
+    return serialization.loads(serialization.dumps(value))
+
+
+def test_datetimes():
+    values = [
+        DUE,
+        DUE.replace(microsecond=123456),
+        datetime.datetime(1960, 1, 1, 12, 30),
+        DUE.replace(tzinfo=datetime.timezone(datetime.timedelta(hours=-3)))
+    ]
+
+    decoded = roundTrip(values)
+
+    assert decoded == values
+    assert [value.tzinfo for value in decoded] == [
+        value.tzinfo for value in values
+    ]
+
+
+def test_nested_dicts_lists_and_bytes():
+    value = {
+        'args': [1, 2.5, None, True, u'ação'],
+        'kwargs': {
+            'userIds': [1, 2],
+            'raw': b'\x00\xff',
+            'at': {
+                'due': DUE
+            }
+        },
+        1: [[], {}]
+    }
+
+    assert roundTrip(value) == value
+
+
+def test_tuples_become_lists():
+    assert roundTrip((1, (2, DUE))) == [1, [2, DUE]]
+
+
+def test_records_with_optional_fields():
+    assignments = [assignment(index, idCurso=250000) for index in range(10)]
+    disciplines = [{
+        'IDCurso': 1,
+        'CodCurso': '10',
+        'Name': u'Cálculo'
+    }, {
+        'IDCurso': 2,
+        'CodCurso': '20',
+        'Name': u'Física',
+        'isOnline': True
+    }]
+
+    assert roundTrip(assignments) == assignments
+    assert roundTrip(assignment(1)) == assignment(1)
+    assert roundTrip(disciplines) == disciplines
+
+
+def test_refresh_results_of_mixed_shapes():
+    results = [{
+        'user_id': 1,
+        'assignments': [assignment(index) for index in range(4)],
+        'error': None,
+        'fingerprint': 'a' * 40
+    }, {
+        'user_id': 2,
+        'assignments': None,
+        'error': None,
+        'fingerprint': 'b' * 40,
+        'unchanged': True
+    }, {
+        'user_id': 3,
+        'assignments': [],
+        'error': u'Não foi possível entrar no site do AVA'
+    }]
+
+    assert roundTrip(results) == results
+
+
+def test_record_columns_keep_values_apart():
+    # equal values of distinct types, and due dates that can't be packed as
+    # seconds
+    assignments = [
+        assignment(index, status=status, days_left=days_left)
+        for index, (status, days_left) in enumerate([
+            (1, None),
+            (True, DUE.replace(microsecond=1)),
+            (1.0, DUE),
+            ('1', DUE),
+        ] * 3)
+    ]
+
+    decoded = roundTrip(assignments)
+
+    assert decoded == assignments
+    assert [type(value['status']) for value in decoded] == [
+        type(value['status']) for value in assignments
+    ]
+
+
+def test_dicts_with_extra_keys_are_not_records():
+    values = [assignment(1), assignment(2, extra=[1])]
+
+    assert roundTrip(values) == values
+
+
+def test_lists_of_lists():
+    value = {'user_id': 1, 'assignments': [[[1]], []], 'error': None}
+
+    assert roundTrip([value, [[[1]]]]) == [value, [[[1]]]]
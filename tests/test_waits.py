@@ -0,0 +1,27 @@
+import pytest
+from selenium.common.exceptions import TimeoutException
+
+from ava_rememberme.engine.waits import LatencyTracker, waitUntil
+
+
+def test_timeouts_raise_the_timeout():
+    tracker = LatencyTracker(
+        window=20, minSamples=5, minTimeout=0.01, maxTimeout=15.0)
+    for _ in range(20):
+        tracker.record('principal', 0.01)
+    fast = tracker.timeout('principal')
+
+    for _ in range(3):
+        with pytest.raises(TimeoutException):
+            waitUntil(None, 'principal', lambda driver: False, tracker)
+
+    assert tracker.timeout('principal') >= 4 * fast
+
+
+def test_timeout_stays_within_bounds():
+    tracker = LatencyTracker(minSamples=1, minTimeout=1.0, maxTimeout=15.0)
+    tracker.record('login', 0.01)
+    assert tracker.timeout('login') == 1.0
+
+    tracker.record('login', 60)
+    assert tracker.timeout('login') == 15.0
@@ -0,0 +1,137 @@
+"""Synthetic AVA pages, with the markup the parsers and scrapers look for.
+
+Served by tools/fake_ava.py and used by the parser benchmark when no
+captured page is given. Sizes can be raised to match real pages, which
+carry a lot of markup around the parts that matter.
+"""
+
+import datetime
+
+PAGE = """<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>{title}</title>
+<link rel="stylesheet" href="/static/ava.css">
+<script src="/static/jquery.js"></script></head>
+<body>
+<div id="topo"><img src="/static/logo.png" alt="AVA">{padding}</div>
+{body}
+<div id="rodape">{padding}</div>
+</body></html>"""
+
+# stands for the stylesheet, scripts, images and web fonts AVA pages load,
+# path -> (content type, size in bytes)
+ASSETS = {
+    '/static/ava.css': ('text/css', 60 * 1024),
+    '/static/jquery.js': ('application/javascript', 90 * 1024),
+    '/static/logo.png': ('image/png', 40 * 1024),
+    '/static/fonte.woff2': ('font/woff2', 50 * 1024),
+}
+
+ASSET_HEADS = {
+    '/static/ava.css': ('@font-face { font-family: "AVA"; '
+                        'src: url(/static/fonte.woff2); }\n'
+                        'body { font-family: "AVA", sans-serif; }\n/*'),
+    '/static/jquery.js': 'window.jQuery = {active: 0};\n/*',
+    '/static/logo.png': '\x89PNG\r\n\x1a\n',
+}
+
+# stands for the headers, menus and scripts around the relevant markup
+PADDING = '<div class="item"><a href="#">link</a><span>texto</span></div>'
+
+LOGIN = """<form id="frm-login" method="post" action="index.php">
+<input type="text" name="user" value="">
+<input type="password" name="Password" value="">
+<input type="hidden" name="acao" value="login">
+<input type="submit" value="Entrar">
+</form>{error}"""
+
+LOGIN_ERROR = '<span id="lb_conteudo">{}</span>'
+
+MAIN = """<form id="frm-principal" method="post" action="ferramentas/principal.php">
+<input type="hidden" name="idCurso" value="">
+<input type="hidden" name="codCurso" value="">
+</form>
+<div id="menu0">{materias}</div>"""
+
+MATERIA = """<div idcurso="{idCurso}" codigo="{codCurso}" class="item-menu">
+<span class="md">{name}</span></div>"""
+
+DISCIPLINE = """<div id="titulo-disciplina"><p>{name}</p></div>
+<ul class="abas">{tab}<li id="aba-material"><a href="#">Material</a></li></ul>"""
+
+ATIVIDADE_TAB = ('<li id="aba-atividade">'
+                 '<a href="atividade.php">Atividade</a></li>')
+
+ATIVIDADE = '<div id="div-conteudo">{questionarios}</div>'
+
+QUESTIONARIO = """<div class="filtro-conteudo">
+<div codigo="{codigo}"><span class="marginLeft10">{name}</span></div>
+<p class="sm2 white">{status}</p>
+<div class="bloco-data">{start:%d/%m/%Y} a {end:%d/%m/%Y}</div>
+</div>"""
+
+
+def asset(path):
+    """Returns content type and body of an asset, None if there is none at
+    path. Bodies are filler of the asset size.
+    """
+    if path not in ASSETS:
+        return None
+    contentType, size = ASSETS[path]
+    head = ASSET_HEADS.get(path, '').encode('latin-1')
+    tail = b'*/' if contentType in ('text/css',
+                                    'application/javascript') else b''
+    return contentType, head + b'x' * (size - len(head) - len(tail)) + tail
+
+
+def page(title, body, padding=50):
+    return PAGE.format(title=title, body=body, padding=PADDING * padding)
+
+
+def loginPage(error=None, padding=50):
+    return page('AVA - Login',
+                LOGIN.format(
+                    error=LOGIN_ERROR.format(error) if error else ''),
+                padding)
+
+
+def mainPage(disciplines, padding=50):
+    """:param disciplines: list of (idCurso, codCurso, name) tuples."""
+    materias = ''.join(
+        MATERIA.format(idCurso=idCurso, codCurso=codCurso, name=name)
+        for idCurso, codCurso, name in disciplines)
+    return page('AVA - Principal', MAIN.format(materias=materias), padding)
+
+
+def disciplinePage(name, online, padding=50):
+    return page('AVA - Ferramentas',
+                DISCIPLINE.format(
+                    name=name, tab=ATIVIDADE_TAB if online else ''),
+                padding)
+
+
+def atividadePage(activities, padding=50):
+    """:param activities: list of (codigo, name, status, end) tuples, end
+    is a date.
+    """
+    questionarios = ''.join(
+        QUESTIONARIO.format(
+            codigo=codigo,
+            name=name,
+            status=status,
+            start=end - datetime.timedelta(days=14),
+            end=end) for codigo, name, status, end in activities)
+    return page('AVA - Atividade',
+                ATIVIDADE.format(questionarios=questionarios), padding)
+
+
+def sampleDisciplines(count, start=250000):
+    return [(start + i, str(370000 + i), 'DISCIPLINA {}'.format(i))
+            for i in range(count)]
+
+
+def sampleActivities(count, start=100000, today=None):
+    today = today or datetime.date.today()
+    return [(str(start + i), 'Questionario {}'.format(i),
+             'Aberto' if i % 3 else 'Encerrado',
+             today + datetime.timedelta(days=i % 30 - 5))
+            for i in range(count)]
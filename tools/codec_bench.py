@@ -0,0 +1,79 @@
+"""Compares the avapack codec with pickle and json on refresh chord results.
+
+    python tools/codec_bench.py --users 20 --activities 60
+
+Encodes the results a chunk of scrapeUserAssignments returns, checking that
+avapack decodes them back unchanged, and prints bytes and encode/decode
+times of each codec.
+"""
+
+import argparse
+import datetime
+import json
+import os
+import pickle
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ava_rememberme import serialization  # noqa: E402
+
+
+def sampleResults(users, activities):
+    today = datetime.datetime.now().replace(
+        hour=23, minute=59, second=59, microsecond=0)
+    return [{
+        'user_id': user,
+        'assignments': [{
+            'name': u'Questionário {}'.format(index),
+            'codigo': str(100000 + index),
+            'status': 'Aberto' if index % 3 else 'Encerrado',
+            'days_left': today + datetime.timedelta(days=index % 30),
+            'type': u'Questionário',
+            'idCurso': 250000 + index % 6
+        } for index in range(activities)],
+        'error': None,
+        'fingerprint': '{:040x}'.format(user)
+    } for user in range(users)]
+
+
+def timeIt(function, value, runs):
+    start = time.perf_counter()
+    for _ in range(runs):
+        function(value)
+    return (time.perf_counter() - start) / runs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--activities', type=int, default=60)
+    parser.add_argument('--runs', type=int, default=200)
+    args = parser.parse_args()
+
+    results = sampleResults(args.users, args.activities)
+    if serialization.loads(serialization.dumps(results)) != results:
+        sys.exit('avapack did not decode results unchanged')
+
+    codecs = {
+        'pickle': (lambda value: pickle.dumps(value, protocol=4),
+                   pickle.loads),
+        # what Celery's json serializer does, datetimes come back as strings
+        'json': (lambda value: json.dumps(value, default=str).encode('utf-8'),
+                 json.loads),
+        'avapack': (serialization.dumps, serialization.loads),
+    }
+
+    print('{:<10} {:>10} {:>12} {:>12}'.format('codec', 'bytes',
+                                               'encode ms', 'decode ms'))
+    for name, (dumps, loads) in codecs.items():
+        encoded = dumps(results)
+        print('{:<10} {:>10} {:>12.3f} {:>12.3f}'.format(
+            name, len(encoded),
+            timeIt(dumps, results, args.runs) * 1000,
+            timeIt(loads, encoded, args.runs) * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,299 @@
+"""Local stand-in for the AVA pages the scrapers visit.
+
+Run it and point the scrapers to it before starting the workers or
+tools/refresh_bench.py:
+
+    python tools/fake_ava.py --port 8030 --users 500 --latency 0.2
+    export AVA_BASE_URL=http://localhost:8030/seu/AVA
+
+Users have RAs starting at --first-ra, all sharing --password. Each one is
+enrolled in --disciplines disciplines out of a catalog shared by everyone,
+a fraction of them online, each with --activities questionarios. Every
+request waits --latency seconds plus up to --jitter, and a fraction of them,
+given by --error-rate, is answered with 503 as AVA does under load.
+Pages load a stylesheet, a script, an image and a web font from /static,
+about the weight of AVA's, so tools/lean_profile_bench.py has something to
+block.
+
+Like AVA, the selected discipline is kept in the server session, so
+atividade.php shows the last discipline posted to ferramentas/principal.php.
+GET /fake/users returns every user with the password and online disciplines,
+GET /fake/stats the request counts.
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from collections import Counter
+from http.cookies import SimpleCookie
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import ava_pages
+
+SESSION_COOKIE = 'PHPSESSID'
+
+
+class FakeAva:
+    """Users, disciplines and sessions of the fake AVA."""
+
+    def __init__(self,
+                 users=100,
+                 firstRa=900000000,
+                 password='senha',
+                 disciplines=6,
+                 catalog=60,
+                 onlineRatio=0.5,
+                 activities=10,
+                 churn=0.0,
+                 padding=50):
+        """
+        :param disciplines: disciplines of each user.
+        :param catalog: disciplines shared by all users.
+        :param onlineRatio: fraction of the catalog that is online.
+        :param churn: chance an activity status changes between requests,
+        so sweeps find some users with new work.
+        """
+        self.password = password
+        self.churn = churn
+        self.padding = padding
+
+        sampled = ava_pages.sampleDisciplines(max(catalog, disciplines))
+        # exact for catalogs of any size, enrollments are random anyway
+        online = round(onlineRatio * len(sampled))
+
+        self.catalog = {}
+        for index, (idCurso, codCurso, name) in enumerate(sampled):
+            self.catalog[idCurso] = {
+                'codCurso': codCurso,
+                'name': name,
+                'online': index < online,
+                'activities': ava_pages.sampleActivities(
+                    activities, start=100000 + index * activities)
+            }
+
+        # enrollments are derived from the RA, so restarts keep them
+        self.users = {}
+        for ra in range(firstRa, firstRa + users):
+            self.users[str(ra)] = sorted(
+                random.Random(ra).sample(list(self.catalog), disciplines))
+
+        self.sessions = {}
+        self.lock = threading.Lock()
+
+    def login(self, ra, password):
+        """Returns a new session id, None if credentials are wrong."""
+        if ra not in self.users or password != self.password:
+            return None
+        sessionId = uuid.uuid4().hex
+        with self.lock:
+            self.sessions[sessionId] = {'ra': ra, 'discipline': None}
+        return sessionId
+
+    def session(self, sessionId):
+        with self.lock:
+            return self.sessions.get(sessionId)
+
+    def select(self, session, idCurso):
+        """Selects a discipline of the session user, False if not enrolled."""
+        if idCurso not in self.users[session['ra']]:
+            return False
+        session['discipline'] = idCurso
+        return True
+
+    def mainPage(self, ra):
+        return ava_pages.mainPage(
+            [(idCurso, self.catalog[idCurso]['codCurso'],
+              self.catalog[idCurso]['name'])
+             for idCurso in self.users[ra]], self.padding)
+
+    def disciplinePage(self, idCurso):
+        discipline = self.catalog[idCurso]
+        return ava_pages.disciplinePage(discipline['name'],
+                                        discipline['online'], self.padding)
+
+    def atividadePage(self, ra, idCurso):
+        activities = []
+        for codigo, name, status, end in self.catalog[idCurso]['activities']:
+            # status of each user is stable unless churn flips it
+            if random.Random('{}:{}'.format(ra, codigo)).random() < 0.5:
+                status = 'Aberto'
+            if self.churn and random.random() < self.churn:
+                status = random.choice(('Aberto', 'Encerrado'))
+            activities.append((codigo, name, status, end))
+        return ava_pages.atividadePage(activities, self.padding)
+
+    def describeUsers(self):
+        return [{
+            'uninove_ra': ra,
+            'uninove_senha': self.password,
+            'disciplines': [(idCurso, self.catalog[idCurso]['codCurso'],
+                             self.catalog[idCurso]['name'],
+                             self.catalog[idCurso]['online'])
+                            for idCurso in disciplines]
+        } for ra, disciplines in self.users.items()]
+
+
+class FakeAvaHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def _handle(self, method):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        path = urlsplit(self.path).path
+
+        if path.startswith('/fake/'):
+            return self._fake(path)
+
+        self._count(method + ' ' + path)
+        time.sleep(self.server.latency +
+                   random.uniform(0, self.server.jitter))
+
+        if random.random() < self.server.errorRate:
+            self._count('errors')
+            return self._reply(503, u'Serviço indisponível')
+
+        asset = ava_pages.asset(path)
+        if asset is not None:
+            return self._reply(
+                200, asset[1], asset[0],
+                headers={'Cache-Control': 'max-age=86400'})
+
+        if not path.startswith(self.server.prefix + '/'):
+            return self._reply(404, u'Página não encontrada')
+        page = path[len(self.server.prefix) + 1:]
+        form = {
+            name: values[0]
+            for name, values in parse_qs(body.decode('utf-8')).items()
+        }
+
+        if page == 'index.php':
+            return self._login(method, form)
+
+        session = self.server.ava.session(self._sessionId())
+        if session is None:
+            return self._redirect('index.php')
+
+        if page == 'principal.php':
+            return self._reply(200, self.server.ava.mainPage(session['ra']))
+
+        if page == 'ferramentas/principal.php' and method == 'POST':
+            try:
+                idCurso = int(form.get('idCurso', ''))
+            except ValueError:
+                return self._redirect('principal.php')
+            if not self.server.ava.select(session, idCurso):
+                return self._redirect('principal.php')
+            return self._reply(200, self.server.ava.disciplinePage(idCurso))
+
+        if page == 'ferramentas/atividade.php':
+            idCurso = session['discipline']
+            if idCurso is None or not self.server.ava.catalog[idCurso][
+                    'online']:
+                return self._redirect('principal.php')
+            return self._reply(200, self.server.ava.atividadePage(
+                session['ra'], idCurso))
+
+        self._reply(404, u'Página não encontrada')
+
+    def _login(self, method, form):
+        if method == 'GET':
+            return self._reply(200, ava_pages.loginPage())
+
+        sessionId = self.server.ava.login(
+            form.get('user'), form.get('Password'))
+        if sessionId is None:
+            return self._reply(200, ava_pages.loginPage(
+                u'RA ou senha inválidos.'))
+
+        self._redirect('principal.php', {
+            'Set-Cookie': '{}={}; path=/'.format(SESSION_COOKIE, sessionId)
+        })
+
+    def _fake(self, path):
+        if path == '/fake/users':
+            return self._reply(200, json.dumps(
+                self.server.ava.describeUsers()), 'application/json')
+        if path == '/fake/stats':
+            with self.server.countLock:
+                stats = json.dumps(self.server.requests)
+            return self._reply(200, stats, 'application/json')
+        self._reply(404, 'Not found')
+
+    def _count(self, key):
+        with self.server.countLock:
+            self.server.requests[key] += 1
+
+    def _sessionId(self):
+        cookie = SimpleCookie(self.headers.get('Cookie', ''))
+        morsel = cookie.get(SESSION_COOKIE)
+        return morsel.value if morsel is not None else None
+
+    def _redirect(self, page, headers=None):
+        headers = dict(headers or {})
+        headers['Location'] = '{}/{}'.format(self.server.prefix, page)
+        self._reply(302, '', headers=headers)
+
+    def _reply(self, status, content, contentType='text/html; charset=utf-8',
+               headers=None):
+        if isinstance(content, str):
+            content = content.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', contentType)
+        self.send_header('Content-Length', str(len(content)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--port', type=int, default=8030)
+    parser.add_argument('--prefix', default='/seu/AVA')
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--first-ra', type=int, default=900000000)
+    parser.add_argument('--password', default='senha')
+    parser.add_argument('--disciplines', type=int, default=6)
+    parser.add_argument('--catalog', type=int, default=60)
+    parser.add_argument('--online-ratio', type=float, default=0.5)
+    parser.add_argument('--activities', type=int, default=10)
+    parser.add_argument('--churn', type=float, default=0.0)
+    parser.add_argument('--padding', type=int, default=50,
+                        help='filler blocks around each page content')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='seconds added to every request')
+    parser.add_argument('--jitter', type=float, default=0.0,
+                        help='up to this many extra seconds, at random')
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(('localhost', args.port), FakeAvaHandler)
+    server.daemon_threads = True
+    server.ava = FakeAva(args.users, args.first_ra, args.password,
+                         args.disciplines, args.catalog, args.online_ratio,
+                         args.activities, args.churn, args.padding)
+    server.prefix = args.prefix.rstrip('/')
+    server.latency = args.latency
+    server.jitter = args.jitter
+    server.errorRate = args.error_rate
+    server.requests = Counter()
+    server.countLock = threading.Lock()
+    print('Fake AVA listening on http://localhost:{}{}'.format(
+        args.port, server.prefix))
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+"""Measures bytes transferred and page time of AVA pages with the default
+and the lean browser profiles.
+
+    AVA_RA=... AVA_SENHA=... python tools/lean_profile_bench.py --runs 5
+
+Without credentials only the login page is measured. Bytes come from the
+Resource Timing API (transferSize of the document and every resource it
+loaded), so cached responses count as zero, like on the wire.
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ava_rememberme.engine import AVAscraper  # noqa: E402
+
+TRANSFERRED_SCRIPT = """
+var entries = performance.getEntriesByType('navigation')
+    .concat(performance.getEntriesByType('resource'));
+return entries.reduce(function (total, entry) {
+    return total + (entry.transferSize || 0);
+}, 0);
+"""
+
+
+def measure(scraper, step, action, samples):
+    start = time.monotonic()
+    action()
+    elapsed = time.monotonic() - start
+    transferred = scraper.driver.execute_script(TRANSFERRED_SCRIPT)
+    samples.setdefault(step, []).append((elapsed, transferred))
+
+
+def run(lean, credentials, samples):
+    scraper = AVAscraper(*credentials, lean=lean)
+    try:
+        measure(scraper, 'index.php', lambda: scraper.driver.get(
+            scraper.AVA_LOGIN_URL), samples)
+
+        if credentials[0] is None:
+            return
+
+        measure(scraper, 'principal.php', scraper.loginAva, samples)
+        materias = []
+        measure(scraper, 'menu', lambda: materias.extend(
+            scraper.getMaterias()), samples)
+
+        if materias:
+            measure(scraper, 'ferramentas/principal.php',
+                    lambda: scraper.disciplineIsOnline(
+                        materias[0]['IDCurso'], materias[0]['CodCurso']),
+                    samples)
+    finally:
+        scraper.quit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=3)
+    args = parser.parse_args()
+
+    credentials = (os.environ.get('AVA_RA'), os.environ.get('AVA_SENHA'))
+
+    print('{:<8} {:<28} {:>10} {:>12}'.format('profile', 'step', 'p50 (s)',
+                                             'p50 (KiB)'))
+    for lean in (False, True):
+        samples = {}
+        for _ in range(args.runs):
+            run(lean, credentials, samples)
+
+        for step, values in samples.items():
+            print('{:<8} {:<28} {:>10.3f} {:>12.1f}'.format(
+                'lean' if lean else 'default', step,
+                statistics.median(value[0] for value in values),
+                statistics.median(value[1] for value in values) / 1024))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""Local stand-in for the Mailgun messages API.
+
+Run it and point the app to it before starting the workers:
+
+    python tools/mailgun_stub.py --port 8025 --fail-rate 0.1
+    export MAILGUN_API_URL=http://localhost:8025/v3
+
+Every accepted message is appended as a JSON line to --output. A fraction of
+requests, given by --fail-rate, is answered with 429 to exercise retries.
+"""
+
+import argparse
+import json
+import random
+import re
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+MESSAGES_PATH = re.compile(r'^/v3/[^/]+/messages$')
+
+
+class MailgunStubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+        if not MESSAGES_PATH.match(self.path):
+            return self._reply(404, {'message': 'Not found'})
+
+        if random.random() < self.server.failRate:
+            return self._reply(429, {'message': 'Rate limited'},
+                               {'Retry-After': '1'})
+
+        form = parse_qs(body.decode('utf-8'))
+        message = {
+            'to': form.get('to', []),
+            'subject': form.get('subject', [None])[0],
+            'recipient-variables': json.loads(
+                form.get('recipient-variables', ['{}'])[0])
+        }
+        with open(self.server.output, 'a', encoding='utf-8') as output:
+            output.write(json.dumps(message) + '\n')
+
+        self._reply(200, {'id': '<stub@localhost>', 'message': 'Queued.'})
+
+    def _reply(self, status, payload, headers=None):
+        content = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--port', type=int, default=8025)
+    parser.add_argument('--fail-rate', type=float, default=0.0)
+    parser.add_argument('--output', default='mailgun_stub.jsonl')
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(('localhost', args.port), MailgunStubHandler)
+    server.failRate = args.fail_rate
+    server.output = args.output
+    print('Mailgun stub listening on http://localhost:{}/v3'.format(args.port))
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+"""Compares the lxml parsers with the BeautifulSoup ones they replaced.
+
+    python tools/parser_bench.py --runs 200
+    python tools/parser_bench.py --main principal.html \\
+        --atividade atividade.html --discipline ferramentas.html
+
+Pages saved from AVA (view source, or response.content of the http scraper)
+are used when given, synthetic ones from tools/ava_pages.py otherwise. Both
+implementations must return the same result, which is checked before
+timing.
+"""
+
+import argparse
+import datetime
+import os
+import re
+import sys
+import time
+
+from bs4 import BeautifulSoup
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ava_pages  # noqa: E402
+from ava_rememberme.engine import parsers  # noqa: E402
+
+DATE_RE = re.compile(r'(\d+\/\d+\/\d+)+')
+DATE_PARTS_RE = re.compile(r'(\d+)+')
+ANY_RE = re.compile(r'.*')
+
+
+class LegacyParsers:
+    """BeautifulSoup implementation, as it was before the lxml rewrite."""
+
+    @staticmethod
+    def parseMaterias(html, userDisciplines=()):
+        soup = BeautifulSoup(html, "lxml")
+        return [{
+            'IDCurso': int(materia.get('idcurso')),
+            'CodCurso': materia.get('codigo'),
+            'Name': materia.select('span.md')[0].string
+        } for materia in soup.find_all("div", {"idcurso": ANY_RE})
+                if int(materia.get('idcurso')) not in userDisciplines]
+
+    @staticmethod
+    def parseQuestionarios(html):
+        soup = BeautifulSoup(html, "lxml")
+
+        questionariosList = []
+        for questionario in soup.find_all('div', class_='filtro-conteudo'):
+            datas = DATE_RE.findall(
+                questionario.select('div.bloco-data')[0].string)
+            day, month, year = DATE_PARTS_RE.findall(datas[1])
+            questionariosList.append({
+                'name': questionario.select('span.marginLeft10')[0].text,
+                'codigo': questionario.find("div",
+                                            {"codigo": ANY_RE})['codigo'],
+                'status': questionario.select('p.sm2.white')[0].text,
+                'days_left': datetime.datetime(
+                    int(year), int(month), int(day), 23, 59, 59),
+                'type': u'Questionário'
+            })
+        return questionariosList
+
+    @staticmethod
+    def hasAtividadeTab(html):
+        return BeautifulSoup(html, "lxml").find(id='aba-atividade') is not None
+
+
+def timeIt(function, page, runs):
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        function(page)
+        samples.append(time.perf_counter() - start)
+    samples.sort()
+    return samples[len(samples) // 2], samples[int(len(samples) * 0.99)]
+
+
+def read(path):
+    with open(path, 'rb') as page:
+        return page.read()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--main', help='captured principal.php')
+    parser.add_argument('--discipline', help='captured ferramentas page')
+    parser.add_argument('--atividade', help='captured atividade.php')
+    parser.add_argument('--disciplines', type=int, default=8)
+    parser.add_argument('--activities', type=int, default=20)
+    parser.add_argument('--padding', type=int, default=300,
+                        help='filler blocks around synthetic content')
+    parser.add_argument('--runs', type=int, default=100)
+    args = parser.parse_args()
+
+    pages = {
+        'parseMaterias': read(args.main) if args.main else ava_pages.mainPage(
+            ava_pages.sampleDisciplines(args.disciplines),
+            args.padding).encode('utf-8'),
+        'hasAtividadeTab':
+        read(args.discipline) if args.discipline else
+        ava_pages.disciplinePage('DISCIPLINA', True,
+                                 args.padding).encode('utf-8'),
+        'parseQuestionarios':
+        read(args.atividade) if args.atividade else ava_pages.atividadePage(
+            ava_pages.sampleActivities(args.activities),
+            args.padding).encode('utf-8'),
+    }
+
+    print('{:<20} {:>8} {:>12} {:>12} {:>12} {:>12} {:>8}'.format(
+        'parser', 'kB', 'bs4 p50 ms', 'bs4 p99 ms', 'lxml p50 ms',
+        'lxml p99 ms', 'speedup'))
+    for name, page in pages.items():
+        legacy, current = getattr(LegacyParsers, name), getattr(parsers, name)
+        if legacy(page) != current(page):
+            sys.exit('{} results differ'.format(name))
+
+        legacyP50, legacyP99 = timeIt(legacy, page, args.runs)
+        currentP50, currentP99 = timeIt(current, page, args.runs)
+        print('{:<20} {:>8.1f} {:>12.3f} {:>12.3f} {:>12.3f} {:>12.3f} '
+              '{:>7.1f}x'.format(name, len(page) / 1024, legacyP50 * 1000,
+                                 legacyP99 * 1000, currentP50 * 1000,
+                                 currentP99 * 1000, legacyP50 / currentP50))
+
+
+if __name__ == '__main__':
+    main()
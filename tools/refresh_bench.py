@@ -0,0 +1,247 @@
+"""Measures refresh throughput against tools/fake_ava.py.
+
+    python tools/fake_ava.py --users 200 --latency 0.1 &
+    python tools/refresh_bench.py scraper --backend http --concurrency 8
+    python tools/refresh_bench.py pipeline --seed --sweeps 2
+
+scraper runs login and getQuestionariosAll of every fake user, as a refresh
+does, with the http, selenium or async backend. pipeline runs the whole
+databaseRefreshAssignments task eagerly in this process, Redis and the
+database included, after --seed registered the fake users in the database
+configured for the app.
+
+Both report users/minute, p50 and p99 refresh time per user and peak memory:
+the Python heap peak from tracemalloc, and the process max RSS. Browsers run
+in their own processes, so with --backend selenium only the Python side is
+counted. With --backend async the time a user waits for a free slot of
+--concurrency is part of its refresh time.
+"""
+
+import argparse
+import json
+import os
+import resource
+import sys
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from urllib.request import urlopen
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def fetchUsers(fakeUrl, limit):
+    with urlopen(fakeUrl + '/fake/users') as response:
+        users = json.loads(response.read().decode('utf-8'))
+    return users[:limit] if limit else users
+
+
+def payloadsOf(users):
+    """Same payloads databaseRefreshAssignments builds, online disciplines
+    only.
+    """
+    return [{
+        'user_id': index,
+        'uninove_ra': user['uninove_ra'],
+        'uninove_senha': user['uninove_senha'],
+        'disciplines': [(idCurso, codCurso)
+                        for idCurso, codCurso, _, online in user['disciplines']
+                        if online]
+    } for index, user in enumerate(users)]
+
+
+class Timings:
+    """Per user refresh time, collected from any thread."""
+
+    def __init__(self):
+        self.samples = []
+        self.errors = 0
+        self.lock = threading.Lock()
+
+    def record(self, seconds, failed):
+        with self.lock:
+            self.samples.append(seconds)
+            self.errors += failed
+
+    def timed(self, function):
+        def wrapper(*args, **kwargs):
+            start = time.monotonic()
+            try:
+                result = function(*args, **kwargs)
+            except Exception:
+                self.record(time.monotonic() - start, True)
+                raise
+            self.record(time.monotonic() - start, False)
+            return result
+        return wrapper
+
+    def timedAsync(self, function):
+        async def wrapper(*args, **kwargs):
+            start = time.monotonic()
+            result = await function(*args, **kwargs)
+            self.record(time.monotonic() - start,
+                        result['error'] is not None)
+            return result
+        return wrapper
+
+
+def scrapeUser(backend, payload):
+    if backend == 'selenium':
+        from ava_rememberme.engine import AVAscraperFactory
+        scraper = AVAscraperFactory.getInstance(payload['uninove_ra'],
+                                                payload['uninove_senha'])
+    else:
+        from ava_rememberme.engine.http_scraper import AVAhttpScraper
+        scraper = AVAhttpScraper(payload['uninove_ra'],
+                                 payload['uninove_senha'])
+
+    with scraper:
+        scraper.loginAva()
+        return scraper.getQuestionariosAll(payload['disciplines'])
+
+
+def runScraper(args, payloads, timings):
+    if args.backend == 'async':
+        from ava_rememberme.engine import async_scraper
+        async_scraper._fetchUser = timings.timedAsync(async_scraper._fetchUser)
+        async_scraper.runFetchAssignments(
+            payloads, concurrency=args.concurrency)
+        return
+
+    if args.backend == 'selenium':
+        from ava_rememberme.engine import AVAscraperFactory
+        AVAscraperFactory.configure(maxInstances=args.concurrency)
+
+    scrape = timings.timed(scrapeUser)
+    with ThreadPoolExecutor(args.concurrency) as executor:
+        for future in [executor.submit(scrape, args.backend, payload)
+                       for payload in payloads]:
+            try:
+                future.result()
+            except Exception as e:
+                print('{}: {}'.format(type(e).__name__, getattr(e, 'msg', e)))
+
+    if args.backend == 'selenium':
+        AVAscraperFactory.closeAll()
+
+
+def seedDatabase(users):
+    """Registers fake users and their disciplines as active users, skipping
+    the ones already there.
+    """
+    from ava_rememberme.database import db_session
+    from ava_rememberme.database_models import Disciplines, Users
+
+    known = {ra for ra, in db_session.query(Users.uninove_ra)}
+    disciplines = {
+        discipline.idCurso: discipline
+        for discipline in Disciplines.query.all()
+    }
+
+    for user in users:
+        if user['uninove_ra'] in known:
+            continue
+        newUser = Users('{}@fake-ava.local'.format(user['uninove_ra']),
+                        'aluno {}'.format(user['uninove_ra']),
+                        user['uninove_ra'], user['uninove_senha'])
+        newUser.activate()
+        db_session.add(newUser)
+        db_session.flush()
+
+        for idCurso, codCurso, name, online in user['disciplines']:
+            if idCurso not in disciplines:
+                disciplines[idCurso] = Disciplines(newUser.user_id, name,
+                                                   online, idCurso,
+                                                   int(codCurso))
+            disciplines[idCurso].users.append(newUser)
+            db_session.add(disciplines[idCurso])
+
+    db_session.commit()
+
+
+def runPipeline(args, users, timings):
+    from ava_rememberme import celery, tasks
+    from ava_rememberme.engine import async_scraper
+
+    if args.seed:
+        seedDatabase(users)
+
+    celery.conf.task_always_eager = True
+    # the async engine has no backend choice
+    tasks.REFRESH_ENGINE = 'async' if args.backend == 'async' else args.engine
+    tasks.REFRESH_CONCURRENCY = args.concurrency
+    if args.backend != 'async':
+        tasks.SCRAPER_BACKEND = args.backend
+    tasks.DEBUG = False
+
+    # per user time, whichever engine runs the sweep
+    tasks._withScraper = timings.timed(tasks._withScraper)
+    async_scraper._fetchUser = timings.timedAsync(async_scraper._fetchUser)
+
+    for sweep in range(args.sweeps):
+        start = time.monotonic()
+        result = tasks.databaseRefreshAssignments.apply().get()
+        print('sweep {}: {} in {:.1f}s'.format(sweep + 1, result,
+                                               time.monotonic() - start))
+
+
+def quantile(samples, q):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('mode', choices=('scraper', 'pipeline'))
+    parser.add_argument('--ava-url', default='http://localhost:8030/seu/AVA')
+    parser.add_argument('--backend', default='http',
+                        choices=('http', 'selenium', 'async'))
+    parser.add_argument('--engine', default='chord',
+                        choices=('chord', 'async'),
+                        help='REFRESH_ENGINE of the pipeline, --backend '
+                        'async implies async')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--users', type=int, default=0,
+                        help='only the first users of the fake AVA')
+    parser.add_argument('--seed', action='store_true',
+                        help='register the fake users in the database')
+    parser.add_argument('--sweeps', type=int, default=1)
+    args = parser.parse_args()
+
+    # scrapers read it on import
+    os.environ['AVA_BASE_URL'] = args.ava_url
+    serverUrl = '/'.join(args.ava_url.split('/', 3)[:3])
+    users = fetchUsers(serverUrl, args.users)
+
+    timings = Timings()
+    tracemalloc.start()
+    start = time.monotonic()
+
+    if args.mode == 'scraper':
+        runScraper(args, payloadsOf(users), timings)
+    else:
+        runPipeline(args, users, timings)
+
+    elapsed = time.monotonic() - start
+    heapPeak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    if not timings.samples:
+        sys.exit('No user was refreshed.')
+
+    print('users refreshed     {} ({} failed)'.format(
+        len(timings.samples), timings.errors))
+    print('users/minute        {:.1f}'.format(
+        len(timings.samples) / elapsed * 60))
+    print('p50 per user        {:.3f}s'.format(
+        quantile(timings.samples, 0.5)))
+    print('p99 per user        {:.3f}s'.format(
+        quantile(timings.samples, 0.99)))
+    print('peak python heap    {:.1f} MB'.format(heapPeak / 2**20))
+    print('max RSS             {:.1f} MB'.format(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024))
+
+
+if __name__ == '__main__':
+    main()